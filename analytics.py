@@ -0,0 +1,67 @@
+# Файл: analytics.py
+# Этот модуль считает статистику посещаемости по work_log векторными операциями NumPy.
+
+import datetime
+from typing import Dict, List, Optional
+import numpy as np
+import database as db
+from config import CONFIG
+
+LATENESS_BINS_MINUTES = [0, 15, 30, 60]
+LATENESS_LABELS = ['вовремя', 'до 15 мин', '15-30 мин', '30-60 мин', 'более часа']
+OVERTIME_PERCENTILES = [50, 90, 95, 99]
+
+def load_work_intervals(user_ids: Optional[List[int]], start_date: datetime.date, end_date: datetime.date) -> Dict[str, np.ndarray]:
+    """Загружает интервалы работы из БД в колонки NumPy."""
+    rows = db.get_work_intervals(user_ids, start_date, end_date)
+    data = np.array(rows, dtype=np.int64).reshape(-1, 6)
+    return {
+        'user_id': data[:, 0],
+        'start_sod': data[:, 1],
+        'end_sod': data[:, 2],
+        'weekday': data[:, 3],
+        'work_seconds': data[:, 4],
+        'is_remote': data[:, 5],
+    }
+
+def compute_attendance_stats(columns: Dict[str, np.ndarray], workday_start_seconds: int = None,
+                             grace_seconds: int = None, norm_seconds: int = None) -> Dict:
+    """
+    Считает статистику по колонкам интервалов:
+    средние начало/конец по дням недели, распределение опозданий,
+    перцентили переработки и долю удаленной работы по сотрудникам.
+    """
+    if workday_start_seconds is None:
+        hour, minute = map(int, CONFIG.WORKDAY_START_TIME.split(':'))
+        workday_start_seconds = hour * 3600 + minute * 60
+    grace_seconds = CONFIG.LATENESS_GRACE_MINUTES * 60 if grace_seconds is None else grace_seconds
+    norm_seconds = CONFIG.MIN_WORK_SECONDS if norm_seconds is None else norm_seconds
+
+    count = len(columns['user_id'])
+    stats = {'count': count}
+    if count == 0:
+        return stats
+
+    weekday = columns['weekday']
+    day_counts = np.bincount(weekday, minlength=8)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['avg_start_by_weekday'] = np.bincount(weekday, weights=columns['start_sod'], minlength=8) / day_counts
+        stats['avg_end_by_weekday'] = np.bincount(weekday, weights=columns['end_sod'], minlength=8) / day_counts
+    stats['days_by_weekday'] = day_counts
+
+    late_seconds = columns['start_sod'] - workday_start_seconds
+    late_minutes = np.where(late_seconds > grace_seconds, late_seconds / 60.0, 0.0)
+    lateness_bucket = np.where(late_minutes > 0, np.digitize(late_minutes, LATENESS_BINS_MINUTES[1:], right=True) + 1, 0)
+    stats['lateness_distribution'] = np.bincount(lateness_bucket, minlength=len(LATENESS_LABELS))
+    stats['late_share'] = float(np.count_nonzero(late_minutes) / count)
+
+    overtime = columns['work_seconds'] - norm_seconds
+    stats['overtime_percentiles'] = dict(zip(OVERTIME_PERCENTILES, np.percentile(overtime, OVERTIME_PERCENTILES)))
+    stats['overtime_share'] = float(np.count_nonzero(overtime > 0) / count)
+
+    user_ids, user_index = np.unique(columns['user_id'], return_inverse=True)
+    days_per_user = np.bincount(user_index)
+    remote_per_user = np.bincount(user_index, weights=columns['is_remote'])
+    stats['remote_ratio_by_user'] = dict(zip(user_ids.tolist(), (remote_per_user / days_per_user).tolist()))
+    stats['days_by_user'] = dict(zip(user_ids.tolist(), days_per_user.tolist()))
+    return stats
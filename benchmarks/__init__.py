@@ -0,0 +1,18 @@
+# Пакет с бенчмарками горячих путей бота. Запуск: python -m benchmarks.<имя_модуля>
+
+import os
+import sys
+
+def configure_bench_database():
+    """
+    Направляет бота на отдельную базу из BENCH_DATABASE_URL и включает трассировку запросов.
+    Вызывается до импорта config/database, так как они читают окружение при импорте.
+    """
+    url = os.getenv('BENCH_DATABASE_URL')
+    if not url:
+        sys.exit("Укажите BENCH_DATABASE_URL: бенчмарки пересоздают таблицы и не должны работать с рабочей базой.")
+    if 'config' in sys.modules:
+        raise RuntimeError("configure_bench_database() нужно вызывать до импорта config")
+    os.environ['DATABASE_URL'] = url
+    os.environ['DB_TRACE_ENABLED'] = '1'
+    os.environ.setdefault('METRICS_ENABLED', '0')
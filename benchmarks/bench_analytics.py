@@ -0,0 +1,42 @@
+# Файл: benchmarks/bench_analytics.py
+# Бенчмарк аналитики посещаемости на синтетической организации с годом истории.
+# Запуск: python -m benchmarks.bench_analytics [--employees 2000] [--days 250]
+
+import argparse
+import time
+import numpy as np
+from analytics import compute_attendance_stats
+
+def generate_intervals(employees: int, days: int, seed: int = 42) -> dict:
+    """Генерирует детерминированные колонки интервалов: каждый сотрудник работает каждый рабочий день."""
+    rng = np.random.default_rng(seed)
+    count = employees * days
+    user_id = np.repeat(np.arange(1, employees + 1, dtype=np.int64), days)
+    weekday = np.tile(np.arange(days, dtype=np.int64) % 5 + 1, employees)
+    start_sod = (9 * 3600 + rng.normal(0, 20 * 60, count)).astype(np.int64)
+    work_seconds = (8 * 3600 + rng.normal(0, 45 * 60, count)).astype(np.int64)
+    end_sod = np.minimum(start_sod + work_seconds + 3600, 24 * 3600 - 1)
+    is_remote = (rng.random(count) < 0.2).astype(np.int64)
+    return {'user_id': user_id, 'start_sod': start_sod, 'end_sod': end_sod, 'weekday': weekday,
+            'work_seconds': work_seconds, 'is_remote': is_remote}
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк analytics.compute_attendance_stats")
+    parser.add_argument('--employees', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=250, help="Рабочих дней истории (год ~ 250)")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    columns = generate_intervals(args.employees, args.days)
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        compute_attendance_stats(columns, workday_start_seconds=9 * 3600, grace_seconds=300, norm_seconds=8 * 3600)
+        timings.append(time.perf_counter() - started)
+    rows = len(columns['user_id'])
+    best = min(timings)
+    print(f"Интервалов: {rows}, лучшее время: {best * 1000:.1f} мс, медиана: {np.median(timings) * 1000:.1f} мс, "
+          f"{rows / best / 1e6:.1f} млн строк/с")
+
+if __name__ == '__main__':
+    main()
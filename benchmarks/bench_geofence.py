@@ -0,0 +1,80 @@
+# Файл: benchmarks/bench_geofence.py
+# Бенчмарк поиска офиса по геолокации: тысячи офисов и утренний наплыв отметок.
+# Запуск: python -m benchmarks.bench_geofence [--offices 5000] [--checkins 100000]
+
+import argparse
+import random
+import statistics
+import time
+from geofence import GeofenceIndex, haversine_m
+
+# Города, вокруг которых "разбросаны" офисы: широта, долгота
+CITY_CENTERS = [(55.7558, 37.6173), (59.9343, 30.3351), (55.0084, 82.9357), (53.3474, 83.7784),
+                (56.8389, 60.6057), (55.7963, 49.1088), (43.5855, 39.7231), (43.1155, 131.8855)]
+
+def generate_offices(count: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    offices = []
+    for office_id in range(1, count + 1):
+        lat, lon = rng.choice(CITY_CENTERS)
+        offices.append({'office_id': office_id, 'name': f"Офис {office_id}",
+                        'latitude': lat + rng.uniform(-0.3, 0.3), 'longitude': lon + rng.uniform(-0.5, 0.5),
+                        'radius_meters': rng.choice([100, 200, 300, 500, 1500])})
+    return offices
+
+def generate_checkins(offices: list, count: int, seed: int = 7) -> list:
+    """Точки отметок: большинство рядом с офисом, часть - далеко от всех офисов."""
+    rng = random.Random(seed)
+    points = []
+    for _ in range(count):
+        office = rng.choice(offices)
+        spread = office['radius_meters'] / 111320 * (0.7 if rng.random() < 0.8 else 5)
+        points.append((office['latitude'] + rng.uniform(-spread, spread), office['longitude'] + rng.uniform(-spread, spread)))
+    return points
+
+def linear_match(offices: list, lat: float, lon: float):
+    """Прежний подход: точное расстояние до каждого офиса."""
+    best = None
+    for office in offices:
+        distance = haversine_m(office['latitude'], office['longitude'], lat, lon)
+        if distance <= office['radius_meters'] and (best is None or distance < best[1]):
+            best = (office, distance)
+    return best
+
+def run(name: str, match, points: list) -> list:
+    latencies = []
+    started = time.perf_counter()
+    results = []
+    for lat, lon in points:
+        call_started = time.perf_counter()
+        results.append(match(lat, lon))
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<8} {len(points) / elapsed:>12,.0f} отметок/с  p50 {statistics.median(latencies) * 1e6:7.1f} мкс  p99 {p99 * 1e6:7.1f} мкс")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк geofence.GeofenceIndex")
+    parser.add_argument('--offices', type=int, default=5000)
+    parser.add_argument('--checkins', type=int, default=100000, help="Отметок в утреннем наплыве")
+    parser.add_argument('--linear-sample', type=int, default=2000, help="Сколько отметок прогнать через линейный поиск")
+    args = parser.parse_args()
+
+    offices = generate_offices(args.offices)
+    points = generate_checkins(offices, args.checkins)
+    index = GeofenceIndex()
+    started = time.perf_counter()
+    index.build(offices)
+    print(f"Офисов: {len(index)}, построение индекса: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    indexed = run('индекс', index.match, points)
+    sample = points[:args.linear_sample]
+    linear = run('перебор', lambda lat, lon: linear_match(offices, lat, lon), sample)
+    mismatches = sum(1 for a, b in zip(indexed, linear) if (a and a[0]['office_id']) != (b and b[0]['office_id']))
+    matched = sum(1 for result in indexed if result)
+    print(f"Совпало с офисом: {matched / len(points):.1%}, расхождений с перебором: {mismatches}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Файл: benchmarks/datagen.py
+# Детерминированный генератор синтетической организации для бенчмарков.
+# Запуск: BENCH_DATABASE_URL=postgresql://... python -m benchmarks.datagen --reset [--employees 1000] [--managers 50] [--months 3]
+
+import argparse
+import datetime
+import json
+import random
+from typing import Dict, List
+
+from benchmarks import configure_bench_database
+
+EMPLOYEE_ID_BASE = 10_000_000   # Синтетические ID не пересекаются с настоящими Telegram ID
+MANAGER_ID_BASE = 9_000_000
+DIRECTOR_ID = 8_999_999
+
+FIRST_NAMES = ['Иван', 'Петр', 'Анна', 'Мария', 'Олег', 'Елена', 'Сергей', 'Ольга', 'Дмитрий', 'Наталья', 'Алексей', 'Татьяна']
+LAST_NAMES = ['Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков', 'Морозов', 'Волков', 'Федоров']
+ABSENCE_TYPES = ['Отпуск', 'Больничный', 'Командировка']
+
+def _full_name(rng: random.Random, index: int) -> str:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    if first.endswith('а') and not last.endswith('а'):
+        last += 'а'
+    return f"{last} {first} {index}"
+
+def _workdays(start_date: datetime.date, end_date: datetime.date) -> List[datetime.date]:
+    days, day = [], start_date
+    while day <= end_date:
+        if day.weekday() < 5:
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+def build_org(employees: int, managers: int, months: int, seed: int = 42, today: datetime.date = None) -> Dict:
+    """
+    Строит описание организации в памяти: директор, managers руководителей (у каждого команда)
+    и employees сотрудников с историей за months месяцев до today.
+    Одинаковые аргументы всегда дают одинаковые данные.
+    """
+    from config import LOCAL_TZ
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    history_start = (today.replace(day=1) - datetime.timedelta(days=31 * (months - 1))).replace(day=1)
+
+    users = [(DIRECTOR_ID, 'Директор Синтетический', 'manager', None, None)]
+    manager_ids = [MANAGER_ID_BASE + i for i in range(managers)]
+    for i, manager_id in enumerate(manager_ids):
+        users.append((manager_id, _full_name(rng, i), 'manager', DIRECTOR_ID, None))
+    employee_ids = [EMPLOYEE_ID_BASE + i for i in range(employees)]
+    for i, employee_id in enumerate(employee_ids):
+        manager_1 = manager_ids[i % managers]
+        manager_2 = rng.choice(manager_ids) if rng.random() < 0.1 else None
+        users.append((employee_id, _full_name(rng, i), 'employee', manager_1, manager_2 if manager_2 != manager_1 else None))
+
+    work_log, debt_log, work_debt, absences, requests = [], [], [], [], []
+    days = _workdays(history_start, today - datetime.timedelta(days=1))
+    for employee_id in employee_ids:
+        absent_until = None
+        for day in days:
+            if absent_until and day <= absent_until:
+                continue
+            if rng.random() < 0.004:
+                length = rng.randint(1, 10)
+                absent_until = day + datetime.timedelta(days=length)
+                absences.append((employee_id, rng.choice(ABSENCE_TYPES), day, absent_until))
+                continue
+            start = LOCAL_TZ.localize(datetime.datetime.combine(day, datetime.time(9)) + datetime.timedelta(seconds=int(rng.gauss(0, 1200))))
+            break_seconds = rng.randint(0, 3600)
+            work_seconds = max(3600, int(rng.gauss(8 * 3600, 2700)))
+            end = start + datetime.timedelta(seconds=work_seconds + break_seconds)
+            work_type = 'remote' if rng.random() < 0.2 else 'office'
+            work_log.append((employee_id, start, end, work_seconds, break_seconds, work_type))
+            if work_seconds < 7 * 3600 and rng.random() < 0.5:
+                work_debt.append((employee_id, 8 * 3600 - work_seconds, day, 'pending' if rng.random() < 0.3 else 'cleared'))
+            if rng.random() < 0.03:
+                debt_start = end + datetime.timedelta(minutes=10)
+                cleared = rng.randint(900, 3600)
+                debt_log.append((employee_id, debt_start, debt_start + datetime.timedelta(seconds=cleared), cleared))
+            if rng.random() < 0.02:
+                status = rng.choice(['pending', 'approved', 'approved', 'denied'])
+                request_type = rng.choice(['Удаленная работа', 'Отгул'])
+                requests.append((employee_id, request_type, json.dumps({'date': str(day + datetime.timedelta(days=7))}), status))
+
+    return {
+        'users': users, 'work_log': work_log, 'debt_log': debt_log, 'work_debt': work_debt,
+        'absences': absences, 'requests': requests,
+        'director_id': DIRECTOR_ID, 'manager_ids': manager_ids, 'employee_ids': employee_ids,
+        'history_start': history_start, 'today': today,
+    }
+
+def load_org(org: Dict, reset: bool = False):
+    """Загружает организацию в базу пачками (execute_values) и перестраивает иерархию подчинения."""
+    from psycopg2.extras import execute_values
+    import database as db
+
+    db.init_db(drop_existing=reset)
+    with db.db_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_values(cursor, "INSERT INTO users (user_id, full_name, role, manager_id_1, manager_id_2) VALUES %s ON CONFLICT (user_id) DO NOTHING", org['users'], page_size=1000)
+            execute_values(cursor, "INSERT INTO work_log (user_id, start_time, end_time, total_work_seconds, total_break_seconds, work_type) VALUES %s", org['work_log'], page_size=5000)
+            execute_values(cursor, "INSERT INTO debt_log (user_id, start_time, end_time, cleared_seconds) VALUES %s", org['debt_log'], page_size=5000)
+            execute_values(cursor, "INSERT INTO work_debt (user_id, debt_seconds, date_incurred, status) VALUES %s", org['work_debt'], page_size=5000)
+            execute_values(cursor, "INSERT INTO absences (user_id, absence_type, start_date, end_date) VALUES %s", org['absences'], page_size=5000)
+            execute_values(cursor, "INSERT INTO requests (requester_id, request_type, request_data, status) VALUES %s", org['requests'], page_size=5000)
+            cursor.execute("ANALYZE")
+    db.rebuild_user_hierarchy()
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетической организации в BENCH_DATABASE_URL")
+    parser.add_argument('--employees', type=int, default=1000)
+    parser.add_argument('--managers', type=int, default=50)
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help="Удалить и пересоздать все таблицы бота в этой базе")
+    args = parser.parse_args()
+
+    configure_bench_database()
+    org = build_org(args.employees, args.managers, args.months, seed=args.seed)
+    load_org(org, reset=args.reset)
+    print(f"Загружено: сотрудников {len(org['employee_ids'])}, руководителей {len(org['manager_ids'])}, "
+          f"work_log {len(org['work_log'])}, debt_log {len(org['debt_log'])}, absences {len(org['absences'])}, requests {len(org['requests'])}")
+
+if __name__ == '__main__':
+    main()
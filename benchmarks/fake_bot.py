@@ -0,0 +1,95 @@
+# Файл: benchmarks/fake_bot.py
+# Поддельные объекты Telegram для бенчмарков: вызовы API не уходят в сеть, а записываются.
+
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional
+
+class FakeMessage:
+    def __init__(self, bot: 'FakeBot', chat_id: int, text: str = None, message_id: int = None, document=None, location=None):
+        self._bot = bot
+        self.chat_id = chat_id
+        self.text = text
+        self.message_id = message_id or next(bot.message_ids)
+        self.document = document
+        self.location = location
+
+    async def reply_text(self, text: str, **kwargs):
+        return await self._bot.send_message(self.chat_id, text, **kwargs)
+
+    async def delete(self):
+        return await self._bot.delete_message(self.chat_id, self.message_id)
+
+class FakeFile:
+    def __init__(self, content: bytes):
+        self._content = content
+
+    async def download_as_bytearray(self) -> bytearray:
+        return bytearray(self._content)
+
+class FakeDocument:
+    def __init__(self, file_name: str, file_id: str):
+        self.file_name = file_name
+        self.file_id = file_id
+
+class FakeBot:
+    """
+    Бот, который запоминает вызовы API (метод и аргументы) и отвечает с задержкой api_delay,
+    имитируя сетевую задержку Bot API.
+    """
+
+    def __init__(self, api_delay: float = 0.0):
+        self.api_delay = api_delay
+        self.calls: List[Dict[str, Any]] = []
+        self.files: Dict[str, bytes] = {}
+        self.message_ids = itertools.count(1)
+
+    async def _call(self, method: str, **kwargs):
+        self.calls.append({'method': method, **kwargs})
+        if self.api_delay:
+            await asyncio.sleep(self.api_delay)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> FakeMessage:
+        await self._call('sendMessage', chat_id=chat_id, text=text, **kwargs)
+        return FakeMessage(self, chat_id, text)
+
+    async def edit_message_text(self, text: str, chat_id: int = None, message_id: int = None, **kwargs):
+        await self._call('editMessageText', chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+        return True
+
+    async def delete_message(self, chat_id: int, message_id: int):
+        await self._call('deleteMessage', chat_id=chat_id, message_id=message_id)
+        return True
+
+    async def send_document(self, chat_id: int, document, **kwargs):
+        await self._call('sendDocument', chat_id=chat_id, **kwargs)
+        return FakeMessage(self, chat_id)
+
+    async def get_file(self, file_id: str) -> FakeFile:
+        await self._call('getFile', file_id=file_id)
+        return FakeFile(self.files[file_id])
+
+    def count(self, method: Optional[str] = None) -> int:
+        return len(self.calls) if method is None else sum(1 for call in self.calls if call['method'] == method)
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+class FakeUpdate:
+    """Минимальный Update с сообщением: effective_user, effective_chat, message, effective_message."""
+
+    def __init__(self, bot: FakeBot, user_id: int, text: str = None, document: FakeDocument = None):
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = FakeUser(user_id)
+        self.message = FakeMessage(bot, user_id, text, document=document)
+        self.effective_message = self.message
+        self.callback_query = None
+
+class FakeContext:
+    def __init__(self, bot: FakeBot, args: List[str] = None):
+        self.bot = bot
+        self.args = args or []
+        self.user_data: Dict[str, Any] = {}
+        self.chat_data: Dict[str, Any] = {}
+        self.bot_data: Dict[str, Any] = {}
@@ -0,0 +1,218 @@
+# Файл: benchmarks/load_replay.py
+# Нагрузочный тест: реалистичные Update прогоняются через настоящие обработчики из bot.py,
+# а бот-заглушка записывает вызовы Bot API и имитирует их задержку.
+# Запуск: BENCH_DATABASE_URL=postgresql://... python -m benchmarks.load_replay [--load --reset] [--users 2000] [--concurrency 200]
+
+import argparse
+import asyncio
+import collections
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from benchmarks import configure_bench_database
+from benchmarks.run import percentile
+
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'sendDocument', 'editMessageReplyMarkup'}
+
+def make_stub_bot_class():
+    """Класс бота-заглушки; создается функцией, чтобы telegram импортировался после настройки окружения."""
+    from telegram.ext import ExtBot
+
+    class StubBot(ExtBot):
+        """ExtBot, у которого сетевой вызов заменен записью метода и паузой api_delay."""
+
+        def __init__(self, api_delay: float = 0.0):
+            super().__init__(token='123456:LOAD-TEST')
+            self.api_delay = api_delay
+            self.api_calls = collections.Counter()
+            self._message_ids = itertools.count(1_000_000)
+
+        async def _do_post(self, endpoint: str, data, *args, **kwargs):
+            self.api_calls[endpoint] += 1
+            if self.api_delay:
+                await asyncio.sleep(self.api_delay)
+            if endpoint == 'getMe':
+                return {'id': 123456, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'load_test_bot',
+                        'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+            if endpoint in MESSAGE_METHODS:
+                chat_id = int(data.get('chat_id') or 0)
+                return {'message_id': int(data.get('message_id') or next(self._message_ids)), 'date': int(time.time()),
+                        'chat': {'id': chat_id, 'type': 'private'}, 'text': data.get('text') or ''}
+            return True
+
+    return StubBot
+
+class UpdateFactory:
+    """Строит настоящие telegram.Update из словарей в формате Bot API."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int) -> Dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"U{user_id}"}
+
+    def _message(self, user_id: int, **fields) -> Dict:
+        return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id), **fields}
+
+    def _build(self, payload: Dict):
+        from telegram import Update
+        return Update.de_json({'update_id': next(self._update_ids), **payload}, self.bot)
+
+    def command(self, user_id: int, text: str):
+        command_length = len(text.split()[0])
+        return self._build({'message': self._message(user_id, text=text, entities=[{'type': 'bot_command', 'offset': 0, 'length': command_length}])})
+
+    def location(self, user_id: int, latitude: float, longitude: float):
+        return self._build({'message': self._message(user_id, location={'latitude': latitude, 'longitude': longitude})})
+
+    def callback(self, user_id: int, data: str):
+        menu_message = self._message(user_id, text='menu')
+        menu_message['from'] = {'id': 123456, 'is_bot': True, 'first_name': 'LoadTest'}
+        return self._build({'callback_query': {'id': str(next(self._update_ids)), 'from': self._user(user_id),
+                                               'chat_instance': str(user_id), 'data': data, 'message': menu_message}})
+
+def user_script(factory: UpdateFactory, user_id: int, rng: random.Random, office: Dict, remote_share: float) -> List[Tuple[str, object]]:
+    """Утро сотрудника: /start, начало дня (офис по геолокации или удаленно), перерыв, уход, отчет."""
+    steps = [('start', lambda: factory.command(user_id, '/start'))]
+    if rng.random() < remote_share or office is None:
+        steps.append(('start_work', lambda: factory.callback(user_id, 'start_work_remote')))
+    else:
+        jitter = office['radius_meters'] / 111320 * 0.5
+        latitude, longitude = office['latitude'] + rng.uniform(-jitter, jitter), office['longitude'] + rng.uniform(-jitter, jitter)
+        steps.append(('location_prompt', lambda: factory.callback(user_id, 'start_work_office_location')))
+        steps.append(('start_work', lambda: factory.location(user_id, latitude, longitude)))
+    steps += [
+        ('start_break', lambda: factory.callback(user_id, 'start_break')),
+        ('end_break', lambda: factory.callback(user_id, 'end_break')),
+        ('end_work', lambda: factory.callback(user_id, 'end_work')),
+        ('end_work_ask_manager', lambda: factory.callback(user_id, 'end_work_ask_manager')),
+        ('report_menu', lambda: factory.callback(user_id, 'request_report')),
+        ('report_today', lambda: factory.callback(user_id, 'report_today_employee')),
+    ]
+    return steps
+
+class ConnectionSampler(threading.Thread):
+    """Раз в interval секунд считает соединения к базе бенчмарка через pg_stat_activity."""
+
+    def __init__(self, dsn: str, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.dsn = dsn
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        import psycopg2
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                while not self._stop_event.wait(self.interval):
+                    cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()")
+                    self.samples.append(cursor.fetchone()[0])
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+async def replay(application, factory: UpdateFactory, user_ids: List[int], concurrency: int, office: Dict, remote_share: float, seed: int):
+    latencies: Dict[str, List[float]] = collections.defaultdict(list)
+    semaphore = asyncio.Semaphore(concurrency)
+    rng = random.Random(seed)
+    scripts = {user_id: user_script(factory, user_id, rng, office, remote_share) for user_id in user_ids}
+
+    async def run_user(user_id: int):
+        async with semaphore:
+            for kind, build in scripts[user_id]:
+                update = build()
+                started = time.perf_counter()
+                await application.process_update(update)
+                latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user_id) for user_id in user_ids))
+    return latencies, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон Update через обработчики бота")
+    parser.add_argument('--users', type=int, default=2000, help="Сколько сотрудников отмечаются")
+    parser.add_argument('--concurrency', type=int, default=100, help="Сколько сотрудников действуют одновременно")
+    parser.add_argument('--api-delay', type=float, default=0.05, help="Имитация задержки Bot API, с")
+    parser.add_argument('--remote-share', type=float, default=0.3)
+    parser.add_argument('--managers', type=int, default=50)
+    parser.add_argument('--months', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--load', action='store_true', help="Сгенерировать и загрузить организацию")
+    parser.add_argument('--reset', action='store_true', help="Вместе с --load: пересоздать таблицы")
+    args = parser.parse_args()
+
+    configure_bench_database()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    import database as db
+    from config import CONFIG
+    from benchmarks.datagen import build_org, load_org
+    from bot import prepare_runtime, build_application
+    from report_jobs import report_jobs
+
+    org = build_org(args.users, args.managers, args.months, seed=args.seed)
+    if args.load:
+        load_org(org, reset=args.reset)
+    prepare_runtime()
+    user_ids = org['employee_ids'][:args.users]
+    with db.db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM work_sessions WHERE user_id = ANY(%s)", (user_ids,))
+    # Как при обычном старте (post_init): пул, подготовленные запросы и кэш сессий
+    db.warm_up()
+    offices = db.get_offices()
+
+    bot = make_stub_bot_class()(api_delay=args.api_delay)
+    application = build_application(bot=bot)
+    errors = collections.Counter()
+
+    async def count_errors(update, context):
+        errors[type(context.error).__name__] += 1
+    application.add_error_handler(count_errors)
+
+    async def run():
+        await application.initialize()
+        sampler = ConnectionSampler(CONFIG.DATABASE_URL)
+        sampler.start()
+        try:
+            latencies, elapsed = await replay(application, UpdateFactory(bot), user_ids, args.concurrency,
+                                              offices[0] if offices else None, args.remote_share, args.seed)
+            # Отчеты строятся в фоне: дожидаемся их, чтобы не оборвать работу пула
+            while report_jobs.in_flight:
+                await asyncio.sleep(0.05)
+        finally:
+            sampler.stop()
+            await application.shutdown()
+        return latencies, elapsed, sampler.samples
+
+    latencies, elapsed, connection_samples = asyncio.run(run())
+    total = sum(len(values) for values in latencies.values())
+    print(f"Пользователей: {len(user_ids)}, одновременно: {args.concurrency}, задержка API: {args.api_delay * 1000:.0f} мс")
+    print(f"Обновлений: {total} за {elapsed:.1f} с -> {total / elapsed:.1f} обновлений/с, "
+          f"начало дня: {len(latencies['start_work']) / elapsed:.1f} отметок/с")
+    print(f"{'шаг':<22} {'кол-во':>7} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+    for kind, values in latencies.items():
+        values.sort()
+        print(f"{kind:<22} {len(values):>7} {percentile(values, 0.5) * 1000:>9.1f} {percentile(values, 0.95) * 1000:>9.1f} {percentile(values, 0.99) * 1000:>9.1f}")
+    if connection_samples:
+        print(f"Соединения с БД: максимум {max(connection_samples)}, в среднем {sum(connection_samples) / len(connection_samples):.1f}")
+    print(f"Вызовы Bot API: {dict(bot.api_calls)}")
+    if errors:
+        print(f"Ошибки обработчиков: {dict(errors)}")
+
+if __name__ == '__main__':
+    main()
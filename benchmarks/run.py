@@ -0,0 +1,117 @@
+# Файл: benchmarks/run.py
+# Запуск сценариев бенчмарка с сохранением результатов и сравнением с прошлым прогоном.
+# Запуск: BENCH_DATABASE_URL=postgresql://... python -m benchmarks.run [--load --reset] [--iterations 200] [--compare benchmarks/results/<файл>.json]
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List
+
+from benchmarks import configure_bench_database
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+def percentile(ordered: List[float], share: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+async def run_scenario(scenario, iterations: int, warmup: int) -> Dict:
+    """Прогоняет сценарий последовательно; время и число SQL-запросов считаются только для run()."""
+    from db_tracing import query_tracer
+    for i in range(warmup):
+        if scenario.prepare:
+            scenario.prepare(i)
+        await scenario.run(i)
+
+    timings, queries = [], 0
+    for i in range(warmup, warmup + iterations):
+        if scenario.prepare:
+            scenario.prepare(i)
+        statements_before = query_tracer.total_statements
+        started = time.perf_counter()
+        await scenario.run(i)
+        timings.append(time.perf_counter() - started)
+        queries += query_tracer.total_statements - statements_before
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'queries_per_op': queries / iterations,
+    }
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_results(results: Dict[str, Dict], baseline: Dict[str, Dict] = None):
+    header = f"{'сценарий':<16} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'запросов':>9}"
+    print(header + ('   Δp50     Δp95' if baseline else ''))
+    for name, row in results.items():
+        line = f"{name:<16} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['queries_per_op']:>9.1f}"
+        base = (baseline or {}).get(name)
+        if base:
+            delta = lambda key: (row[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+            line += f"  {delta('p50_ms'):+6.1f}%  {delta('p95_ms'):+6.1f}%"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк горячих путей бота на синтетической организации")
+    parser.add_argument('--employees', type=int, default=1000)
+    parser.add_argument('--managers', type=int, default=50)
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--load', action='store_true', help="Сгенерировать и загрузить организацию перед прогоном")
+    parser.add_argument('--reset', action='store_true', help="Вместе с --load: пересоздать таблицы")
+    parser.add_argument('--scenarios', default='', help="Через запятую; по умолчанию все")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--warm-cache', action='store_true', help="Не сбрасывать кэш отчетов между итерациями")
+    parser.add_argument('--compare', help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    configure_bench_database()
+    from benchmarks.datagen import build_org, load_org
+    from benchmarks.scenarios import build_scenarios
+
+    org = build_org(args.employees, args.managers, args.months, seed=args.seed)
+    if args.load:
+        load_org(org, reset=args.reset)
+    scenarios = build_scenarios(org, warm_cache=args.warm_cache)
+    selected = [name.strip() for name in args.scenarios.split(',') if name.strip()] or list(scenarios)
+
+    async def run_all():
+        return {name: await run_scenario(scenarios[name], args.iterations, args.warmup) for name in selected}
+    results = asyncio.run(run_all())
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(RESULTS_DIR, f"{stamp}_{_git_revision()}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'revision': _git_revision(), 'created_at': stamp, 'python': platform.python_version(),
+                'org': {'employees': args.employees, 'managers': args.managers, 'months': args.months, 'seed': args.seed},
+                'warm_cache': args.warm_cache, 'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Файл: benchmarks/scenarios.py
+# Сценарии бенчмарка: каждый замеряет одну операцию горячего пути на синтетической организации.
+
+import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from benchmarks.fake_bot import FakeBot, FakeContext, FakeDocument, FakeUpdate
+
+class Scenario:
+    """
+    Сценарий: prepare(i) готовит данные для i-й итерации и в замер не входит,
+    run(i) - сама замеряемая операция.
+    """
+
+    def __init__(self, name: str, run: Callable[[int], Awaitable], prepare: Optional[Callable[[int], None]] = None):
+        self.name = name
+        self.run = run
+        self.prepare = prepare
+
+def _previous_month(today: datetime.date):
+    end_date = today.replace(day=1) - datetime.timedelta(days=1)
+    return end_date.replace(day=1), end_date
+
+def build_scenarios(org: Dict, warm_cache: bool = False, csv_rows: int = 100) -> Dict[str, Scenario]:
+    """Создает сценарии для организации, описанной benchmarks.datagen.build_org."""
+    from menu_generator import MenuGenerator
+    from report_cache import report_cache
+    from report_generator import ReportGenerator
+    from utils import end_workday_logic, get_now
+    import database as db
+
+    managers, employees = org['manager_ids'], org['employee_ids']
+    start_date, end_date = _previous_month(org['today'])
+    bot = FakeBot()
+
+    def reset_cache(i: int):
+        if not warm_cache:
+            report_cache.clear()
+
+    async def team_status(i: int):
+        return await ReportGenerator.get_team_status_text(managers[i % len(managers)])
+
+    async def manager_report(i: int):
+        return await ReportGenerator.get_manager_report_text(managers[i % len(managers)], start_date, end_date)
+
+    async def employee_report(i: int):
+        return await ReportGenerator.get_employee_report_text(employees[i % len(employees)], start_date, end_date)
+
+    async def main_menu(i: int):
+        return await MenuGenerator.get_main_menu(employees[i % len(employees)])
+
+    def open_session(i: int):
+        started = get_now() - datetime.timedelta(hours=8, minutes=30)
+        db.set_session_state(employees[i % len(employees)], {'status': 'working', 'start_time': started, 'total_break_seconds': 1800, 'is_remote': False})
+
+    async def end_workday(i: int):
+        await end_workday_logic(FakeContext(bot), employees[i % len(employees)])
+
+    # CSV-импорт обновляет уже существующих сотрудников: так каждая итерация делает одинаковую работу
+    csv_lines = ["user_id,full_name,role,manager_1,manager_2"]
+    users_by_id = {user[0]: user for user in org['users']}
+    for employee_id in employees[:csv_rows]:
+        _, full_name, role, manager_1, manager_2 = users_by_id[employee_id]
+        csv_lines.append(f"{employee_id},{full_name},{role},{manager_1 or ''},{manager_2 or ''}")
+    bot.files['bench_users_csv'] = ("\n".join(csv_lines) + "\n").encode('utf-8')
+
+    async def csv_import(i: int):
+        from conversation_handlers import process_users_file
+        update = FakeUpdate(bot, org['director_id'], document=FakeDocument('users.csv', 'bench_users_csv'))
+        await process_users_file(update, FakeContext(bot))
+
+    return {scenario.name: scenario for scenario in [
+        Scenario('team_status', team_status),
+        Scenario('manager_report', manager_report, reset_cache),
+        Scenario('employee_report', employee_report, reset_cache),
+        Scenario('main_menu', main_menu),
+        Scenario('end_workday', end_workday, open_session),
+        Scenario('csv_import', csv_import),
+    ]}
@@ -1,26 +1,88 @@
 # Файл: bot.py
+import time
+PROCESS_STARTED = time.monotonic()  # Отсчет времени до готовности - до импорта тяжелых модулей
+
+import asyncio
 import logging
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram import Update
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, TypeHandler
 import database as db
 from config import CONFIG
 from command_handlers import CommandHandlerManager
 from callback_handlers import callback_manager
+from jobs import register_jobs
+from user_search import user_search_index
+from geofence import geofence_index
+from logging_setup import setup_logging
+from metrics import metrics, instrument_handlers, instrumented_request_class, start_metrics_server
+from report_cache import report_cache
+from report_jobs import report_jobs
+from state_cache import state_cache
+from work_calendar import work_calendar
+from callback_dedup import drop_duplicate_callbacks
+from rate_limit import buckets, throttle_updates
+from persistence import PostgresPersistence
 from conversation_handlers import (absence_conv_handler, report_conv_handler, location_conv_handler, upload_users_conv_handler)
 
-logging.basicConfig(level=CONFIG.LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', handlers=[logging.FileHandler(CONFIG.LOG_FILE_PATH), logging.StreamHandler()])
 logger = logging.getLogger(__name__)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Произошла ошибка при обработке обновления:", exc_info=context.error)
 
-def main() -> None:
+async def post_init(application: Application) -> None:
+    """
+    Прогревает пул соединений и кэши до приема первых обновлений, затем запускает эндпоинт метрик
+    и регистрирует показатели, которые читаются в момент запроса.
+    """
+    warmed = await asyncio.to_thread(db.warm_up)
+    logger.info("Прогрев завершен: соединений %s, активных сессий %s, пользователей %s.",
+                warmed['connections'], warmed['sessions'], warmed['users'])
+    if CONFIG.METRICS_ENABLED:
+        metrics.gauge('bot_state_cache_entries', lambda: state_cache.stats()['sessions'] + state_cache.stats()['users'], 'Записей в кэше сессий и пользователей')
+        metrics.gauge('bot_active_sessions', db.count_active_sessions, 'Активные рабочие сессии')
+        metrics.gauge('bot_report_jobs_in_flight', lambda: report_jobs.in_flight, 'Отчеты в очереди фонового построения')
+        metrics.gauge('bot_update_queue_size', lambda: application.update_queue.qsize(), 'Необработанные обновления в очереди PTB')
+        metrics.gauge('bot_report_cache_entries', lambda: report_cache.stats()['entries'], 'Записей в кэше отчетов')
+        metrics.gauge('bot_rate_limit_buckets', lambda: len(buckets), 'Пользователей с активной корзиной ограничения частоты')
+        application.bot_data['metrics_server'] = await start_metrics_server(CONFIG.METRICS_HOST, CONFIG.METRICS_PORT)
+    logger.info("Бот готов к работе через %.2f с после старта процесса.", time.monotonic() - PROCESS_STARTED)
+
+async def post_shutdown(application: Application) -> None:
+    report_jobs.shutdown()
+    server = application.bot_data.pop('metrics_server', None)
+    if server:
+        server.close()
+        await server.wait_closed()
+
+def prepare_runtime() -> None:
+    """Готовит базу данных и индексы в памяти, которые нужны обработчикам."""
     logger.info("Инициализация базы данных...")
     db.init_db()
     logger.info("База данных успешно инициализирована.")
-    if not CONFIG.TELEGRAM_BOT_TOKEN:
-        logger.critical("КРИТИЧЕСКАЯ ОШИБКА: Токен Telegram не найден! Проверьте файл .env")
-        return
-    application = Application.builder().token(CONFIG.TELEGRAM_BOT_TOKEN).build()
+    user_search_index.build(db.get_all_users())
+    logger.info("Индекс поиска сотрудников построен: %s записей.", len(user_search_index))
+    geofence_index.build(db.get_offices())
+    logger.info("Индекс офисов построен: %s офисов.", len(geofence_index))
+    work_calendar.load(CONFIG.WORK_CALENDAR_PATH)
+
+def build_application(bot=None, with_jobs: bool = True) -> Application:
+    """
+    Собирает приложение со всеми обработчиками и задачами.
+    bot - готовый объект бота вместо создания по токену (например, заглушка для нагрузочного теста).
+    with_jobs=False - без задач по расписанию (рабочие процессы, кроме первого, см. sharding.py).
+    """
+    builder = Application.builder().post_init(post_init).post_shutdown(post_shutdown)
+    # Состояния диалогов и user_data переживают перезапуск (см. persistence.py)
+    builder = builder.persistence(PostgresPersistence(CONFIG.PERSISTENCE_UPDATE_INTERVAL_SECONDS))
+    if bot is not None:
+        builder = builder.bot(bot)
+    else:
+        builder = builder.token(CONFIG.TELEGRAM_BOT_TOKEN)
+        if CONFIG.METRICS_ENABLED:
+            builder = builder.request(instrumented_request_class()(connection_pool_size=256))
+    if CONFIG.METRICS_ENABLED:
+        metrics.enabled = True
+    application = builder.build()
     application.add_error_handler(error_handler)
     
     # Регистрация диалогов
@@ -35,14 +97,57 @@ def main() -> None:
     application.add_handler(CommandHandler("upload_users", CommandHandlerManager.upload_users_start)) # Для entry_point
     application.add_handler(CommandHandler("users", CommandHandlerManager.list_users))
     application.add_handler(CommandHandler("deluser", CommandHandlerManager.del_user))
+    application.add_handler(CommandHandler("find", CommandHandlerManager.find_user))
+    application.add_handler(CommandHandler("offices", CommandHandlerManager.list_offices))
+    application.add_handler(CommandHandler("addoffice", CommandHandlerManager.add_office))
+    application.add_handler(CommandHandler("deloffice", CommandHandlerManager.del_office))
+    application.add_handler(CommandHandler("settz", CommandHandlerManager.set_timezone))
+    application.add_handler(CommandHandler("setoffice", CommandHandlerManager.set_user_office))
+    application.add_handler(CommandHandler("schedule", CommandHandlerManager.set_schedule))
+    application.add_handler(CommandHandler("calendar", CommandHandlerManager.show_calendar))
+    application.add_handler(CommandHandler("bank", CommandHandlerManager.time_bank_history))
     application.add_handler(CommandHandler("report", CommandHandlerManager.report))
+    application.add_handler(CommandHandler("export", CommandHandlerManager.export))
+    application.add_handler(CommandHandler("reportcache", CommandHandlerManager.report_cache_stats))
+    application.add_handler(CommandHandler("flushcache", CommandHandlerManager.flush_report_cache))
+    application.add_handler(CommandHandler("ratelimit", CommandHandlerManager.rate_limit_stats))
+    application.add_handler(CommandHandler("slowqueries", CommandHandlerManager.slow_queries))
     application.add_handler(CommandHandler("help", CommandHandlerManager.help_command))
     
     # Регистрация обработчика кнопок
     application.add_handler(CallbackQueryHandler(callback_manager.main_handler))
-    
-    logger.info("Бот запускается...")
-    application.run_polling()
+
+    if CONFIG.METRICS_ENABLED:
+        instrument_handlers(application)
+
+    # Фильтры перед всеми обработчиками (отрицательные группы выполняются раньше); регистрируются
+    # после instrument_handlers, чтобы не попадать в гистограмму времени обработчиков
+    application.add_handler(TypeHandler(Update, throttle_updates), group=-2)
+    application.add_handler(CallbackQueryHandler(drop_duplicate_callbacks), group=-1)
+
+    # Регистрация задач по расписанию
+    if with_jobs:
+        register_jobs(application)
+    return application
+
+def main() -> None:
+    listener = setup_logging(CONFIG.LOG_LEVEL, CONFIG.LOG_FILE_PATH, CONFIG.LOG_MAX_BYTES, CONFIG.LOG_BACKUP_COUNT, CONFIG.LOG_SAMPLE_PER_MINUTE)
+    try:
+        if not CONFIG.TELEGRAM_BOT_TOKEN:
+            logger.critical("КРИТИЧЕСКАЯ ОШИБКА: Токен Telegram не найден! Проверьте файл .env")
+            return
+        if CONFIG.WORKER_COUNT > 1:
+            from sharding import run_sharded
+            logger.info("Бот запускается в %s рабочих процессах...", CONFIG.WORKER_COUNT)
+            run_sharded(CONFIG.WORKER_COUNT)
+            return
+        prepare_runtime()
+        application = build_application()
+        logger.info("Бот запускается...")
+        application.run_polling()
+    finally:
+        # Дописываем очередь логов до выхода, не дожидаясь atexit
+        listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
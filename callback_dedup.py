@@ -0,0 +1,75 @@
+# Файл: callback_dedup.py
+# Этот модуль отсекает повторные нажатия одной и той же кнопки (двойной тап),
+# пока они не дошли до обработчиков и базы данных.
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from config import CONFIG
+from logging_setup import SAMPLED
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class SeenQueryCache:
+    """
+    Ограниченный по размеру LRU-набор отпечатков нажатий со временем жизни.
+    Записи лежат в порядке добавления, поэтому устаревшие удаляются с начала за O(1) на запись.
+    """
+
+    def __init__(self, window_seconds: float, max_entries: int):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()
+        self.suppressed = 0
+
+    def check_and_remember(self, key: Hashable) -> bool:
+        """True, если такое нажатие уже было в пределах окна (дубликат); иначе запоминает его."""
+        now = time.monotonic()
+        with self._lock:
+            while self._seen and now - next(iter(self._seen.values())) >= self.window_seconds:
+                self._seen.popitem(last=False)
+            if key in self._seen:
+                self.suppressed += 1
+                return True
+            self._seen[key] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return False
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+seen_queries = SeenQueryCache(CONFIG.CALLBACK_DEDUP_WINDOW_SECONDS, CONFIG.CALLBACK_DEDUP_MAX_ENTRIES)
+
+def callback_fingerprint(update: Update) -> Optional[Tuple]:
+    """Отпечаток нажатия: пользователь, сообщение с клавиатурой и данные кнопки."""
+    query = update.callback_query
+    if query is None or query.data is None:
+        return None
+    message_key = query.message.message_id if query.message else query.inline_message_id
+    return (query.from_user.id, message_key, query.data)
+
+async def drop_duplicate_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Регистрируется в группе -1, до диалогов и main_handler. Повторное нажатие в пределах окна
+    только гасит "часики" на кнопке и останавливает дальнейшую обработку обновления.
+    """
+    fingerprint = callback_fingerprint(update)
+    if fingerprint is None or not seen_queries.check_and_remember(fingerprint):
+        return
+    metrics.inc('bot_callback_duplicates_total')
+    logger.info("Повторное нажатие %s от user_id %s пропущено.", fingerprint[2], fingerprint[0], extra=SAMPLED)
+    try:
+        await update.callback_query.answer()
+    except TelegramError as e:
+        logger.debug("Не удалось ответить на повторное нажатие: %s", e)
+    raise ApplicationHandlerStop
@@ -10,10 +10,17 @@ import database as db
 from config import CONFIG
 from menu_generator import MenuGenerator
 from report_generator import ReportGenerator
-from utils import get_now, end_workday_logic, seconds_to_str, start_work_logic
+from report_jobs import schedule_period_report, report_status_text
+from logging_setup import SAMPLED
+from metrics import metrics
+from utils import edit_messages_paced, format_time_bank_entry, get_now, get_daily_norm_seconds, get_month_bounds, get_user_today, get_user_tz, end_workday_logic, seconds_to_str, send_long_message, send_messages_paced, start_work_logic
 
 logger = logging.getLogger(__name__)
 
+# Префиксы callback-данных с параметрами: в метриках маршрут определяется по префиксу, а не по полной строке
+ROUTE_PREFIXES = ('approve_no_debt_', 'approve_', 'deny_', 'ack_request_', 'users_page_', 'user_details_', 'confirm_delete_',
+                  'report_today_', 'report_this_month_', 'export_this_month_', 'inbox_pick_', 'inbox_drop_')
+
 class CallbackHandlerManager:
     """
     Класс-менеджер, который обрабатывает все callback-запросы от inline-клавиатур.
@@ -51,25 +58,39 @@ class CallbackHandlerManager:
             'request_report': self.request_report,
             'manager_report_button': self.request_report,
             'team_status_button': self.team_status_button,
+            'team_status_tree': self.team_status_tree,
+            'analytics_button': self.analytics_button,
             'help_button': self.help_button,
             'show_all_users': self.show_all_users,
             'cancel_action': self.cancel_action,
+            'requests_inbox': self.requests_inbox,
+            'inbox_approve_all': self.inbox_approve_all,
+            'inbox_approve_selected': self.inbox_approve_selected,
+            'inbox_deny_selected': self.inbox_deny_selected,
         }
         
         handler_method = routes.get(command)
-
-        if handler_method:
-            await handler_method(update, context)
-        elif command.startswith(('approve_', 'deny_', 'approve_no_debt_', 'ack_request_')):
-            await self.process_manager_decision(update, context)
-        elif command.startswith('user_details_'):
-            await self.user_details(update, context)
-        elif command.startswith('confirm_delete_'):
-            await self.confirm_delete(update, context)
-        elif command.startswith('report_today_') or command.startswith('report_this_month_'):
-            await self.generate_period_report(update, context)
-        else:
-            logger.warning(f"Получен неизвестный callback от user_id {user_id}: {command}")
+        route = command if handler_method else next((prefix for prefix in ROUTE_PREFIXES if command.startswith(prefix)), 'unknown')
+        with metrics.timer('bot_callback_route_seconds', route=route):
+            if handler_method:
+                await handler_method(update, context)
+            elif command.startswith(('approve_', 'deny_', 'approve_no_debt_', 'ack_request_')):
+                await self.process_manager_decision(update, context)
+            elif command.startswith(('inbox_pick_', 'inbox_drop_')):
+                await self.inbox_toggle(update, context)
+            elif command.startswith('users_page_'):
+                from command_handlers import CommandHandlerManager
+                await CommandHandlerManager.users_page(update, context)
+            elif command.startswith('user_details_'):
+                await self.user_details(update, context)
+            elif command.startswith('confirm_delete_'):
+                await self.confirm_delete(update, context)
+            elif command.startswith('report_today_') or command.startswith('report_this_month_'):
+                await self.generate_period_report(update, context)
+            elif command.startswith('export_this_month_'):
+                await self.export_period_report(update, context)
+            else:
+                logger.warning("Получен неизвестный callback от user_id %s: %s", user_id, command, extra=SAMPLED)
 
     # --- МЕТОДЫ-ОБРАБОТЧИКИ ---
 
@@ -78,7 +99,7 @@ class CallbackHandlerManager:
         query = update.callback_query
         user_id = query.from_user.id
         
-        logger.info(f"--- ЗАПУСК show_status (edit_message) для user_id: {user_id} ---")
+        logger.info("--- ЗАПУСК show_status (edit_message) для user_id: %s ---", user_id, extra=SAMPLED)
         
         try:
             session_state = db.get_session_state(user_id)
@@ -124,10 +145,10 @@ class CallbackHandlerManager:
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
-            logger.info(f"--- УСПЕШНОЕ ЗАВЕРШЕНИЕ show_status (edit_message) для user_id: {user_id} ---")
+            logger.info("--- УСПЕШНОЕ ЗАВЕРШЕНИЕ show_status (edit_message) для user_id: %s ---", user_id, extra=SAMPLED)
 
         except Exception as e:
-            logger.error(f"!!! КРИТИЧЕСКАЯ ОШИБКА внутри show_status: {e}", exc_info=True)
+            logger.error("!!! КРИТИЧЕСКАЯ ОШИБКА внутри show_status: %s", e, exc_info=True)
             await query.answer("Произошла ошибка при получении статуса.", show_alert=True)
             
     async def show_time_bank(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -135,17 +156,20 @@ class CallbackHandlerManager:
         query = update.callback_query
         user_id = query.from_user.id
         
-        logger.info(f"--- ЗАПУСК show_time_bank (edit_message) для user_id: {user_id} ---")
+        logger.info("--- ЗАПУСК show_time_bank (edit_message) для user_id: %s ---", user_id, extra=SAMPLED)
         
         try:
             user_info = db.get_user(user_id)
             if not user_info:
-                logger.warning(f"Пользователь с ID {user_id} НЕ НАЙДЕН в базе данных.")
+                logger.warning("Пользователь с ID %s НЕ НАЙДЕН в базе данных.", user_id)
                 await query.answer("Не удалось найти ваш профиль.", show_alert=True)
                 return
 
             banked_seconds = user_info.get('time_bank_seconds', 0)
             message_text = f"🏦 В вашем банке времени накоплено: **{seconds_to_str(banked_seconds)}**."
+            entries = db.get_time_bank_entries(user_id, limit=CONFIG.TIME_BANK_RECENT_ENTRIES)
+            if entries:
+                message_text += "\n\n**Последние операции:**\n" + "\n".join(format_time_bank_entry(entry, get_user_tz(user_id)) for entry in entries)
             
             session_state = db.get_session_state(user_id)
             back_callback = "back_to_main_menu"
@@ -160,10 +184,10 @@ class CallbackHandlerManager:
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
-            logger.info(f"--- УСПЕШНОЕ ЗАВЕРШЕНИЕ show_time_bank (edit_message) для user_id: {user_id} ---")
+            logger.info("--- УСПЕШНОЕ ЗАВЕРШЕНИЕ show_time_bank (edit_message) для user_id: %s ---", user_id, extra=SAMPLED)
             
         except Exception as e:
-            logger.error(f"!!! КРИТИЧЕСКАЯ ОШИБКА внутри show_time_bank: {e}", exc_info=True)
+            logger.error("!!! КРИТИЧЕСКАЯ ОШИБКА внутри show_time_bank: %s", e, exc_info=True)
 
     async def start_work_remote(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начинает удаленный рабочий день."""
@@ -176,7 +200,7 @@ class CallbackHandlerManager:
         if not session_state: return
 
         work_duration = (get_now() - session_state['start_time']).total_seconds()
-        if work_duration < CONFIG.MIN_WORK_SECONDS:
+        if work_duration < get_daily_norm_seconds(user_id, session_state['start_time']):
             await query.edit_message_text("Вы хотите уйти раньше. Как поступим?", reply_markup=MenuGenerator.get_early_leave_menu())
         else:
             await query.edit_message_text("Завершение рабочего дня...")
@@ -227,11 +251,11 @@ class CallbackHandlerManager:
         if not session_state or not user_info: return
 
         work_duration = (get_now() - session_state['start_time']).total_seconds() - session_state.get('total_break_seconds', 0)
-        shortfall_seconds = CONFIG.MIN_WORK_SECONDS - work_duration
+        shortfall_seconds = get_daily_norm_seconds(user_id, session_state['start_time']) - work_duration
         banked_seconds = user_info.get('time_bank_seconds', 0)
         
         if banked_seconds >= shortfall_seconds:
-            db.update_time_bank(user_id, -int(shortfall_seconds))
+            # Списание из банка проводится в end_workday_logic со ссылкой на запись work_log
             await query.edit_message_text("Завершение рабочего дня за счет банка времени...")
             await end_workday_logic(context, user_id, is_early_leave=True, used_bank_time=shortfall_seconds)
         else:
@@ -290,13 +314,28 @@ class CallbackHandlerManager:
         
         session_state = db.get_session_state(user_id)
         is_manager = user_info['role'] in ['manager', 'admin']
-        await query.edit_message_text("Выберите период для отчета:", reply_markup=MenuGenerator.get_report_period_menu(is_manager=is_manager, in_session=bool(session_state)))
+        is_admin = user_id in CONFIG.ADMIN_IDS
+        await query.edit_message_text("Выберите период для отчета:", reply_markup=MenuGenerator.get_report_period_menu(is_manager=is_manager, in_session=bool(session_state), is_admin=is_admin))
         
     async def team_status_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         user_id = query.from_user.id
         report_text = await ReportGenerator.get_team_status_text(user_id)
-        await context.bot.send_message(user_id, report_text, parse_mode='Markdown')
+        await send_long_message(context.bot, user_id, report_text)
+
+    async def team_status_tree(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Статус всей структуры подчинения руководителя (все уровни)."""
+        query = update.callback_query
+        user_id = query.from_user.id
+        report_text = await ReportGenerator.get_team_status_text(user_id, max_depth=None)
+        await send_long_message(context.bot, user_id, report_text)
+
+    async def analytics_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отправляет руководителю аналитику посещаемости команды за текущий месяц."""
+        query = update.callback_query
+        start_date, end_date = get_month_bounds(get_user_today(query.from_user.id))
+        result = schedule_period_report(context.bot, query.from_user.id, 'analytics', start_date, end_date)
+        await query.edit_message_text(report_status_text(result))
 
     async def help_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         from command_handlers import CommandHandlerManager
@@ -313,39 +352,118 @@ class CallbackHandlerManager:
         parts = query.data.split('_')
         action = "_".join(parts[:-1])
         request_id = int(parts[-1])
-        
-        request_info = db.get_request(request_id)
-        if not request_info or request_info['status'] != 'pending':
+        if action == 'ack_request':
+            status = 'acknowledged'
+        else:
+            status = 'approved' if action.startswith('approve') else 'denied'
+
+        decided = db.decide_requests([request_id], status)
+        if not decided:
             await query.edit_message_text("Этот запрос уже был обработан.")
             return
 
-        requester_info = db.get_user(request_info['requester_id'])
-        if not requester_info:
-            await query.edit_message_text("Ошибка: не удалось найти сотрудника.")
+        request = decided[0]
+        response_text = f"{CONFIG.REQUEST_STATUS_MAP[request['status']]}: {MenuGenerator.describe_request(request)}"
+        if action == 'approve_no_debt':
+            response_text += " (без начисления отработки)"
+        await query.edit_message_text(response_text + ".")
+        clicked = (query.message.chat_id, query.message.message_id) if query.message else None
+        await self._deliver_request_decisions(context, user_info, decided, forgive_debt=(action == 'approve_no_debt'), skip_message=clicked)
+
+    async def _deliver_request_decisions(self, context: ContextTypes.DEFAULT_TYPE, manager_info: dict, decided: list,
+                                         forgive_debt: bool = False, skip_message: tuple = None):
+        """
+        Последствия решений по запросам: завершение дня при одобренном раннем уходе, уведомления
+        сотрудникам и правка копий запроса у обоих руководителей. Сообщения уходят одной рассылкой с паузами.
+        """
+        notifications, edits = [], []
+        for request in decided:
+            status = request['status']
+            if request['request_type'] == 'early_leave' and status == 'approved':
+                message = await end_workday_logic(context, request['requester_id'], is_early_leave=True, forgive_debt=forgive_debt, notify=False)
+                if message:
+                    notifications.append(message)
+            if status != 'acknowledged':
+                notifications.append({'chat_id': request['requester_id'],
+                                      'text': f"Ваш запрос ('{request['request_type']}') был {'одобрен' if status == 'approved' else 'отклонен'}."})
+            outcome = f"{CONFIG.REQUEST_STATUS_MAP[status]}: {MenuGenerator.describe_request(request)} ({manager_info['full_name']})."
+            for chat_id, message_id in ((request['manager_id_1'], request['manager_1_message_id']),
+                                        (request['manager_id_2'], request['manager_2_message_id'])):
+                if chat_id and message_id and (chat_id, message_id) != skip_message:
+                    edits.append({'chat_id': chat_id, 'message_id': message_id, 'text': outcome})
+        await send_messages_paced(context.bot, notifications)
+        await edit_messages_paced(context.bot, edits)
+        logger.info("Руководитель %s решил запросов: %s (уведомлений %s, правок %s).",
+                    manager_info['user_id'], len(decided), len(notifications), len(edits))
+
+    # --- Входящие запросы руководителя ---
+
+    async def requests_inbox(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        user_info = db.get_user(query.from_user.id)
+        if not user_info or user_info.get('role') not in ['manager', 'admin']:
+            await query.answer("У вас нет прав для этого действия.", show_alert=True)
             return
+        context.user_data['inbox_selected'] = []
+        await self._render_inbox(query, context)
 
-        if action == 'ack_request':
-            db.update_request_status(request_id, 'acknowledged')
-            await query.edit_message_text(f"✅ Принято к сведению (уведомление от {requester_info['full_name']}).")
-        else:
-            new_status = 'approved' if action.startswith('approve') else 'denied'
-            db.update_request_status(request_id, new_status)
-            
-            response_text = f"Вы {'одобрили' if new_status == 'approved' else 'отклонили'} запрос от {requester_info['full_name']}"
-            if action == 'approve_no_debt': response_text += " (без начисления отработки)."
-            await query.edit_message_text(response_text)
-            
-            text_to_employee = f"Ваш запрос ('{request_info.get('request_type', 'Неизвестно')}') был {'одобрен' if new_status == 'approved' else 'отклонен'}."
-            
-            if request_info['request_type'] == 'early_leave' and new_status == 'approved':
-                forgive_debt = (action == 'approve_no_debt')
-                await end_workday_logic(context, requester_info['user_id'], is_early_leave=True, forgive_debt=forgive_debt)
-            
-            await context.bot.send_message(requester_info['user_id'], text_to_employee)
+    async def _render_inbox(self, query, context: ContextTypes.DEFAULT_TYPE, notice: str = ''):
+        """
+        Показывает ожидающие запросы подчиненных. Показанные ID запоминаются в user_data:
+        "одобрить все" решает только то, что руководитель видел, а не пришедшее позже.
+        """
+        pending = db.get_pending_requests_by_manager(query.from_user.id)[:CONFIG.REQUEST_INBOX_LIMIT]
+        shown_ids = [request['request_id'] for request in pending]
+        selected = [request_id for request_id in context.user_data.get('inbox_selected', []) if request_id in shown_ids]
+        context.user_data['inbox_shown'] = shown_ids
+        context.user_data['inbox_selected'] = selected
+        text, markup = MenuGenerator.get_requests_inbox(pending, set(selected), notice)
+        await query.edit_message_text(text, reply_markup=markup)
+
+    async def inbox_toggle(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """inbox_pick_<ID> добавляет запрос в выбранные, inbox_drop_<ID> - убирает."""
+        query = update.callback_query
+        request_id = int(query.data.split('_')[-1])
+        selected = [item for item in context.user_data.get('inbox_selected', []) if item != request_id]
+        if query.data.startswith('inbox_pick_'):
+            selected.append(request_id)
+        context.user_data['inbox_selected'] = selected
+        await self._render_inbox(query, context)
+
+    async def inbox_approve_all(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await self._decide_from_inbox(update, context, context.user_data.get('inbox_shown', []), 'approved')
+
+    async def inbox_approve_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await self._decide_from_inbox(update, context, context.user_data.get('inbox_selected', []), 'approved')
+
+    async def inbox_deny_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await self._decide_from_inbox(update, context, context.user_data.get('inbox_selected', []), 'denied')
+
+    async def _decide_from_inbox(self, update: Update, context: ContextTypes.DEFAULT_TYPE, request_ids: list, status: str):
+        """Решение по набору запросов одним UPDATE; запросы, уже решенные вторым руководителем, пропускаются."""
+        query = update.callback_query
+        user_info = db.get_user(query.from_user.id)
+        if not user_info or user_info.get('role') not in ['manager', 'admin']:
+            await query.answer("У вас нет прав для этого действия.", show_alert=True)
+            return
+        if not request_ids:
+            await self._render_inbox(query, context, "Список запросов обновлен, выберите запросы еще раз.")
+            return
+
+        decided = db.decide_requests(request_ids, status, manager_id=user_info['user_id'])
+        context.user_data['inbox_selected'] = []
+        notice = f"Решено запросов: {len(decided)}."
+        if len(decided) < len(request_ids):
+            notice += f" Уже решены ранее: {len(request_ids) - len(decided)}."
+        await self._render_inbox(query, context, notice)
+        if decided:
+            await self._deliver_request_decisions(context, user_info, decided)
 
     async def user_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        target_user_id = int(query.data.split('_')[-1])
+        # Формат: user_details_<ID>[|<callback страницы списка>]
+        target_part, _, back_callback = query.data[len('user_details_'):].partition('|')
+        target_user_id = int(target_part)
         info = db.get_user(target_user_id)
         if not info:
             await query.edit_message_text("Пользователь не найден."); return
@@ -354,7 +472,7 @@ class CallbackHandlerManager:
                 f"Банк времени: {seconds_to_str(info.get('time_bank_seconds',0))}\n"
                 f"ID Рук. 1: {info.get('manager_id_1', 'Н/Д')}\nID Рук. 2: {info.get('manager_id_2', 'Н/Д')}")
         keyboard = [
-            [InlineKeyboardButton("« Назад к списку", callback_data="show_all_users")]
+            [InlineKeyboardButton("« Назад к списку", callback_data=back_callback or "show_all_users")]
         ]
         await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
         
@@ -378,26 +496,31 @@ class CallbackHandlerManager:
         command = query.data
         
         report_type = command.split('_')[-1]
-        today = get_now().date()
+        today = get_user_today(user_id)
         
         if 'today' in command:
             start_date, end_date = today, today
         else:
-            start_date = today.replace(day=1)
-            next_month = start_date.replace(day=28) + datetime.timedelta(days=4)
-            end_date = next_month - datetime.timedelta(days=next_month.day)
+            start_date, end_date = get_month_bounds(today)
         
-        await query.delete_message()
-        if report_type == 'manager':
-            report_text = await ReportGenerator.get_manager_report_text(user_id, start_date, end_date)
-            reply_markup = MenuGenerator.get_manager_menu()
-        else:
-            report_text = await ReportGenerator.get_employee_report_text(user_id, start_date, end_date)
-            is_in_session = bool(db.get_session_state(user_id))
-            reply_markup = MenuGenerator.get_working_menu() if is_in_session else await MenuGenerator.get_main_menu(user_id)
-            
-        await context.bot.send_message(user_id, report_text, parse_mode='Markdown', reply_markup=reply_markup)
+        if report_type == 'org' and user_id not in CONFIG.ADMIN_IDS:
+            await query.answer("Отчет по организации доступен только администраторам.", show_alert=True)
+            return
+
+        if report_type not in ['org', 'manager', 'tree']:
+            report_type = 'employee'
+        result = schedule_period_report(context.bot, user_id, report_type, start_date, end_date)
+        await query.edit_message_text(report_status_text(result))
         
+    async def export_period_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгружает отчет за текущий месяц в CSV: сотруднику - свой, руководителю - по команде."""
+        from command_handlers import CommandHandlerManager
+        query = update.callback_query
+        scope = 'team' if query.data.endswith('_manager') else 'self'
+        start_date, end_date = get_month_bounds(get_user_today(query.from_user.id))
+        await query.edit_message_text("Готовлю файл отчета...")
+        await CommandHandlerManager.send_export(context, query.from_user.id, scope, 'csv', start_date, end_date)
+
     async def additional_work_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.edit_message_text("Выберите тип дополнительной работы:", reply_markup=MenuGenerator.get_additional_work_menu(query.from_user.id))
@@ -417,7 +540,7 @@ class CallbackHandlerManager:
     async def _start_extra_work(self, update: Update, status: str, notify_manager: bool = False, bot=None):
         query = update.callback_query
         user_id = query.from_user.id
-        start_time = get_now()
+        start_time = get_now(get_user_tz(user_id))
         db.set_session_state(user_id, {'status': status, 'start_time': start_time})
         text, markup = MenuGenerator.get_extra_work_active_menu(status, start_time)
         await query.edit_message_text(text, reply_markup=markup)
@@ -452,8 +575,8 @@ class CallbackHandlerManager:
             db.add_debt_log(user_id, start_time, get_now(), int(worked_seconds))
             text = f"Зачтено в счет отработки: {seconds_to_str(worked_seconds)}."
         elif status == 'banking_time':
-            db.update_time_bank(user_id, int(worked_seconds))
-            db.add_work_log(user_id, start_time, get_now(), int(worked_seconds), 0, 'banking')
+            log_id = db.add_work_log(user_id, start_time, get_now(), int(worked_seconds), 0, 'banking')
+            db.update_time_bank(user_id, int(worked_seconds), 'banking_work', f"work_log:{log_id}")
             text = f"Работа в банк времени завершена. Вы накопили: {seconds_to_str(worked_seconds)}."
         else:
             return
@@ -1,17 +1,28 @@
 # Файл: command_handlers.py (Полная финальная версия)
 import re
+import asyncio
+import datetime
 import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 import database as db
-from utils import admin_only, get_now
+from utils import admin_only, format_time_bank_entry, get_day_start, get_month_bounds, get_user_today, get_user_tz, parse_dates, seconds_to_str, send_long_message
 from menu_generator import MenuGenerator
 from config import CONFIG
+from report_cache import report_cache
+from rate_limit import buckets
+from db_tracing import query_tracer
+from timezones import timezones
+from work_calendar import work_calendar
+from user_search import user_search_index
+from report_exporter import ReportExporter, EXPORT_SCOPES, EXPORT_FORMATS
 
 
 
 logger = logging.getLogger(__name__)
 
+USER_ROLES = ('employee', 'manager', 'admin')
+
 class CommandHandlerManager:
     @staticmethod
     async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -21,7 +32,7 @@ class CommandHandlerManager:
             await update.message.reply_text("Ваш аккаунт не зарегистрирован. Обратитесь к администратору.")
             return
 
-        today = get_now().date()
+        today = get_user_today(user_id)
         absences = db.get_absences_for_user(user_id, today)
         
         if absences:
@@ -84,7 +95,7 @@ class CommandHandlerManager:
             db.add_or_update_user(target_user_id, full_name, role, manager_1, manager_2)
             await update.message.reply_text(f"Пользователь {full_name} (ID: {target_user_id}) успешно сохранен.")
         except (IndexError, ValueError) as e:
-            logger.error(f"Ошибка при выполнении adduser: {e}")
+            logger.error("Ошибка при выполнении adduser: %s", e)
             await update.message.reply_text(f"Ошибка в аргументах: {e}. Проверьте формат.")
     
     @staticmethod
@@ -103,12 +114,73 @@ class CommandHandlerManager:
     @staticmethod
     @admin_only
     async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        all_users = db.get_all_users()
-        if not all_users:
-            await update.message.reply_text("В базе данных пока нет пользователей.")
+        """Первая страница списка пользователей: /users [employee|manager|admin]"""
+        role = 'all'
+        if update.message and context.args and context.args[0] in USER_ROLES:
+            role = context.args[0]
+        await CommandHandlerManager.show_users_page(update, role, 'a', None)
+
+    @staticmethod
+    @admin_only
+    async def users_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Переход по страницам списка; callback_data: users_page_<роль>_<направление>_<ID-якорь>."""
+        _, _, role, direction, anchor = update.callback_query.data.split('_')
+        anchor_id = int(anchor) or None
+        await CommandHandlerManager.show_users_page(update, role, direction, anchor_id)
+
+    @staticmethod
+    async def show_users_page(update: Update, role: str, direction: str, anchor_id: int = None):
+        page_size = CONFIG.USERS_PAGE_SIZE
+        role_filter = None if role == 'all' else role
+        users = db.get_users_page(role_filter, anchor_id, direction, page_size)
+        if not users and anchor_id is not None:
+            # Якорь удален или страница опустела - показываем начало списка
+            direction, anchor_id = 'a', None
+            users = db.get_users_page(role_filter, None, direction, page_size)
+
+        has_more = len(users) > page_size
+        if direction == 'p':
+            users = users[1:] if has_more else users
+            has_prev, has_next = has_more, True
+        else:
+            users = users[:page_size]
+            has_prev, has_next = anchor_id is not None, has_more
+
+        if not users:
+            text, reply_markup = "В базе данных пока нет пользователей.", None
+        else:
+            # Возврат на первую страницу - без якоря, иначе она открылась бы с кнопкой "« Пред."
+            page_callback = f"users_page_{role}_a_{users[0]['user_id'] if has_prev else 0}"
+            prev_callback = f"users_page_{role}_p_{users[0]['user_id']}" if has_prev else None
+            next_callback = f"users_page_{role}_n_{users[-1]['user_id']}" if has_next else None
+            text = "Список пользователей:" if role == 'all' else f"Список пользователей ({role}):"
+            reply_markup = MenuGenerator.get_users_page_menu(users, page_callback, prev_callback, next_callback)
+
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(text, reply_markup=reply_markup)
+
+    @staticmethod
+    async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Поиск сотрудника по имени: /find <текст>. Руководитель ищет только среди своей структуры."""
+        user_id = update.effective_user.id
+        user_info = db.get_user(user_id)
+        is_admin = user_id in CONFIG.ADMIN_IDS
+        if not is_admin and (not user_info or user_info['role'] not in ['manager', 'admin']):
+            await update.message.reply_text("У вас нет доступа к этой команде.")
+            return
+        text = " ".join(context.args or [])
+        if not text:
+            await update.message.reply_text("Формат: /find Имя или часть имени")
             return
-        keyboard = [[InlineKeyboardButton(f"{user['full_name']} ({user['role']})", callback_data=f"user_details_{user['user_id']}")] for user in all_users]
-        await update.message.reply_text("Список пользователей:", reply_markup=InlineKeyboardMarkup(keyboard))
+        allowed_ids = None if is_admin else {member['user_id'] for member in db.get_managed_users(user_id, max_depth=None)}
+        found = user_search_index.search(text, limit=CONFIG.USERS_PAGE_SIZE, allowed_ids=allowed_ids)
+        if not found:
+            await update.message.reply_text("Никого не найдено.")
+            return
+        keyboard = [[InlineKeyboardButton(full_name, callback_data=f"user_details_{found_id}")] for found_id, full_name in found]
+        await update.message.reply_text(f"Найдено: {len(found)}", reply_markup=InlineKeyboardMarkup(keyboard))
 
     @staticmethod
     @admin_only
@@ -125,13 +197,250 @@ class CommandHandlerManager:
         except (IndexError, ValueError):
             await update.message.reply_text("Неверный формат. Используйте: /deluser <ID>")
 
+    @staticmethod
+    @admin_only
+    async def list_offices(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        offices = db.get_offices()
+        if not offices:
+            await update.message.reply_text("Офисы не настроены. Добавьте офис командой /addoffice.")
+            return
+        lines = [f"{office['office_id']}. {office['name']} - {office['latitude']:.6f}, {office['longitude']:.6f}, радиус {office['radius_meters']} м, "
+                 f"пояс {office['timezone'] or CONFIG.TIMEZONE}" for office in offices]
+        await send_long_message(context.bot, update.effective_chat.id, "Офисы:\n" + "\n".join(lines), parse_mode=None)
+
+    @staticmethod
+    @admin_only
+    async def add_office(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Добавление офиса: /addoffice <широта> <долгота> <радиус_м> <название>"""
+        try:
+            latitude, longitude, radius_meters = float(context.args[0]), float(context.args[1]), int(context.args[2])
+            name = " ".join(context.args[3:]).strip('"') or f"Офис {latitude:.4f}, {longitude:.4f}"
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and radius_meters > 0):
+                raise ValueError
+        except (IndexError, ValueError):
+            await update.message.reply_text("Неверный формат. Используйте: /addoffice <широта> <долгота> <радиус_м> <название>")
+            return
+        office = db.add_office(name, latitude, longitude, radius_meters)
+        await update.message.reply_text(f"Офис «{office['name']}» добавлен (ID {office['office_id']}).")
+
+    @staticmethod
+    @admin_only
+    async def del_office(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            office_id = int(context.args[0])
+        except (IndexError, ValueError):
+            await update.message.reply_text("Неверный формат. Используйте: /deloffice <ID>")
+            return
+        if db.delete_office(office_id):
+            await update.message.reply_text(f"Офис {office_id} удален.")
+        else:
+            await update.message.reply_text(f"Офис с ID {office_id} не найден.")
+
+    @staticmethod
+    @admin_only
+    async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Часовой пояс: /settz user <ID> <пояс|->, /settz office <ID> <пояс|-> (пояс в формате Europe/Moscow, "-" - сбросить)"""
+        usage = "Неверный формат. Используйте: /settz user <ID> <пояс|-> или /settz office <ID> <пояс|->, например Europe/Moscow."
+        try:
+            target, target_id, tz_name = context.args[0], int(context.args[1]), context.args[2]
+            if target not in ('user', 'office'):
+                raise ValueError
+        except (IndexError, ValueError):
+            await update.message.reply_text(usage)
+            return
+        tz_name = None if tz_name == '-' else tz_name
+        if tz_name and not timezones.is_valid(tz_name):
+            await update.message.reply_text(f"Неизвестный часовой пояс {tz_name}. {usage}")
+            return
+        if target == 'office':
+            office = db.set_office_timezone(target_id, tz_name)
+            text = f"Офису «{office['name']}» задан пояс {tz_name or CONFIG.TIMEZONE}." if office else f"Офис с ID {target_id} не найден."
+        elif db.set_user_timezone(target_id, tz_name):
+            text = f"Сотруднику {target_id} задан пояс {tz_name}." if tz_name else f"Сотрудник {target_id} будет использовать пояс своего офиса."
+        else:
+            text = f"Пользователь с ID {target_id} не найден."
+        await update.message.reply_text(text)
+
+    @staticmethod
+    @admin_only
+    async def set_user_office(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Закрепление за офисом (от него берется часовой пояс): /setoffice <ID сотрудника> <ID офиса|->"""
+        try:
+            user_id = int(context.args[0])
+            office_id = None if context.args[1] == '-' else int(context.args[1])
+        except (IndexError, ValueError):
+            await update.message.reply_text("Неверный формат. Используйте: /setoffice <ID сотрудника> <ID офиса|->")
+            return
+        if office_id is not None and not any(office['office_id'] == office_id for office in db.get_offices()):
+            await update.message.reply_text(f"Офис с ID {office_id} не найден.")
+            return
+        if db.set_user_office(user_id, office_id):
+            await update.message.reply_text(f"Сотрудник {user_id} {'закреплен за офисом ' + str(office_id) if office_id else 'откреплен от офиса'}.")
+        else:
+            await update.message.reply_text(f"Пользователь с ID {user_id} не найден.")
+
+    @staticmethod
+    @admin_only
+    async def set_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Индивидуальный график: /schedule <ID> <ставка> [дни недели 1-7, например 135]"""
+        try:
+            user_id, work_rate = int(context.args[0]), float(context.args[1].replace(',', '.'))
+            work_weekdays = "".join(sorted(set(context.args[2]))) if len(context.args) > 2 else None
+            if not 0 < work_rate <= 2 or (work_weekdays and not set(work_weekdays) <= set('1234567')):
+                raise ValueError
+        except (IndexError, ValueError):
+            await update.message.reply_text("Неверный формат. Используйте: /schedule <ID> <ставка, например 0.5> [дни недели, например 135]")
+            return
+        if not db.set_user_schedule(user_id, work_rate, work_weekdays):
+            await update.message.reply_text(f"Пользователь с ID {user_id} не найден.")
+            return
+        days_text = f"дни недели {work_weekdays}" if work_weekdays else "по производственному календарю"
+        await update.message.reply_text(f"Сотруднику {user_id} задан график: ставка {work_rate:g}, {days_text}.")
+
+    @staticmethod
+    @admin_only
+    async def show_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Норма текущего месяца по производственному календарю; /calendar reload - перечитать файл календаря."""
+        if context.args and context.args[0] == 'reload':
+            work_calendar.load(CONFIG.WORK_CALENDAR_PATH)
+        start_date, end_date = get_month_bounds(get_user_today(update.effective_user.id))
+        working_days = sum(work_calendar.is_working_day(start_date + datetime.timedelta(days=offset)) for offset in range((end_date - start_date).days + 1))
+        await update.message.reply_text(
+            f"Производственный календарь на {start_date.strftime('%m.%Y')}: рабочих дней {working_days}, "
+            f"норма {seconds_to_str(work_calendar.expected_seconds(start_date, end_date))}.")
+
+    @staticmethod
+    @admin_only
+    async def time_bank_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Журнал банка времени сотрудника: /bank <ID> [ДД.ММ.ГГГГ - остаток на начало этой даты]"""
+        try:
+            user_id = int(context.args[0])
+            dates = parse_dates(" ".join(context.args[1:]))
+        except (IndexError, ValueError):
+            await update.message.reply_text("Неверный формат. Используйте: /bank <ID> [ДД.ММ.ГГГГ]")
+            return
+        user_info = db.get_user(user_id)
+        if not user_info:
+            await update.message.reply_text(f"Пользователь с ID {user_id} не найден.")
+            return
+        tz = get_user_tz(user_id)
+        lines = [f"Банк времени: {user_info['full_name']}, остаток {seconds_to_str(user_info['time_bank_seconds'])}"]
+        if dates:
+            balance = db.get_time_bank_balance_as_of(user_id, get_day_start(dates[0], tz))
+            lines.append(f"Остаток на начало {dates[0].strftime('%d.%m.%Y')}: {'-' if balance < 0 else ''}{seconds_to_str(abs(balance))}")
+        entries = db.get_time_bank_entries(user_id, limit=50)
+        lines.append("")
+        lines.extend(f"{format_time_bank_entry(entry, tz)} [{entry['source_ref'] or '-'}]" for entry in entries)
+        if not entries:
+            lines.append("Операций нет.")
+        await send_long_message(context.bot, update.effective_chat.id, "\n".join(lines), parse_mode=None)
+
+    @staticmethod
+    @admin_only
+    async def slow_queries(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сводка по SQL-запросам: /slowqueries [N], /slowqueries plan <номер>, /slowqueries reset"""
+        if not CONFIG.DB_TRACE_ENABLED:
+            await update.message.reply_text("Трассировка запросов выключена (DB_TRACE_ENABLED).")
+            return
+        args = context.args or []
+        if args and args[0] == 'reset':
+            query_tracer.reset()
+            await update.message.reply_text("Статистика запросов сброшена.")
+            return
+        if args and args[0] == 'plan':
+            summary = query_tracer.summary(limit=50)
+            try:
+                row = summary[int(args[1]) - 1]
+            except (IndexError, ValueError):
+                await update.message.reply_text("Используйте: /slowqueries plan <номер из списка>")
+                return
+            text = f"{row['template']}\n\n{row['plan'] or 'План еще не снимался: запрос не превышал порог или не является SELECT.'}"
+            await send_long_message(context.bot, update.effective_chat.id, text, parse_mode=None)
+            return
+        limit = int(args[0]) if args and args[0].isdigit() else 10
+        summary = query_tracer.summary(limit=limit)
+        if not summary:
+            await update.message.reply_text("Запросов пока не было.")
+            return
+        lines = [f"Всего запросов: {query_tracer.total_statements}, порог медленного: {CONFIG.DB_SLOW_QUERY_MS} мс\n"]
+        for i, row in enumerate(summary, start=1):
+            lines.append(
+                f"{i}. всего {row['total']:.2f} с, {row['count']} раз (ошибок {row['errors']}), "
+                f"ср {row['avg'] * 1000:.1f} мс, p95 {row['p95'] * 1000:.1f} мс, макс {row['max'] * 1000:.1f} мс"
+                f"{', есть план' if row['plan'] else ''}\n   {row['template'][:200]}")
+        await send_long_message(context.bot, update.effective_chat.id, "\n".join(lines), parse_mode=None)
+
+    @staticmethod
+    @admin_only
+    async def report_cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        stats = report_cache.stats()
+        await update.message.reply_text(
+            f"Кэш отчетов:\nЗаписей: {stats['entries']}\nПопаданий: {stats['hits']}\nПромахов: {stats['misses']}\n"
+            f"Доля попаданий: {stats['hit_rate']:.1%}\nСброшено записей: {stats['invalidations']}")
+
+    @staticmethod
+    @admin_only
+    async def rate_limit_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сколько обновлений отброшено ограничением частоты с момента запуска, по ролям."""
+        lines = [f"{role}: отброшено {buckets.shed[role]} (лимит {rate:g}/с, запас {burst})"
+                 for role, (rate, burst) in CONFIG.RATE_LIMITS.items()]
+        await update.message.reply_text("Ограничение частоты:\n" + "\n".join(lines) + f"\nАктивных корзин: {len(buckets)}")
+
+    @staticmethod
+    @admin_only
+    async def flush_report_cache(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        count = report_cache.clear()
+        logger.info("Кэш отчетов очищен администратором %s, удалено записей: %s", update.effective_user.id, count)
+        await update.message.reply_text(f"Кэш отчетов очищен. Удалено записей: {count}.")
+
     @staticmethod
     async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_info = db.get_user(update.effective_user.id)
         if not user_info: return
         session_state = db.get_session_state(update.effective_user.id)
         is_manager = user_info['role'] in ['manager', 'admin']
-        await update.message.reply_text("Выберите период для отчета:", reply_markup=MenuGenerator.get_report_period_menu(is_manager=is_manager, in_session=bool(session_state)))
+        is_admin = update.effective_user.id in CONFIG.ADMIN_IDS
+        await update.message.reply_text("Выберите период для отчета:", reply_markup=MenuGenerator.get_report_period_menu(is_manager=is_manager, in_session=bool(session_state), is_admin=is_admin))
+
+    @staticmethod
+    async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузка отчета в файл: /export [self|team|tree|org] [csv|xlsx] [ДД.ММ.ГГГГ - ДД.ММ.ГГГГ]"""
+        user_id = update.effective_user.id
+        user_info = db.get_user(user_id)
+        if not user_info: return
+        args = context.args or []
+        scope = next((a for a in args if a in EXPORT_SCOPES), 'self')
+        fmt = next((a for a in args if a in EXPORT_FORMATS), 'csv')
+        if scope in ['team', 'tree'] and user_info['role'] not in ['manager', 'admin']:
+            await update.message.reply_text("Выгрузка по команде доступна только руководителям.")
+            return
+        if scope == 'org' and user_id not in CONFIG.ADMIN_IDS:
+            await update.message.reply_text("Выгрузка по всей организации доступна только администраторам.")
+            return
+        if fmt == 'xlsx' and not ReportExporter.xlsx_available():
+            await update.message.reply_text("Выгрузка в XLSX недоступна на сервере, используйте csv.")
+            return
+        try:
+            dates = parse_dates(" ".join(args))
+        except ValueError:
+            await update.message.reply_text("Неверный формат даты. Используйте: /export [self|team|tree|org] [csv|xlsx] ДД.ММ.ГГГГ - ДД.ММ.ГГГГ")
+            return
+        start_date, end_date = (min(dates), max(dates)) if dates else get_month_bounds(get_user_today(user_id))
+        await update.message.reply_text("Готовлю файл отчета...")
+        await CommandHandlerManager.send_export(context, user_id, scope, fmt, start_date, end_date)
+
+    @staticmethod
+    async def send_export(context: ContextTypes.DEFAULT_TYPE, user_id: int, scope: str, fmt: str, start_date, end_date):
+        """Строит файл выгрузки в отдельном потоке и отправляет его документом."""
+        try:
+            file, filename, count = await asyncio.to_thread(ReportExporter.build_export, scope, user_id, start_date, end_date, fmt)
+        except Exception as e:
+            logger.error("Ошибка при выгрузке отчета для %s: %s", user_id, e, exc_info=True)
+            await context.bot.send_message(user_id, "Не удалось сформировать файл отчета.")
+            return
+        with file:
+            caption = f"Отчет с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}, строк: {count}"
+            await context.bot.send_document(user_id, document=file, filename=filename, caption=caption)
 
     @staticmethod
     async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -142,17 +451,30 @@ class CommandHandlerManager:
             help_text += ("**Вы — Администратор.**\n\n"
                           "`/adduser ID \"Имя Фамилия\" [роль] [ID_рук]` - добавить/изменить пользователя.\n"
                           "`/upload_users` - загрузить пользователей из CSV-файла.\n"
-                          "`/users` - посмотреть список всех пользователей.\n"
+                          "`/users [employee|manager|admin]` - посмотреть список пользователей.\n"
+                          "`/find текст` - найти сотрудника по имени.\n"
                           "`/deluser ID` - удалить пользователя по ID.\n"
-                          "`/report` - отчет по команде.\n"
+                          "`/offices` - список офисов, `/addoffice широта долгота радиус название` - добавить офис, `/deloffice ID` - удалить.\n"
+                          "`/settz user|office ID пояс` - часовой пояс сотрудника или офиса, `/setoffice ID_сотрудника ID_офиса` - закрепить за офисом.\n"
+                          "`/schedule ID ставка [дни]` - индивидуальный график, `/calendar [reload]` - норма месяца по производственному календарю.\n"
+                          "`/bank ID [дата]` - журнал банка времени сотрудника и остаток на дату.\n"
+                          "`/reportcache` - статистика кэша отчетов, `/flushcache` - очистить его.\n"
+                          "`/ratelimit` - сколько обновлений отброшено ограничением частоты.\n"
+                          "`/slowqueries [N|plan номер|reset]` - самые тяжелые SQL-запросы.\n"
+                          "`/report` - отчет по команде или по всей организации.\n"
+                          "`/export [self|team|tree|org] [csv|xlsx] ДД.ММ.ГГГГ - ДД.ММ.ГГГГ` - выгрузить отчет в файл.\n"
                           "`/help` - эта справка.")
         elif user_info and user_info['role'] == 'manager':
             help_text += ("**Вы — Руководитель.**\n\n"
                           "Команда `/start` вызовет ваше меню...\n"
+                          "Кнопка «Входящие запросы» в меню - все ожидающие решения запросы команды, их можно одобрить разом.\n"
+                          "`/find текст` - найти сотрудника своей команды.\n"
+                          "`/export team|tree [csv|xlsx] ДД.ММ.ГГГГ - ДД.ММ.ГГГГ` - выгрузить отчет по команде или всей структуре в файл.\n"
                           "`/help` - эта справка.")
         elif user_info and user_info['role'] == 'employee':
             help_text += ("**Вы — Сотрудник.**\n\n"
                           "- Начинайте и заканчивайте рабочий день кнопками.\n"
+                          "`/export [csv|xlsx] ДД.ММ.ГГГГ - ДД.ММ.ГГГГ` - выгрузить свой отчет в файл.\n"
                           "`/help` - эта справка.")
         else:
             help_text += "Ваш аккаунт не зарегистрирован. Пожалуйста, обратитесь к администратору."
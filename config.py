@@ -13,20 +13,95 @@ class BotConfig:
 
     # --- Настройки базы данных ---
     DATABASE_URL: str = os.getenv('DATABASE_URL')
+    DB_POOL_MIN: int = 2     # Соединения, которые открываются при старте
+    DB_POOL_MAX: int = 20    # Сверх этого открываются разовые соединения
+    USER_CACHE_TTL_SECONDS: int = 300  # Сколько профиль пользователя живет в кэше памяти
 
     # --- Настройки времени и работы ---
     TIMEZONE: str = 'Asia/Barnaul'
     DAILY_BREAK_LIMIT_SECONDS: int = 3600  # 1 час
-    MIN_WORK_SECONDS: int = 8 * 3600    # 8 часов
+    MIN_WORK_SECONDS: int = 8 * 3600    # 8 часов - длительность полного рабочего дня по календарю
+    SHORT_DAY_REDUCTION_SECONDS: int = 3600  # Сокращение предпраздничного дня
+    WORK_CALENDAR_PATH: str = os.getenv('WORK_CALENDAR_PATH', 'work_calendar.json')
 
-    # --- Настройки геолокации офиса ---
+    # --- Настройки аналитики ---
+    WORKDAY_START_TIME: str = '09:00'   # Начало рабочего дня для расчета опозданий
+    LATENESS_GRACE_MINUTES: int = 5     # Опоздание меньше этого не считается
+
+    # --- Офис по умолчанию (добавляется в таблицу offices при первом запуске) ---
     OFFICE_LATITUDE: float = 53.356422
     OFFICE_LONGITUDE: float = 83.771422
     OFFICE_RADIUS_METERS: int = 1500
 
+    # --- Ночное закрытие забытых сессий ---
+    STALE_SESSION_MAX_SECONDS: int = 12 * 3600  # Максимум, который засчитывается за забытую сессию
+    NOTIFY_BATCH_SIZE: int = 25                 # Сообщений в одной пачке рассылки
+    NOTIFY_BATCH_DELAY_SECONDS: float = 1.0     # Пауза между пачками
+
+    # --- Утренняя сводка для руководителей ---
+    MANAGER_DIGEST_ENABLED: bool = True
+    MANAGER_DIGEST_TIME: str = '09:30'  # Локальное время рассылки, ЧЧ:ММ
+
+    # --- Банк времени ---
+    TIME_BANK_RECENT_ENTRIES: int = 10   # Сколько последних операций показывать сотруднику
+    TIME_BANK_CHECKPOINT_TIME: str = '01:00'  # 1-го числа: остатки на начало месяца для запросов "на дату"
+
+    # --- Входящие запросы руководителя ---
+    REQUEST_INBOX_LIMIT: int = 30    # Запросов на одном экране (по кнопке выбора на каждый)
+
+    # --- Фоновое построение отчетов ---
+    REPORT_WORKERS: int = 4          # Одновременно строящихся отчетов (и занятых ими соединений с БД)
+    REPORT_QUEUE_LIMIT: int = 50     # Максимум отчетов в очереди, остальные запросы отклоняются
+
+    # --- Повторные нажатия кнопок ---
+    CALLBACK_DEDUP_WINDOW_SECONDS: float = 3.0  # Одинаковое нажатие на ту же кнопку в этом окне считается дубликатом
+    CALLBACK_DEDUP_MAX_ENTRIES: int = 10000
+
+    # --- Ограничение частоты обновлений от одного пользователя ---
+    # роль -> (обновлений в секунду в среднем, запас подряд); лишние обновления отбрасываются до обработчиков
+    RATE_LIMITS: dict = {
+        'employee': (1.0, 10),
+        'manager': (2.0, 20),
+        'admin': (5.0, 50),
+    }
+    RATE_LIMIT_MAX_ENTRIES: int = 50000
+
+    # --- Сохранение диалогов между перезапусками ---
+    PERSISTENCE_UPDATE_INTERVAL_SECONDS: float = 10.0  # Как часто изменения диалогов и user_data пишутся в БД
+
+    # --- Несколько рабочих процессов ---
+    # При BOT_WORKERS > 1 процесс-приемник получает обновления и раздает их рабочим процессам
+    # по user_id; у каждого рабочего свой пул соединений (до DB_POOL_MAX) и свой порт метрик (METRICS_PORT + номер)
+    WORKER_COUNT: int = int(os.getenv('BOT_WORKERS', '1'))
+    WEBHOOK_URL: str = os.getenv('WEBHOOK_URL', '')   # Пусто - приемник работает через long polling
+    WEBHOOK_LISTEN: str = '0.0.0.0'
+    WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WORKER_STOP_TIMEOUT_SECONDS: int = 30     # Сколько ждать завершения рабочего процесса при остановке
+
+    # --- Список пользователей ---
+    USERS_PAGE_SIZE: int = 20
+
+    # --- Длинные сообщения ---
+    MESSAGE_CHUNK_LIMIT: int = 4000      # Telegram ограничивает сообщение 4096 символами
+    LONG_MESSAGE_BATCH_SIZE: int = 5     # Частей одного отчета между паузами
+
+    # --- Метрики (Prometheus) ---
+    METRICS_ENABLED: bool = os.getenv('METRICS_ENABLED', '0') == '1'
+    METRICS_HOST: str = '127.0.0.1'   # Эндпоинт слушает только локально
+    METRICS_PORT: int = 9108
+
+    # --- Трассировка SQL-запросов ---
+    DB_TRACE_ENABLED: bool = os.getenv('DB_TRACE_ENABLED', '0') == '1'
+    DB_SLOW_QUERY_MS: int = 200                 # Запросы дольше этого пишутся в лог
+    DB_EXPLAIN_SLOW_QUERIES: bool = True        # Снимать EXPLAIN (ANALYZE, BUFFERS) для медленных SELECT
+    DB_EXPLAIN_INTERVAL_SECONDS: int = 300      # Не чаще раза в этот интервал для одного запроса
+
     # --- Настройки логирования ---
     LOG_LEVEL: str = 'INFO'
     LOG_FILE_PATH: str = '/root/hr-time-bot/bot.log'
+    LOG_MAX_BYTES: int = 10 * 1024 * 1024   # Размер файла лога до ротации
+    LOG_BACKUP_COUNT: int = 5               # Сколько старых файлов хранить
+    LOG_SAMPLE_PER_MINUTE: int = 30         # Частые сообщения "на каждое нажатие": не больше стольких в минуту на шаблон
 
     # --- Словари для маппинга ---
     ABSENCE_TYPE_MAP: dict = {
@@ -37,6 +112,18 @@ class BotConfig:
         'request_remote_work': 'Удаленная работа',
         'request_day_off': 'Отгул'
     }
+    TIME_BANK_REASON_MAP: dict = {
+        'opening_balance': 'Начальный остаток',
+        'unused_break': 'Неиспользованный перерыв',
+        'early_leave': 'Ранний уход за счет банка',
+        'banking_work': 'Работа в банк времени',
+        'banking_auto_closed': 'Работа в банк (закрыта автоматически)',
+    }
+    REQUEST_STATUS_MAP: dict = {
+        'approved': '✅ Одобрено',
+        'denied': '❌ Отклонено',
+        'acknowledged': '👌 Принято к сведению',
+    }
 
 CONFIG = BotConfig()
 LOCAL_TZ = pytz.timezone(CONFIG.TIMEZONE)
\ No newline at end of file
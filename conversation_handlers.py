@@ -1,14 +1,16 @@
 # Файл: conversation_handlers.py
-import re, datetime, logging, csv, io
-from math import radians, sin, cos, sqrt, atan2
+import logging, csv, io
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, CallbackQueryHandler, filters, CommandHandler
 import database as db
 from config import CONFIG
 from menu_generator import MenuGenerator
-from report_generator import ReportGenerator
 from command_handlers import CommandHandlerManager
 from constants import GET_DATES_TEXT, GET_REPORT_DATES, GET_LOCATION, GET_USERS_FILE
+from report_jobs import schedule_period_report, report_status_text
+from geofence import geofence_index
+from logging_setup import SAMPLED
+from utils import parse_dates
 
 logger = logging.getLogger(__name__)
 
@@ -30,11 +32,10 @@ async def process_dates_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
     absence_type_key = context.user_data.get('absence_type')
     absence_name = CONFIG.ABSENCE_TYPE_MAP.get(absence_type_key, "Отсутствие")
     try:
-        found_dates = re.findall(r'\b(\d{1,2})\.(\d{1,2})\.(\d{2,4})\b', user_input)
-        if not found_dates:
+        parsed_dates = parse_dates(user_input)
+        if not parsed_dates:
             await update.message.reply_text("Не могу найти ни одной даты. Попробуйте формат: ДД.ММ.ГГГГ или введите /cancel.")
             return GET_DATES_TEXT
-        parsed_dates = [datetime.date(int(y if len(y)==4 else f"20{y}"), int(m), int(d)) for d, m, y in found_dates]
         start_date, end_date = min(parsed_dates), max(parsed_dates)
         user_info = db.get_user(user.id)
         if not user_info:
@@ -67,7 +68,7 @@ async def process_dates_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
         context.user_data.clear()
         return ConversationHandler.END
     except (ValueError, TypeError) as e:
-        logger.error(f"Ошибка парсинга даты: {e}")
+        logger.error("Ошибка парсинга даты: %s", e)
         await update.message.reply_text("Неверный формат даты. Попробуйте еще раз (ДД.ММ.ГГГГ) или введите /cancel.")
         return GET_DATES_TEXT
 
@@ -83,21 +84,18 @@ async def process_report_dates(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = update.effective_user.id
     report_type = context.user_data.get('report_type')
     try:
-        found_dates = re.findall(r'\b(\d{1,2})\.(\d{1,2})\.(\d{2,4})\b', update.message.text)
-        if not found_dates:
+        parsed_dates = parse_dates(update.message.text)
+        if not parsed_dates:
             await update.message.reply_text("Не могу найти дат. Попробуйте формат: ДД.ММ.ГГГГ - ДД.ММ.ГГГГ или /cancel")
             return GET_REPORT_DATES
-        parsed_dates = [datetime.date(int(y if len(y)==4 else f"20{y}"), int(m), int(d)) for d, m, y in found_dates]
         start_date, end_date = min(parsed_dates), max(parsed_dates)
         await update.message.delete()
-        if report_type == 'manager':
-            report_text = await ReportGenerator.get_manager_report_text(user_id, start_date, end_date)
-            reply_markup = MenuGenerator.get_manager_menu()
-        else:
-            report_text = await ReportGenerator.get_employee_report_text(user_id, start_date, end_date)
-            is_in_session = bool(db.get_session_state(user_id))
-            reply_markup = MenuGenerator.get_working_menu() if is_in_session else await MenuGenerator.get_main_menu(user_id)
-        await context.bot.send_message(user_id, report_text, parse_mode='Markdown', reply_markup=reply_markup)
+        if report_type == 'org' and user_id not in CONFIG.ADMIN_IDS:
+            report_type = 'manager'
+        if report_type not in ['org', 'manager', 'tree']:
+            report_type = 'employee'
+        result = schedule_period_report(context.bot, user_id, report_type, start_date, end_date)
+        await context.bot.send_message(user_id, report_status_text(result))
         return ConversationHandler.END
     except (ValueError, TypeError):
         await update.message.reply_text("Неверный формат. Попробуйте еще раз или введите /cancel")
@@ -120,25 +118,20 @@ async def ask_for_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def process_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user, user_location = update.effective_user, update.message.location
     await update.message.reply_text("Проверяем вашу геолокацию...", reply_markup=ReplyKeyboardRemove())
-    user_info = db.get_user(user.id)
-    if not user_info or not all([user_info.get('office_latitude'), user_info.get('office_longitude')]):
+    if not len(geofence_index):
         await update.message.reply_text("Ошибка: Координаты офиса не настроены. Обратитесь к администратору.")
         return ConversationHandler.END
-    office_lat, office_lon = user_info['office_latitude'], user_info['office_longitude']
     user_lat, user_lon = user_location.latitude, user_location.longitude
-    logger.info(f"Проверка геолокации для user_id {user.id}:\nОфис: {office_lat}, {office_lon}\nПользователь: {user_lat}, {user_lon}")
-    R = 6371.0
-    lat1_rad, lon1_rad, lat2_rad, lon2_rad = map(radians, [office_lat, office_lon, user_lat, user_lon])
-    dlon, dlat = lon2_rad - lon1_rad, lat2_rad - lat1_rad
-    a = sin(dlat / 2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    distance_m = R * c * 1000
-    logger.info(f"Рассчитанное расстояние: {distance_m:.2f} метров.")
-    if distance_m <= user_info.get('office_radius_meters', CONFIG.OFFICE_RADIUS_METERS):
+    match = geofence_index.match(user_lat, user_lon)
+    if match:
+        office, distance_m = match
+        logger.info("Геолокация user_id %s (%s, %s): офис %s, %.2f м.", user.id, user_lat, user_lon, office['office_id'], distance_m, extra=SAMPLED)
         from utils import start_work_logic
-        await start_work_logic(update, context, user.id, is_remote=False)
+        await start_work_logic(update, context, user.id, is_remote=False, office=office)
     else:
-        await update.message.reply_text(f"Вы находитесь слишком далеко от офиса ({int(distance_m)} м). Пожалуйста, подойдите ближе.", reply_markup=await MenuGenerator.get_main_menu(user.id))
+        office, distance_m = geofence_index.nearest(user_lat, user_lon)
+        logger.info("Геолокация user_id %s (%s, %s) вне офисов, ближайший %s: %.2f м.", user.id, user_lat, user_lon, office['office_id'], distance_m, extra=SAMPLED)
+        await update.message.reply_text(f"Вы находитесь слишком далеко от офиса ({int(distance_m)} м до «{office['name']}»). Пожалуйста, подойдите ближе.", reply_markup=await MenuGenerator.get_main_menu(user.id))
     return ConversationHandler.END
 
 async def process_users_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -188,7 +181,7 @@ async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
     context.user_data.clear()
     return ConversationHandler.END
 
-absence_conv_handler = ConversationHandler(entry_points=[CallbackQueryHandler(ask_for_dates_text, pattern='^(request_remote_work|absence_sick|absence_vacation|absence_trip|request_day_off|absence_sick_child)$')], states={GET_DATES_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_dates_text)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
-report_conv_handler = ConversationHandler(entry_points=[CallbackQueryHandler(ask_for_report_dates, pattern='^report_custom_period_')], states={GET_REPORT_DATES: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_report_dates)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
-location_conv_handler = ConversationHandler(entry_points=[CallbackQueryHandler(ask_for_location, pattern='^start_work_office_location$')], states={GET_LOCATION: [MessageHandler(filters.LOCATION, process_location)]}, fallbacks=[CallbackQueryHandler(cancel_conversation, pattern='^cancel_action$'), CommandHandler('cancel', cancel_conversation)], per_message=False)
-upload_users_conv_handler = ConversationHandler(entry_points=[CommandHandler('upload_users', CommandHandlerManager.upload_users_start)],states={GET_USERS_FILE: [MessageHandler(filters.Document.ALL, process_users_file)]},fallbacks=[CommandHandler('cancel', cancel_conversation)],per_message=False)
\ No newline at end of file
+absence_conv_handler = ConversationHandler(entry_points=[CallbackQueryHandler(ask_for_dates_text, pattern='^(request_remote_work|absence_sick|absence_vacation|absence_trip|request_day_off|absence_sick_child)$')], states={GET_DATES_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_dates_text)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, name='absence', persistent=True)
+report_conv_handler = ConversationHandler(entry_points=[CallbackQueryHandler(ask_for_report_dates, pattern='^report_custom_period_')], states={GET_REPORT_DATES: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_report_dates)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, name='report_dates', persistent=True)
+location_conv_handler = ConversationHandler(entry_points=[CallbackQueryHandler(ask_for_location, pattern='^start_work_office_location$')], states={GET_LOCATION: [MessageHandler(filters.LOCATION, process_location)]}, fallbacks=[CallbackQueryHandler(cancel_conversation, pattern='^cancel_action$'), CommandHandler('cancel', cancel_conversation)], per_message=False, name='office_location', persistent=True)
+upload_users_conv_handler = ConversationHandler(entry_points=[CommandHandler('upload_users', CommandHandlerManager.upload_users_start)],states={GET_USERS_FILE: [MessageHandler(filters.Document.ALL, process_users_file)]},fallbacks=[CommandHandler('cancel', cancel_conversation)],per_message=False, name='upload_users', persistent=True)
\ No newline at end of file
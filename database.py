@@ -2,39 +2,154 @@
 # Этот модуль содержит все функции для взаимодействия с базой данных PostgreSQL.
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+import psycopg2.pool
+from psycopg2.extras import RealDictCursor, execute_values
 import json
 import datetime
 import logging
+import threading
+import weakref
 from contextlib import contextmanager
 from typing import Dict, Any, List, Optional
 from config import CONFIG, LOCAL_TZ
+from report_cache import report_cache
+from user_search import user_search_index
+from geofence import geofence_index
+from metrics import instrument_module_functions
+from db_tracing import TracingConnection, query_tracer
+from state_cache import MISSING, state_cache
+from timezones import timezones
 
 logger = logging.getLogger(__name__)
 
+query_tracer.configure(CONFIG.DB_SLOW_QUERY_MS, CONFIG.DB_EXPLAIN_SLOW_QUERIES, CONFIG.DB_EXPLAIN_INTERVAL_SECONDS)
+_CONNECTION_FACTORY = TracingConnection if CONFIG.DB_TRACE_ENABLED else None
+state_cache.user_ttl = CONFIG.USER_CACHE_TTL_SECONDS
+
+SCHEMA_VERSION = 5  # Увеличивается при каждом изменении DDL в init_db
+
+_pool: Optional[psycopg2.pool.ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(CONFIG.DB_POOL_MIN, CONFIG.DB_POOL_MAX, CONFIG.DATABASE_URL,
+                                                             connection_factory=_CONNECTION_FACTORY)
+    return _pool
+
+def close_pool():
+    """Закрывает все соединения пула (следующий запрос откроет новый пул)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+# Строка users в кэше профилей (state_cache); колонки перечислены явно, потому что запрос готовится через PREPARE:
+# с "SELECT *" после ALTER TABLE users подготовленный оператор падал бы с "cached plan must not change result type"
+USER_COLUMNS = ("user_id, full_name, role, manager_id_1, manager_id_2, time_bank_seconds, office_latitude, office_longitude, "
+                "office_radius_meters, timezone, office_id, work_rate, work_weekdays")
+
+# Частые запросы, которые после прогрева выполняются как серверные подготовленные операторы
+HOT_STATEMENTS = {
+    'hot_get_user': f"SELECT {USER_COLUMNS} FROM users WHERE user_id = %s",
+    'hot_get_session': "SELECT state_json FROM work_sessions WHERE user_id = %s",
+    'hot_set_session': "INSERT INTO work_sessions (user_id, state_json) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET state_json = EXCLUDED.state_json",
+    'hot_delete_session': "DELETE FROM work_sessions WHERE user_id = %s",
+    'hot_absences_on_date': "SELECT absence_id, user_id, absence_type, start_date, end_date FROM absences WHERE user_id = %s AND start_date <= %s AND end_date >= %s",
+    'hot_todays_work_log': "SELECT log_id, user_id, start_time, end_time, total_work_seconds, total_break_seconds, work_type, office_id FROM work_log "
+                           "WHERE user_id = %s AND start_time >= %s ORDER BY end_time DESC LIMIT 1",
+}
+_hot_statements_enabled = False  # Включается в warm_up, когда схема уже создана
+_prepared_connections = weakref.WeakSet()
+
+def _prepare_hot_statements(conn):
+    with conn.cursor() as cursor:
+        for name, query in HOT_STATEMENTS.items():
+            positional = query
+            for number in range(1, query.count('%s') + 1):
+                positional = positional.replace('%s', f'${number}', 1)
+            cursor.execute(f"PREPARE {name} AS {positional}")
+    conn.commit()
+    _prepared_connections.add(conn)
+
+def _execute_hot(cursor, name: str, params: tuple):
+    """Выполняет запрос из HOT_STATEMENTS: через EXECUTE, если соединение уже подготовлено, иначе обычным SQL."""
+    if cursor.connection in _prepared_connections:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(HOT_STATEMENTS[name], params)
+
 @contextmanager
 def db_connection():
-    """Контекстный менеджер для безопасных транзакций с базой данных."""
-    conn = None
+    """
+    Контекстный менеджер для безопасных транзакций с базой данных.
+    Соединение берется из пула и возвращается в него; если пул исчерпан, открывается разовое соединение.
+    """
+    conn, pooled, broken = None, False, False
     try:
-        conn = psycopg2.connect(CONFIG.DATABASE_URL)
+        try:
+            conn = _get_pool().getconn()
+            pooled = True
+        except psycopg2.pool.PoolError:
+            logger.warning("Пул соединений исчерпан (%s), открываю отдельное соединение.", CONFIG.DB_POOL_MAX)
+            conn = psycopg2.connect(CONFIG.DATABASE_URL, connection_factory=_CONNECTION_FACTORY)
+        if pooled and _hot_statements_enabled and conn not in _prepared_connections:
+            _prepare_hot_statements(conn)
         yield conn
         conn.commit()
-    except psycopg2.Error as e:
-        if conn: conn.rollback()
-        logger.error(f"Ошибка транзакции с БД: {e}")
+    except BaseException as e:
+        # В пул соединение должно вернуться без открытой транзакции
+        if conn and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if isinstance(e, psycopg2.Error):
+            logger.error("Ошибка транзакции с БД: %s", e)
+            broken = broken or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
         raise
     finally:
-        if conn: conn.close()
+        if conn is not None:
+            if pooled:
+                _pool.putconn(conn, close=broken or bool(conn.closed))
+            else:
+                conn.close()
+
+def _get_schema_version(cursor) -> int:
+    try:
+        cursor.execute("SELECT version FROM schema_version")
+    except psycopg2.errors.UndefinedTable:
+        cursor.connection.rollback()
+        return 0
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+# Часовой пояс сотрудника в SQL; требует "users u LEFT JOIN offices o ON o.office_id = u.office_id"
+USER_TZ_SQL = "COALESCE(u.timezone, o.timezone, %(tz)s)"
+
+def _user_tz(user_id: int) -> datetime.tzinfo:
+    return timezones.for_user(get_user(user_id))
 
 def init_db(drop_existing=False):
-    """Инициализирует базу данных, создавая таблицы, если их нет."""
-    tables = ['users', 'work_sessions', 'requests', 'work_log', 'work_debt', 'debt_log', 'absences']
+    """
+    Инициализирует базу данных, создавая таблицы, если их нет.
+    Если версия схемы в базе уже совпадает с SCHEMA_VERSION, DDL не выполняется.
+    """
+    tables = ['schema_version', 'offices', 'users', 'user_hierarchy', 'work_sessions', 'requests', 'work_log', 'work_debt', 'debt_log', 'absences',
+              'time_bank_ledger', 'time_bank_checkpoints', 'bot_persistence']
     with db_connection() as conn:
         with conn.cursor() as cursor:
+            if not drop_existing and _get_schema_version(cursor) == SCHEMA_VERSION:
+                logger.info("Схема БД актуальна (версия %s), создание таблиц пропущено.", SCHEMA_VERSION)
+                return
             if drop_existing:
                 for table in reversed(tables):
-                    logger.warning(f"Удаление таблицы {table}...")
+                    logger.warning("Удаление таблицы %s...", table)
                     cursor.execute(f'DROP TABLE IF EXISTS {table} CASCADE')
 
             logger.info("Создание таблиц...")
@@ -94,16 +209,150 @@ def init_db(drop_existing=False):
                     start_date DATE, end_date DATE,
                     CONSTRAINT fk_user FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
                 )''')
-    logger.info("База данных успешно инициализирована.")
+
+            # Индексы для сводных запросов по всей организации
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_work_log_user_start ON work_log (user_id, start_time)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_absences_user_dates ON absences (user_id, start_date, end_date)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_status ON requests (status, requester_id)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_hierarchy (
+                    ancestor_id BIGINT NOT NULL, descendant_id BIGINT NOT NULL, depth INTEGER NOT NULL,
+                    PRIMARY KEY (ancestor_id, descendant_id)
+                )''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_hierarchy_descendant ON user_hierarchy (descendant_id)')
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM user_hierarchy), EXISTS (SELECT 1 FROM users)")
+            hierarchy_filled, users_exist = cursor.fetchone()
+            if users_exist and not hierarchy_filled:
+                logger.info("Заполнение таблицы иерархии подчинения...")
+                _refresh_hierarchy(cursor, None)
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS offices (
+                    office_id SERIAL PRIMARY KEY, name TEXT NOT NULL,
+                    latitude DOUBLE PRECISION NOT NULL, longitude DOUBLE PRECISION NOT NULL,
+                    radius_meters INTEGER NOT NULL
+                )''')
+            cursor.execute('ALTER TABLE work_log ADD COLUMN IF NOT EXISTS office_id INTEGER REFERENCES offices(office_id) ON DELETE SET NULL')
+            # Часовые пояса: личный пояс сотрудника важнее пояса его офиса, иначе берется пояс из конфига
+            cursor.execute('ALTER TABLE offices ADD COLUMN IF NOT EXISTS timezone TEXT')
+            cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS timezone TEXT')
+            cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS office_id INTEGER REFERENCES offices(office_id) ON DELETE SET NULL')
+            # Индивидуальный график: ставка (1.0 - полная) и ISO-дни недели ('135'); NULL - по производственному календарю
+            cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS work_rate REAL NOT NULL DEFAULT 1.0')
+            cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS work_weekdays TEXT')
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM offices)")
+            if not cursor.fetchone()[0]:
+                logger.info("Добавление основного офиса из конфигурации...")
+                cursor.execute("INSERT INTO offices (name, latitude, longitude, radius_meters) VALUES (%s, %s, %s, %s)",
+                               ('Основной офис', CONFIG.OFFICE_LATITUDE, CONFIG.OFFICE_LONGITUDE, CONFIG.OFFICE_RADIUS_METERS))
+
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_name_id ON users (full_name, user_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_role_name_id ON users (role, full_name, user_id)')
+
+            # Журнал банка времени: только добавление; users.time_bank_seconds - текущий остаток,
+            # time_bank_checkpoints - остатки на начало месяца для запросов "остаток на дату"
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS time_bank_ledger (
+                    entry_id BIGSERIAL PRIMARY KEY, user_id BIGINT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(), delta_seconds INTEGER NOT NULL,
+                    reason TEXT NOT NULL, source_ref TEXT,
+                    CONSTRAINT fk_user FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+                )''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_time_bank_ledger_user_created ON time_bank_ledger (user_id, created_at)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS time_bank_checkpoints (
+                    user_id BIGINT NOT NULL, as_of TIMESTAMPTZ NOT NULL, balance_seconds INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, as_of),
+                    CONSTRAINT fk_user FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+                )''')
+            # Остатки, накопленные до появления журнала, записываются одной начальной проводкой
+            cursor.execute('''
+                INSERT INTO time_bank_ledger (user_id, delta_seconds, reason)
+                SELECT u.user_id, u.time_bank_seconds, 'opening_balance' FROM users u
+                WHERE u.time_bank_seconds <> 0 AND NOT EXISTS (SELECT 1 FROM time_bank_ledger l WHERE l.user_id = u.user_id)''')
+
+            # Состояния диалогов и user_data (persistence.py): namespace - 'user_data' или 'conversation:<имя>'
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS bot_persistence (
+                    namespace TEXT NOT NULL, key TEXT NOT NULL, value JSONB NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (namespace, key)
+                )''')
+
+            cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+            cursor.execute('DELETE FROM schema_version')
+            cursor.execute('INSERT INTO schema_version (version) VALUES (%s)', (SCHEMA_VERSION,))
+    logger.info("База данных успешно инициализирована (версия схемы %s).", SCHEMA_VERSION)
+
+def warm_up() -> Dict[str, int]:
+    """
+    Прогрев перед приемом обновлений: открывает минимальный набор соединений пула,
+    готовит на них частые запросы и загружает в кэш активные сессии и пользователей.
+    """
+    global _hot_statements_enabled
+    _hot_statements_enabled = True
+    pool = _get_pool()
+    connections = [pool.getconn() for _ in range(CONFIG.DB_POOL_MIN)]
+    try:
+        for conn in connections:
+            if conn not in _prepared_connections:
+                _prepare_hot_statements(conn)
+    finally:
+        for conn in connections:
+            pool.putconn(conn)
+
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("SELECT user_id, state_json FROM work_sessions")
+            sessions = {row['user_id']: _deserialize_state(row['state_json']) for row in cursor.fetchall() if row['state_json']}
+            cursor.execute(f"SELECT {USER_COLUMNS} FROM users")
+            users = cursor.fetchall()
+    state_cache.load_sessions(sessions)
+    state_cache.load_users(users)
+    return {'connections': len(connections), 'sessions': len(sessions), 'users': len(users)}
+
+HIERARCHY_MAX_DEPTH = 32  # Защита от циклов в назначении руководителей
+
+def _refresh_hierarchy(cursor, user_ids: Optional[List[int]]):
+    """
+    Пересчитывает в таблице-замыкании user_hierarchy все пути "руководитель -> подчиненный"
+    для сотрудников user_ids (None - для всех). Пути строятся подъемом по manager_id_1/manager_id_2,
+    при нескольких путях хранится кратчайший.
+    """
+    if user_ids is None:
+        cursor.execute("DELETE FROM user_hierarchy")
+    else:
+        cursor.execute("DELETE FROM user_hierarchy WHERE descendant_id = ANY(%s)", (user_ids,))
+    cursor.execute("""
+        WITH RECURSIVE up(descendant_id, ancestor_id, depth) AS (
+            SELECT user_id, user_id, 0 FROM users
+            WHERE %(user_ids)s::bigint[] IS NULL OR user_id = ANY(%(user_ids)s::bigint[])
+            UNION
+            SELECT up.descendant_id, m.manager_id, up.depth + 1
+            FROM up
+            JOIN users u ON u.user_id = up.ancestor_id
+            CROSS JOIN LATERAL (VALUES (u.manager_id_1), (u.manager_id_2)) AS m(manager_id)
+            WHERE m.manager_id IS NOT NULL AND up.depth < %(max_depth)s
+        )
+        INSERT INTO user_hierarchy (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM up GROUP BY ancestor_id, descendant_id
+    """, {'user_ids': user_ids, 'max_depth': HIERARCHY_MAX_DEPTH})
+
+def _get_subtree_ids(cursor, user_id: int) -> List[int]:
+    cursor.execute("SELECT descendant_id FROM user_hierarchy WHERE ancestor_id = %s AND depth > 0", (user_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+def rebuild_user_hierarchy():
+    """Полностью пересобирает таблицу иерархии подчинения."""
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            _refresh_hierarchy(cursor, None)
 
 def get_absences_for_user(user_id: int, check_date: datetime.date) -> List[Dict]:
     """Находит активные отсутствия для пользователя на КОНКРЕТНУЮ ДАТУ."""
     with db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "SELECT * FROM absences WHERE user_id = %s AND start_date <= %s AND end_date >= %s",
-                (user_id, check_date, check_date)
-            )
+            _execute_hot(cursor, 'hot_absences_on_date', (user_id, check_date, check_date))
             return cursor.fetchall()
 
 def get_absences_for_user_in_period(user_id: int, start_date: datetime.date, end_date: datetime.date) -> List[Dict]:
@@ -122,10 +371,10 @@ def get_absences_for_user_in_period(user_id: int, start_date: datetime.date, end
 
 def get_todays_work_log_for_user(user_id: int) -> Optional[Dict]:
     """Получает последний лог работы для пользователя за сегодня."""
-    today_start = datetime.datetime.now(LOCAL_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    today_start, _ = timezones.day_bounds(_user_tz(user_id))
     with db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM work_log WHERE user_id = %s AND start_time >= %s ORDER BY end_time DESC LIMIT 1", (user_id, today_start))
+            _execute_hot(cursor, 'hot_todays_work_log', (user_id, today_start))
             return cursor.fetchone()
 
 def update_request_messages(request_id: int, msg1_id: int = None, msg2_id: int = None):
@@ -144,20 +393,23 @@ def set_session_state(user_id: int, state_data: Dict[str, Any]):
                 if isinstance(value, datetime.datetime):
                     state_copy[key] = value.isoformat()
             state_data_serializable = json.dumps(state_copy)
-            cursor.execute(
-                "INSERT INTO work_sessions (user_id, state_json) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET state_json = EXCLUDED.state_json",
-                (user_id, state_data_serializable)
-            )
+            _execute_hot(cursor, 'hot_set_session', (user_id, state_data_serializable))
+    state_cache.put_session(user_id, state_data)
 
 def get_session_state(user_id: int) -> Optional[Dict]:
+    cached = state_cache.get_session(user_id)
+    if cached is not MISSING:
+        return cached
     with db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT state_json FROM work_sessions WHERE user_id = %s", (user_id,))
+            _execute_hot(cursor, 'hot_get_session', (user_id,))
             row = cursor.fetchone()
-    if not row or not row['state_json']:
-        return None
-        
-    state_data = row['state_json']
+    state = _deserialize_state(row['state_json']) if row and row['state_json'] else None
+    state_cache.put_session(user_id, state)
+    return state
+
+def _deserialize_state(state_data: Dict) -> Dict:
+    """Превращает строки с временем из state_json обратно в datetime в локальной таймзоне."""
     for key, value in state_data.items():
         if 'time' in key and isinstance(value, str):
             try:
@@ -179,12 +431,27 @@ def add_or_update_user(user_id: int, full_name: str, role: str = 'employee', man
                 full_name = EXCLUDED.full_name, role = EXCLUDED.role, 
                 manager_id_1 = EXCLUDED.manager_id_1, manager_id_2 = EXCLUDED.manager_id_2;
                 """, (user_id, full_name, role, manager_id_1, manager_id_2, current_bank, CONFIG.OFFICE_LATITUDE, CONFIG.OFFICE_LONGITUDE, CONFIG.OFFICE_RADIUS_METERS))
+            # Смена руководителя меняет пути для самого сотрудника и всех его подчиненных
+            _refresh_hierarchy(cursor, [user_id] + _get_subtree_ids(cursor, user_id))
+            cursor.execute("SELECT ancestor_id FROM user_hierarchy WHERE descendant_id = %s AND depth > 0", (user_id,))
+            new_managers = {row[0] for row in cursor.fetchall()}
+    user_search_index.upsert(user_id, full_name)
+    state_cache.invalidate_user(user_id)
+    report_cache.invalidate_user(user_id)
+    # Отчеты новых руководителей (всех уровней) сотрудника еще не учитывают
+    for manager_id in new_managers | ({manager_id_1, manager_id_2} - {None}):
+        report_cache.invalidate_subject(manager_id)
     
 def get_user(user_id: int) -> Optional[Dict]:
+    cached = state_cache.get_user(user_id)
+    if cached is not MISSING:
+        return cached
     with db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
-            return cursor.fetchone()
+            _execute_hot(cursor, 'hot_get_user', (user_id,))
+            row = cursor.fetchone()
+    state_cache.put_user(user_id, row)
+    return row
 
 def get_all_users() -> List[Dict]:
     with db_connection() as conn:
@@ -192,15 +459,54 @@ def get_all_users() -> List[Dict]:
             cursor.execute("SELECT user_id, full_name, role FROM users ORDER BY full_name")
             return cursor.fetchall()
     
-def get_managed_users(manager_id: int) -> List[Dict]:
+def get_users_page(role: Optional[str] = None, anchor_id: Optional[int] = None, direction: str = 'a', limit: int = 20) -> List[Dict]:
+    """
+    Возвращает страницу пользователей по ключу (full_name, user_id), не более limit + 1 строки
+    (лишняя строка показывает, что дальше есть еще записи). Строки всегда упорядочены по возрастанию.
+    direction: 'a' - начиная с anchor_id включительно, 'n' - после anchor_id, 'p' - перед anchor_id.
+    """
+    conditions, params = [], {'limit': limit + 1, 'anchor_id': anchor_id, 'role': role}
+    if role:
+        conditions.append("role = %(role)s")
+    order = "ASC"
+    if anchor_id is not None:
+        operator = {'a': '>=', 'n': '>', 'p': '<'}[direction]
+        conditions.append(f"(full_name, user_id) {operator} (SELECT full_name, user_id FROM users WHERE user_id = %(anchor_id)s)")
+        if direction == 'p':
+            order = "DESC"
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT user_id, full_name, role FROM users {where} ORDER BY full_name {order}, user_id {order} LIMIT %(limit)s"
     with db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT user_id, full_name FROM users WHERE manager_id_1 = %s OR manager_id_2 = %s", (manager_id, manager_id))
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+    if order == "DESC":
+        # Лишняя строка при движении назад оказывается в начале страницы
+        rows.reverse()
+    return rows
+
+def get_managed_users(manager_id: int, max_depth: Optional[int] = 1) -> List[Dict]:
+    """
+    Возвращает подчиненных руководителя. max_depth=1 - только прямые подчиненные,
+    N - до N уровней вниз, None - вся структура (выбирается одним запросом по таблице иерархии).
+    """
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            if max_depth == 1:
+                cursor.execute("SELECT user_id, full_name, work_rate, work_weekdays, timezone, office_id FROM users WHERE manager_id_1 = %s OR manager_id_2 = %s", (manager_id, manager_id))
+            else:
+                cursor.execute("""
+                    SELECT u.user_id, u.full_name, u.work_rate, u.work_weekdays, u.timezone, u.office_id, h.depth
+                    FROM user_hierarchy h JOIN users u ON u.user_id = h.descendant_id
+                    WHERE h.ancestor_id = %s AND h.depth >= 1 AND (%s::int IS NULL OR h.depth <= %s::int)
+                    ORDER BY h.depth, u.full_name
+                """, (manager_id, max_depth, max_depth))
             return cursor.fetchall()
 
 def delete_user(user_id: int):
     with db_connection() as conn:
         with conn.cursor() as cursor:
+            former_subtree = _get_subtree_ids(cursor, user_id)
             cursor.execute("DELETE FROM work_sessions WHERE user_id = %s", (user_id,))
             cursor.execute("DELETE FROM requests WHERE requester_id = %s", (user_id,))
             cursor.execute("DELETE FROM work_log WHERE user_id = %s", (user_id,))
@@ -208,6 +514,14 @@ def delete_user(user_id: int):
             cursor.execute("DELETE FROM debt_log WHERE user_id = %s", (user_id,))
             cursor.execute("DELETE FROM absences WHERE user_id = %s", (user_id,))
             cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+            cursor.execute("DELETE FROM user_hierarchy WHERE ancestor_id = %s OR descendant_id = %s", (user_id, user_id))
+            if former_subtree:
+                _refresh_hierarchy(cursor, former_subtree)
+    user_search_index.remove(user_id)
+    state_cache.put_session(user_id, None)
+    state_cache.invalidate_user(user_id)
+    report_cache.invalidate_user(user_id)
+    report_cache.invalidate_subject(user_id)
 
 def create_request(requester_id: int, request_type: str, request_data: Dict, msg_id_1: int = None, msg_id_2: int = None) -> int:
     with db_connection() as conn:
@@ -218,50 +532,217 @@ def create_request(requester_id: int, request_type: str, request_data: Dict, msg
             )
             return cursor.fetchone()[0]
 
-def get_request(request_id: int) -> Optional[Dict]:
-    with db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM requests WHERE request_id = %s", (request_id,))
-            return cursor.fetchone()
+# Запросы-уведомления: их не одобряют, а принимают к сведению
+ACK_REQUEST_TYPES = ['banking_work']
 
-def update_request_status(request_id: int, status: str):
+def decide_requests(request_ids: List[int], status: str, manager_id: int = None) -> List[Dict]:
+    """
+    Одним UPDATE переводит ожидающие решения запросы в status ('approved' / 'denied' / 'acknowledged').
+    Запросы из ACK_REQUEST_TYPES всегда получают 'acknowledged'. manager_id ограничивает выборку
+    запросами его прямых подчиненных. Возвращает только запросы, решенные этим вызовом, вместе с
+    данными сотрудника и сообщениями руководителей: запрос, который уже решил второй руководитель, не вернется.
+    """
+    if not request_ids:
+        return []
+    query = """
+        UPDATE requests r
+        SET status = CASE WHEN r.request_type = ANY(%(ack_types)s) THEN 'acknowledged' ELSE %(status)s END
+        FROM users u
+        WHERE u.user_id = r.requester_id AND r.request_id = ANY(%(request_ids)s) AND r.status = 'pending'
+          AND (%(manager_id)s::bigint IS NULL OR %(manager_id)s::bigint IN (u.manager_id_1, u.manager_id_2))
+        RETURNING r.request_id, r.request_type, r.request_data, r.status, r.manager_1_message_id, r.manager_2_message_id,
+                  u.user_id AS requester_id, u.full_name, u.manager_id_1, u.manager_id_2
+    """
+    params = {'ack_types': ACK_REQUEST_TYPES, 'status': status, 'request_ids': list(request_ids), 'manager_id': manager_id}
     with db_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute("UPDATE requests SET status = %s WHERE request_id = %s", (status, request_id))
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            return sorted(cursor.fetchall(), key=lambda row: row['request_id'])
     
-def add_work_log(user_id: int, start_time: datetime.datetime, end_time: datetime.datetime, total_work_seconds: int, total_break_seconds: int, work_type: str):
+def add_work_log(user_id: int, start_time: datetime.datetime, end_time: datetime.datetime, total_work_seconds: int, total_break_seconds: int, work_type: str, office_id: int = None) -> int:
+    """Добавляет запись о работе и возвращает ее log_id."""
     with db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute(
-                "INSERT INTO work_log (user_id, start_time, end_time, total_work_seconds, total_break_seconds, work_type) VALUES (%s, %s, %s, %s, %s, %s)",
-                (user_id, start_time, end_time, total_work_seconds, total_break_seconds, work_type)
+                # Офис мог быть удален, пока сессия была открыта: такая ссылка записывается как NULL
+                "INSERT INTO work_log (user_id, start_time, end_time, total_work_seconds, total_break_seconds, work_type, office_id) "
+                "VALUES (%s, %s, %s, %s, %s, %s, (SELECT office_id FROM offices WHERE office_id = %s)) RETURNING log_id",
+                (user_id, start_time, end_time, total_work_seconds, total_break_seconds, work_type, office_id)
             )
+            log_id = cursor.fetchone()[0]
+    report_cache.invalidate_user(user_id, start_time.astimezone(_user_tz(user_id)).date())
+    return log_id
+
+def get_offices() -> List[Dict]:
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("SELECT office_id, name, latitude, longitude, radius_meters, timezone FROM offices ORDER BY office_id")
+            return cursor.fetchall()
+
+def add_office(name: str, latitude: float, longitude: float, radius_meters: int, timezone: Optional[str] = None) -> Dict:
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                "INSERT INTO offices (name, latitude, longitude, radius_meters, timezone) VALUES (%s, %s, %s, %s, %s) RETURNING office_id, name, latitude, longitude, radius_meters, timezone",
+                (name, latitude, longitude, radius_meters, timezone)
+            )
+            office = cursor.fetchone()
+    geofence_index.upsert(office)
+    return office
+
+def set_office_timezone(office_id: int, timezone: Optional[str]) -> Optional[Dict]:
+    """Меняет часовой пояс офиса (None - пояс из конфига). Возвращает офис или None, если его нет."""
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("UPDATE offices SET timezone = %s WHERE office_id = %s RETURNING office_id, name, latitude, longitude, radius_meters, timezone",
+                           (timezone, office_id))
+            office = cursor.fetchone()
+    if office:
+        geofence_index.upsert(office)
+        # Сдвигаются границы суток у всех сотрудников офиса
+        report_cache.clear()
+    return office
+
+def set_user_timezone(user_id: int, timezone: Optional[str]) -> bool:
+    """Задает сотруднику личный часовой пояс (None - брать пояс закрепленного офиса)."""
+    return _update_user_location(user_id, "timezone = %s", timezone)
+
+def set_user_schedule(user_id: int, work_rate: float, work_weekdays: Optional[str]) -> bool:
+    """Задает ставку и дни недели графика (None - по производственному календарю)."""
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE users SET work_rate = %s, work_weekdays = %s WHERE user_id = %s", (work_rate, work_weekdays, user_id))
+            updated = cursor.rowcount > 0
+    state_cache.invalidate_user(user_id)
+    report_cache.invalidate_user(user_id)
+    return updated
+
+def set_user_office(user_id: int, office_id: Optional[int]) -> bool:
+    """Закрепляет сотрудника за офисом, от которого берется часовой пояс (None - открепить)."""
+    return _update_user_location(user_id, "office_id = %s", office_id)
+
+def _update_user_location(user_id: int, assignment: str, value) -> bool:
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"UPDATE users SET {assignment} WHERE user_id = %s", (value, user_id))
+            updated = cursor.rowcount > 0
+    state_cache.invalidate_user(user_id)
+    report_cache.invalidate_user(user_id)
+    return updated
+
+def delete_office(office_id: int) -> bool:
+    """
+    Удаляет офис. В той же транзакции office_id убирается из открытых сессий: иначе их закрытие
+    записало бы в work_log ссылку на несуществующий офис и нарушило внешний ключ.
+    """
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE work_sessions SET state_json = state_json - 'office_id' WHERE (state_json->>'office_id')::int = %s RETURNING user_id",
+                           (office_id,))
+            session_user_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT user_id FROM users WHERE office_id = %s", (office_id,))
+            assigned_user_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("DELETE FROM offices WHERE office_id = %s", (office_id,))
+            deleted = cursor.rowcount > 0
+    geofence_index.remove(office_id)
+    for user_id in session_user_ids:
+        state_cache.invalidate_session(user_id)
+    for user_id in assigned_user_ids:
+        # Закрепление снято внешним ключом (ON DELETE SET NULL), часовой пояс теперь из конфига
+        state_cache.invalidate_user(user_id)
+    if assigned_user_ids:
+        report_cache.clear()
+    return deleted
 
 def get_work_logs_for_user(user_id: int, start_date: str, end_date: str) -> List[Dict]:
+    """Логи работы, начатые с полуночи start_date до полуночи end_date в поясе сотрудника."""
+    tz_name = _user_tz(user_id).zone
     with db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM work_log WHERE user_id = %s AND start_time >= %s AND start_time < %s", (user_id, start_date, end_date))
+            cursor.execute("SELECT * FROM work_log WHERE user_id = %s AND start_time >= (%s::date::timestamp AT TIME ZONE %s) AND start_time < (%s::date::timestamp AT TIME ZONE %s)",
+                           (user_id, start_date, tz_name, end_date, tz_name))
             return cursor.fetchall()
 
 def add_work_debt(user_id: int, debt_seconds: int):
     with db_connection() as conn:
         with conn.cursor() as cursor:
-            today_date = datetime.date.today()
+            today_date = timezones.today(_user_tz(user_id))
             cursor.execute("INSERT INTO work_debt (user_id, debt_seconds, date_incurred) VALUES (%s, %s, %s)", (user_id, debt_seconds, today_date))
+    report_cache.invalidate_user(user_id, today_date)
 
 def get_total_debt(user_id: int) -> int:
     with db_connection() as conn:
         with conn.cursor() as cursor:
-            today = datetime.date.today()
+            today = timezones.today(_user_tz(user_id))
             first_day_of_month = today.replace(day=1)
             cursor.execute("SELECT SUM(debt_seconds) FROM work_debt WHERE user_id = %s AND status = 'pending' AND date_incurred >= %s", (user_id, first_day_of_month))
             result = cursor.fetchone()
             return result[0] if result and result[0] else 0
 
-def update_time_bank(user_id: int, seconds_to_add: int):
+def update_time_bank(user_id: int, seconds_to_add: int, reason: str, source_ref: Optional[str] = None) -> Optional[int]:
+    """
+    Проводка по банку времени: запись в журнал и изменение текущего остатка в одной транзакции.
+    reason - ключ из CONFIG.TIME_BANK_REASON_MAP, source_ref - ссылка на источник (например, 'work_log:123').
+    Возвращает новый остаток или None, если пользователя нет.
+    """
     with db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("UPDATE users SET time_bank_seconds = time_bank_seconds + %s WHERE user_id = %s", (seconds_to_add, user_id))
+            cursor.execute("UPDATE users SET time_bank_seconds = time_bank_seconds + %s WHERE user_id = %s RETURNING time_bank_seconds", (seconds_to_add, user_id))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute("INSERT INTO time_bank_ledger (user_id, delta_seconds, reason, source_ref) VALUES (%s, %s, %s, %s)",
+                               (user_id, seconds_to_add, reason, source_ref))
+    state_cache.invalidate_user(user_id)
+    return row[0] if row else None
+
+def get_time_bank_entries(user_id: int, limit: int = 10) -> List[Dict]:
+    """Последние проводки по банку времени сотрудника, новые первыми."""
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("SELECT created_at, delta_seconds, reason, source_ref FROM time_bank_ledger WHERE user_id = %s ORDER BY created_at DESC, entry_id DESC LIMIT %s",
+                           (user_id, limit))
+            return cursor.fetchall()
+
+def get_time_bank_balance_as_of(user_id: int, moment: datetime.datetime) -> int:
+    """Остаток на момент moment: ближайшая предыдущая контрольная точка плюс проводки после нее (не больше месяца)."""
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                WITH checkpoint AS (
+                    SELECT as_of, balance_seconds FROM time_bank_checkpoints
+                    WHERE user_id = %(user_id)s AND as_of <= %(moment)s
+                    ORDER BY as_of DESC LIMIT 1
+                )
+                SELECT COALESCE((SELECT balance_seconds FROM checkpoint), 0) + COALESCE(SUM(l.delta_seconds), 0)
+                FROM time_bank_ledger l
+                WHERE l.user_id = %(user_id)s AND l.created_at < %(moment)s
+                  AND l.created_at >= COALESCE((SELECT as_of FROM checkpoint), '-infinity'::timestamptz)
+            """, {'user_id': user_id, 'moment': moment})
+            return cursor.fetchone()[0]
+
+def create_time_bank_checkpoints(as_of: datetime.datetime) -> int:
+    """
+    Записывает остатки всех сотрудников на момент as_of: предыдущая точка плюс проводки между точками.
+    Запускается после начала месяца с запасом, чтобы все транзакции с created_at < as_of уже были зафиксированы.
+    """
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                WITH previous AS (
+                    SELECT DISTINCT ON (user_id) user_id, as_of, balance_seconds
+                    FROM time_bank_checkpoints WHERE as_of < %(as_of)s
+                    ORDER BY user_id, as_of DESC
+                )
+                INSERT INTO time_bank_checkpoints (user_id, as_of, balance_seconds)
+                SELECT u.user_id, %(as_of)s,
+                       COALESCE(p.balance_seconds, 0) + COALESCE((
+                           SELECT SUM(l.delta_seconds) FROM time_bank_ledger l
+                           WHERE l.user_id = u.user_id AND l.created_at < %(as_of)s
+                             AND l.created_at >= COALESCE(p.as_of, '-infinity'::timestamptz)), 0)
+                FROM users u LEFT JOIN previous p ON p.user_id = u.user_id
+                ON CONFLICT (user_id, as_of) DO NOTHING
+            """, {'as_of': as_of})
+            return cursor.rowcount
     
 def clear_work_debt(user_id: int, seconds_to_clear: int):
     with db_connection() as conn:
@@ -279,16 +760,20 @@ def clear_work_debt(user_id: int, seconds_to_clear: int):
                     cleared_amount = 0
                 if cleared_amount <= 0:
                     break
+    report_cache.invalidate_user(user_id, timezones.today(_user_tz(user_id)))
 
 def add_debt_log(user_id: int, start_time: datetime.datetime, end_time: datetime.datetime, cleared_seconds: int):
     with db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("INSERT INTO debt_log (user_id, start_time, end_time, cleared_seconds) VALUES (%s, %s, %s, %s)", (user_id, start_time, end_time, cleared_seconds))
+    report_cache.invalidate_user(user_id, start_time.astimezone(_user_tz(user_id)).date())
 
 def get_debt_logs_for_user(user_id: int, start_date: str, end_date: str) -> int:
     with db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT SUM(cleared_seconds) FROM debt_log WHERE user_id = %s AND start_time >= %s AND start_time < %s", (user_id, start_date, end_date))
+            tz_name = _user_tz(user_id).zone
+            cursor.execute("SELECT SUM(cleared_seconds) FROM debt_log WHERE user_id = %s AND start_time >= (%s::date::timestamp AT TIME ZONE %s) AND start_time < (%s::date::timestamp AT TIME ZONE %s)",
+                           (user_id, start_date, tz_name, end_date, tz_name))
             result = cursor.fetchone()
             return result[0] if result and result[0] else 0
     
@@ -296,6 +781,7 @@ def add_absence(user_id: int, absence_type: str, start_date: datetime.date, end_
     with db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("INSERT INTO absences (user_id, absence_type, start_date, end_date) VALUES (%s, %s, %s, %s)", (user_id, absence_type, start_date, end_date))
+    report_cache.invalidate_user(user_id, start_date, end_date)
 
 def get_approved_request(user_id: int, request_type: str, date_str: str) -> bool:
     with db_connection() as conn:
@@ -307,4 +793,336 @@ def get_approved_request(user_id: int, request_type: str, date_str: str) -> bool
 def delete_session_state(user_id: int):
     with db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM work_sessions WHERE user_id = %s", (user_id,))
\ No newline at end of file
+            _execute_hot(cursor, 'hot_delete_session', (user_id,))
+    state_cache.put_session(user_id, None)
+
+
+STALE_SESSION_STATUSES = ['working', 'on_break', 'clearing_debt', 'banking_time']
+
+
+def close_stale_sessions(now: datetime.datetime, max_session_seconds: int) -> List[Dict]:
+    """
+    Закрывает одним запросом все сессии, начатые до начала текущих суток в поясе сотрудника
+    (на момент now). Время сессии ограничивается max_session_seconds и началом нового дня.
+    Для обычной работы и работы в банк пишется work_log, для отработки - debt_log и гашение долга.
+    Возвращает список закрытых сессий с данными сотрудника и его руководителей.
+    """
+    query = """
+        WITH closed AS (
+            DELETE FROM work_sessions ws
+            USING users u LEFT JOIN offices o ON o.office_id = u.office_id
+            WHERE ws.user_id = u.user_id
+              AND ws.state_json->>'status' = ANY(%(statuses)s)
+              AND (ws.state_json->>'start_time')::timestamptz < (date_trunc('day', %(now)s AT TIME ZONE """ + USER_TZ_SQL + """) AT TIME ZONE """ + USER_TZ_SQL + """)
+            RETURNING ws.user_id, ws.state_json, date_trunc('day', %(now)s AT TIME ZONE """ + USER_TZ_SQL + """) AT TIME ZONE """ + USER_TZ_SQL + """ AS day_start
+        ), spans AS (
+            SELECT user_id,
+                   state_json->>'status' AS status,
+                   COALESCE((state_json->>'is_remote')::boolean, FALSE) AS is_remote,
+                   o.office_id,
+                   (state_json->>'start_time')::timestamptz AS start_time,
+                   LEAST((state_json->>'start_time')::timestamptz + make_interval(secs => %(max_seconds)s), day_start) AS end_time,
+                   COALESCE((state_json->>'total_break_seconds')::int, 0) AS break_seconds,
+                   (state_json->>'break_start_time')::timestamptz AS break_start_time
+            -- Офис удаленный, пока сессия была открыта, дает NULL вместо нарушения внешнего ключа
+            FROM closed c LEFT JOIN offices o ON o.office_id = (c.state_json->>'office_id')::int
+        ), worked AS (
+            SELECT s.*,
+                   s.break_seconds + CASE WHEN s.status = 'on_break' AND s.break_start_time < s.end_time
+                                          THEN EXTRACT(EPOCH FROM s.end_time - s.break_start_time)::int ELSE 0 END AS total_break,
+                   EXTRACT(EPOCH FROM s.end_time - s.start_time)::int AS span_seconds
+            FROM spans s
+        ), totals AS (
+            SELECT w.*,
+                   GREATEST(0, w.span_seconds - CASE WHEN w.status IN ('working', 'on_break') THEN w.total_break ELSE 0 END) AS work_seconds
+            FROM worked w
+        ), work_rows AS (
+            INSERT INTO work_log (user_id, start_time, end_time, total_work_seconds, total_break_seconds, work_type, office_id)
+            SELECT user_id, start_time, end_time, work_seconds,
+                   CASE WHEN status = 'banking_time' THEN 0 ELSE total_break END,
+                   CASE WHEN status = 'banking_time' THEN 'banking' WHEN is_remote THEN 'remote' ELSE 'office' END,
+                   office_id
+            FROM totals WHERE status <> 'clearing_debt'
+            RETURNING log_id, user_id, work_type
+        ), bank_ledger AS (
+            INSERT INTO time_bank_ledger (user_id, delta_seconds, reason, source_ref)
+            SELECT t.user_id, t.work_seconds, 'banking_auto_closed', 'work_log:' || w.log_id
+            FROM totals t JOIN work_rows w ON w.user_id = t.user_id AND w.work_type = 'banking'
+            WHERE t.status = 'banking_time'
+        ), debt_rows AS (
+            INSERT INTO debt_log (user_id, start_time, end_time, cleared_seconds)
+            SELECT user_id, start_time, end_time, work_seconds FROM totals WHERE status = 'clearing_debt'
+        ), bank AS (
+            UPDATE users u SET time_bank_seconds = u.time_bank_seconds + t.work_seconds
+            FROM totals t WHERE t.user_id = u.user_id AND t.status = 'banking_time'
+        ), debt_running AS (
+            SELECT d.debt_id, d.debt_seconds, t.work_seconds,
+                   SUM(d.debt_seconds) OVER (PARTITION BY d.user_id ORDER BY d.date_incurred, d.debt_id) AS running
+            FROM work_debt d JOIN totals t ON t.user_id = d.user_id AND t.status = 'clearing_debt'
+            WHERE d.status = 'pending'
+        ), debt_cleared AS (
+            UPDATE work_debt d SET
+                debt_seconds = GREATEST(0, r.running - r.work_seconds),
+                status = CASE WHEN r.running <= r.work_seconds THEN 'cleared' ELSE d.status END
+            FROM debt_running r
+            WHERE d.debt_id = r.debt_id AND r.running - r.debt_seconds < r.work_seconds
+        )
+        SELECT t.user_id, t.status, t.work_seconds, u.full_name, u.manager_id_1, u.manager_id_2
+        FROM totals t JOIN users u ON u.user_id = t.user_id
+    """
+    params = {'statuses': STALE_SESSION_STATUSES, 'now': now, 'tz': CONFIG.TIMEZONE, 'max_seconds': max_session_seconds}
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            closed = cursor.fetchall()
+    for row in closed:
+        state_cache.invalidate_session(row['user_id'])
+        state_cache.invalidate_user(row['user_id'])
+        report_cache.invalidate_user(row['user_id'])
+    return closed
+
+def get_team_overview(day: datetime.date, manager_id: int = None, max_depth: Optional[int] = 1) -> List[Dict]:
+    """
+    Одним запросом собирает состояние команд руководителей на дату day:
+    активную сессию, отсутствие, последний лог за день, а также итоги и долги за предыдущий день.
+    Если manager_id не задан, возвращаются команды всех руководителей. Строки упорядочены по руководителю.
+    Для manager_id можно запросить всю структуру (max_depth=None) или N уровней подчинения.
+    Границы дня day считаются в часовом поясе каждого сотрудника (колонка tz).
+    """
+    prev_day = day - datetime.timedelta(days=1)
+    if manager_id is not None and max_depth != 1:
+        team_query = """
+            SELECT h.ancestor_id AS manager_id, u.user_id, u.full_name
+            FROM user_hierarchy h JOIN users u ON u.user_id = h.descendant_id
+            WHERE h.ancestor_id = %(manager_id)s AND h.depth >= 1 AND (%(max_depth)s::int IS NULL OR h.depth <= %(max_depth)s::int)
+        """
+    else:
+        team_query = """
+            SELECT DISTINCT m.manager_id, u.user_id, u.full_name
+            FROM users u
+            CROSS JOIN LATERAL (VALUES (u.manager_id_1), (u.manager_id_2)) AS m(manager_id)
+            WHERE m.manager_id IS NOT NULL
+              AND (%(manager_id)s::bigint IS NULL OR m.manager_id = %(manager_id)s::bigint)
+        """
+    query = """
+        WITH team AS (""" + team_query + """), members AS (
+            SELECT u.user_id, """ + USER_TZ_SQL + """ AS tz,
+                   (%(day)s::date::timestamp AT TIME ZONE """ + USER_TZ_SQL + """) AS day_start,
+                   (%(prev_day)s::date::timestamp AT TIME ZONE """ + USER_TZ_SQL + """) AS prev_day_start
+            FROM users u LEFT JOIN offices o ON o.office_id = u.office_id
+            WHERE u.user_id IN (SELECT user_id FROM team)
+        ), prev_work AS (
+            SELECT w.user_id, SUM(w.total_work_seconds) AS work_seconds
+            FROM work_log w JOIN members mb ON mb.user_id = w.user_id
+            WHERE w.start_time >= mb.prev_day_start AND w.start_time < mb.day_start
+            GROUP BY w.user_id
+        ), prev_debt AS (
+            SELECT user_id, SUM(debt_seconds) AS debt_seconds
+            FROM work_debt WHERE date_incurred = %(prev_day)s
+            GROUP BY user_id
+        )
+        SELECT t.manager_id, t.user_id, t.full_name, mb.tz, s.state_json,
+               a.absence_type, l.start_time AS log_start_time, l.end_time AS log_end_time,
+               COALESCE(pw.work_seconds, 0) AS prev_work_seconds,
+               COALESCE(pd.debt_seconds, 0) AS prev_debt_seconds
+        FROM team t
+        JOIN members mb ON mb.user_id = t.user_id
+        LEFT JOIN work_sessions s ON s.user_id = t.user_id
+        LEFT JOIN LATERAL (
+            SELECT absence_type FROM absences
+            WHERE user_id = t.user_id AND start_date <= %(day)s AND end_date >= %(day)s
+            LIMIT 1
+        ) a ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT start_time, end_time FROM work_log
+            WHERE user_id = t.user_id AND start_time >= mb.day_start
+            ORDER BY end_time DESC LIMIT 1
+        ) l ON TRUE
+        LEFT JOIN prev_work pw ON pw.user_id = t.user_id
+        LEFT JOIN prev_debt pd ON pd.user_id = t.user_id
+        ORDER BY t.manager_id, t.full_name
+    """
+    params = {'manager_id': manager_id, 'max_depth': max_depth, 'day': day, 'prev_day': prev_day, 'tz': CONFIG.TIMEZONE}
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+    for row in rows:
+        if row['state_json']:
+            row['state_json'] = _deserialize_state(row['state_json'])
+    return rows
+
+def load_persistence(namespace: str) -> List[Dict]:
+    """Все сохраненные ключи пространства имен persistence.py."""
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("SELECT key, value FROM bot_persistence WHERE namespace = %s", (namespace,))
+            return cursor.fetchall()
+
+def save_persistence_batch(changes: Dict[tuple, Any]):
+    """
+    Записывает накопленные изменения одной транзакцией: {(namespace, key): JSON-строка},
+    значение None удаляет ключ.
+    """
+    upserts = [(namespace, key, value) for (namespace, key), value in changes.items() if value is not None]
+    deletes = [(namespace, key) for (namespace, key), value in changes.items() if value is None]
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            if upserts:
+                execute_values(cursor, """
+                    INSERT INTO bot_persistence (namespace, key, value) VALUES %s
+                    ON CONFLICT (namespace, key) DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+                """, upserts, template="(%s, %s, %s::jsonb)")
+            if deletes:
+                cursor.execute(
+                    "DELETE FROM bot_persistence p USING unnest(%s::text[], %s::text[]) AS d(namespace, key) "
+                    "WHERE p.namespace = d.namespace AND p.key = d.key",
+                    ([namespace for namespace, _ in deletes], [key for _, key in deletes]))
+
+def get_pending_requests_by_manager(manager_id: int = None) -> List[Dict]:
+    """Возвращает ожидающие решения запросы сотрудников, сгруппированные по руководителю."""
+    query = """
+        SELECT DISTINCT m.manager_id, r.request_id, r.request_type, r.request_data, u.user_id, u.full_name
+        FROM requests r
+        JOIN users u ON u.user_id = r.requester_id
+        CROSS JOIN LATERAL (VALUES (u.manager_id_1), (u.manager_id_2)) AS m(manager_id)
+        WHERE r.status = 'pending' AND m.manager_id IS NOT NULL
+          AND (%(manager_id)s::bigint IS NULL OR m.manager_id = %(manager_id)s::bigint)
+        ORDER BY m.manager_id, r.request_id
+    """
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, {'manager_id': manager_id})
+            return cursor.fetchall()
+
+def iter_daily_report_rows(user_ids: Optional[List[int]], start_date: datetime.date, end_date: datetime.date, batch_size: int = 2000):
+    """
+    Потоково отдает строки отчета "день x сотрудник" за период через серверный курсор.
+    user_ids=None означает всю организацию. В выборку попадают только дни с работой, отработкой или отсутствием.
+    Записи раскладываются по дням в часовом поясе сотрудника.
+    """
+    query = """
+        WITH scope AS (
+            SELECT u.user_id, u.full_name, """ + USER_TZ_SQL + """ AS tz,
+                   (%(start_date)s::date::timestamp AT TIME ZONE """ + USER_TZ_SQL + """) AS start_ts,
+                   ((%(end_date)s::date + 1)::timestamp AT TIME ZONE """ + USER_TZ_SQL + """) AS end_ts
+            FROM users u LEFT JOIN offices o ON o.office_id = u.office_id
+            WHERE %(user_ids)s::bigint[] IS NULL OR u.user_id = ANY(%(user_ids)s::bigint[])
+        ), work AS (
+            SELECT w.user_id, (w.start_time AT TIME ZONE s.tz)::date AS day,
+                   SUM(CASE WHEN w.work_type <> 'banking' THEN w.total_work_seconds ELSE 0 END) AS work_seconds,
+                   SUM(w.total_break_seconds) AS break_seconds,
+                   SUM(CASE WHEN w.work_type = 'banking' THEN w.total_work_seconds ELSE 0 END) AS banked_seconds,
+                   string_agg(DISTINCT w.work_type, ', ') FILTER (WHERE w.work_type <> 'banking') AS work_types
+            FROM work_log w JOIN scope s ON s.user_id = w.user_id
+            WHERE w.start_time >= s.start_ts AND w.start_time < s.end_ts
+            GROUP BY 1, 2
+        ), debt AS (
+            SELECT d.user_id, (d.start_time AT TIME ZONE s.tz)::date AS day, SUM(d.cleared_seconds) AS cleared_seconds
+            FROM debt_log d JOIN scope s ON s.user_id = d.user_id
+            WHERE d.start_time >= s.start_ts AND d.start_time < s.end_ts
+            GROUP BY 1, 2
+        ), absent AS (
+            SELECT a.user_id, g.day::date AS day, string_agg(a.absence_type, ', ') AS absence_types
+            FROM absences a JOIN scope s ON s.user_id = a.user_id
+            CROSS JOIN LATERAL generate_series(GREATEST(a.start_date, %(start_date)s), LEAST(a.end_date, %(end_date)s), interval '1 day') AS g(day)
+            WHERE a.start_date <= %(end_date)s AND a.end_date >= %(start_date)s
+            GROUP BY 1, 2
+        ), keys AS (
+            SELECT user_id, day FROM work UNION SELECT user_id, day FROM debt UNION SELECT user_id, day FROM absent
+        )
+        SELECT k.day, k.user_id, s.full_name,
+               COALESCE(w.work_seconds, 0) AS work_seconds, COALESCE(w.break_seconds, 0) AS break_seconds,
+               COALESCE(w.banked_seconds, 0) AS banked_seconds, COALESCE(d.cleared_seconds, 0) AS cleared_seconds,
+               w.work_types, a.absence_types
+        FROM keys k
+        JOIN scope s ON s.user_id = k.user_id
+        LEFT JOIN work w ON w.user_id = k.user_id AND w.day = k.day
+        LEFT JOIN debt d ON d.user_id = k.user_id AND d.day = k.day
+        LEFT JOIN absent a ON a.user_id = k.user_id AND a.day = k.day
+        ORDER BY k.day, s.full_name, k.user_id
+    """
+    params = {'user_ids': user_ids, 'tz': CONFIG.TIMEZONE, 'start_date': start_date, 'end_date': end_date}
+    with db_connection() as conn:
+        with conn.cursor(name='daily_report_export', cursor_factory=RealDictCursor) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row
+
+def get_org_report_rows(start_date: datetime.date, end_date: datetime.date, user_ids: Optional[List[int]] = None) -> List[Dict]:
+    """
+    Одним запросом собирает итоги за период по сотрудникам с их основным руководителем.
+    user_ids=None - вся организация. Период считается в часовом поясе каждого сотрудника.
+    """
+    query = """
+        WITH scope AS (
+            SELECT u.user_id,
+                   (%(start_date)s::date::timestamp AT TIME ZONE """ + USER_TZ_SQL + """) AS start_ts,
+                   ((%(end_date)s::date + 1)::timestamp AT TIME ZONE """ + USER_TZ_SQL + """) AS end_ts
+            FROM users u LEFT JOIN offices o ON o.office_id = u.office_id
+            WHERE %(user_ids)s::bigint[] IS NULL OR u.user_id = ANY(%(user_ids)s::bigint[])
+        ), work AS (
+            SELECT w.user_id, SUM(w.total_work_seconds) AS work_seconds, SUM(w.total_break_seconds) AS break_seconds
+            FROM work_log w JOIN scope s ON s.user_id = w.user_id
+            WHERE w.start_time >= s.start_ts AND w.start_time < s.end_ts
+            GROUP BY w.user_id
+        ), absent AS (
+            SELECT user_id, array_agg(absence_type ORDER BY start_date) AS absence_types,
+                   array_agg(start_date ORDER BY start_date) AS absence_starts, array_agg(end_date ORDER BY start_date) AS absence_ends
+            FROM absences WHERE start_date <= %(end_date)s AND end_date >= %(start_date)s
+              AND (%(user_ids)s::bigint[] IS NULL OR user_id = ANY(%(user_ids)s::bigint[]))
+            GROUP BY user_id
+        )
+        SELECT u.user_id, u.full_name, u.work_rate, u.work_weekdays, u.timezone, u.office_id, u.manager_id_1 AS manager_id, m.full_name AS manager_name,
+               w.work_seconds, w.break_seconds, a.absence_types, a.absence_starts, a.absence_ends
+        FROM users u
+        LEFT JOIN users m ON m.user_id = u.manager_id_1
+        LEFT JOIN work w ON w.user_id = u.user_id
+        LEFT JOIN absent a ON a.user_id = u.user_id
+        WHERE %(user_ids)s::bigint[] IS NULL OR u.user_id = ANY(%(user_ids)s::bigint[])
+        ORDER BY m.full_name NULLS LAST, u.manager_id_1 NULLS LAST, u.full_name
+    """
+    params = {'tz': CONFIG.TIMEZONE, 'start_date': start_date, 'end_date': end_date, 'user_ids': user_ids}
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+def get_work_intervals(user_ids: Optional[List[int]], start_date: datetime.date, end_date: datetime.date) -> List[tuple]:
+    """
+    Возвращает интервалы работы (без работы в банк) в виде кортежей:
+    (user_id, начало в секундах от полуночи, конец в секундах от полуночи, день недели ISO, чистое время, удаленно 0/1).
+    Перевод в локальное время сотрудника делается в SQL, чтобы дальше данные можно было сразу сложить в массивы.
+    """
+    query = """
+        WITH scope AS (
+            SELECT u.user_id, """ + USER_TZ_SQL + """ AS tz,
+                   (%(start_date)s::date::timestamp AT TIME ZONE """ + USER_TZ_SQL + """) AS start_ts,
+                   ((%(end_date)s::date + 1)::timestamp AT TIME ZONE """ + USER_TZ_SQL + """) AS end_ts
+            FROM users u LEFT JOIN offices o ON o.office_id = u.office_id
+            WHERE %(user_ids)s::bigint[] IS NULL OR u.user_id = ANY(%(user_ids)s::bigint[])
+        )
+        SELECT w.user_id,
+               EXTRACT(EPOCH FROM (w.start_time AT TIME ZONE s.tz)::time)::int,
+               EXTRACT(EPOCH FROM (w.end_time AT TIME ZONE s.tz)::time)::int,
+               EXTRACT(ISODOW FROM w.start_time AT TIME ZONE s.tz)::int,
+               w.total_work_seconds,
+               (w.work_type = 'remote')::int
+        FROM work_log w JOIN scope s ON s.user_id = w.user_id
+        WHERE w.start_time >= s.start_ts AND w.start_time < s.end_ts AND w.work_type <> 'banking'
+    """
+    params = {'tz': CONFIG.TIMEZONE, 'start_date': start_date, 'end_date': end_date, 'user_ids': user_ids}
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+def count_active_sessions() -> int:
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM work_sessions")
+            return cursor.fetchone()[0]
+
+# Все публичные функции модуля замеряются в метриках (при выключенных метриках - только проверка флага)
+instrument_module_functions(globals(), 'bot_db_call_seconds')
@@ -0,0 +1,182 @@
+# Файл: db_tracing.py
+# Этот модуль замеряет каждый SQL-запрос, пишет медленные в лог и снимает для них планы выполнения.
+
+import collections
+import logging
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_MAX_LENGTH = 500   # Столько символов текста запроса попадает в лог и сводку
+RECENT_DURATIONS = 512      # Последних замеров на запрос для оценки p95
+
+_WRITE_KEYWORDS = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|NEXTVAL|SETVAL)\b', re.IGNORECASE)
+
+def normalize_statement(query) -> str:
+    """Шаблон запроса: текст с плейсхолдерами без лишних пробелов. Значения параметров в него не попадают."""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    return ' '.join(query.split())
+
+def is_read_only(template: str) -> bool:
+    """Можно ли безопасно выполнить запрос повторно под EXPLAIN ANALYZE."""
+    head = template[:4].upper()
+    return head in ('SELE', 'WITH') and not _WRITE_KEYWORDS.search(template)
+
+def redact_params(params) -> str:
+    """Описание параметров без значений: только типы и размеры."""
+    if params is None:
+        return '-'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f"{name}: {_describe(value)}" for name, value in params.items()) + '}'
+    return '(' + ', '.join(_describe(value) for value in params) + ')'
+
+def _describe(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+class StatementStats:
+    __slots__ = ('template', 'count', 'errors', 'total', 'max', 'recent', 'last_plan', 'last_explain_at')
+
+    def __init__(self, template: str):
+        self.template = template
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=RECENT_DURATIONS)
+        self.last_plan: Optional[str] = None
+        self.last_explain_at = 0.0
+
+    def p95(self) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+class QueryTracer:
+    """
+    Сводка по запросам: количество, суммарное время, p95 и максимум по каждому шаблону.
+    Запросы дольше порога пишутся в лог, а для читающих дополнительно снимается
+    EXPLAIN (ANALYZE, BUFFERS) - не чаще раза в explain_interval секунд на шаблон,
+    поскольку ANALYZE выполняет запрос повторно.
+    """
+
+    def __init__(self, slow_ms: float = 200, explain: bool = True, explain_interval: float = 300):
+        self.slow_seconds = slow_ms / 1000
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.total_statements = 0
+        self._lock = threading.Lock()
+        self._stats: Dict[str, StatementStats] = {}
+
+    def configure(self, slow_ms: float, explain: bool, explain_interval: float):
+        self.slow_seconds = slow_ms / 1000
+        self.explain = explain
+        self.explain_interval = explain_interval
+
+    def record(self, template: str, duration: float, failed: bool = False) -> StatementStats:
+        with self._lock:
+            stats = self._stats.get(template)
+            if stats is None:
+                stats = self._stats[template] = StatementStats(template)
+            stats.count += 1
+            stats.errors += failed
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+            stats.recent.append(duration)
+            self.total_statements += 1
+            return stats
+
+    def should_explain(self, stats: StatementStats) -> bool:
+        """Решает, снимать ли план; заодно резервирует попытку, чтобы параллельные потоки ее не повторили."""
+        if not self.explain or not is_read_only(stats.template):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if stats.last_explain_at and now - stats.last_explain_at < self.explain_interval:
+                return False
+            stats.last_explain_at = now
+            return True
+
+    def summary(self, limit: int = 10) -> List[dict]:
+        """Самые тяжелые запросы по суммарному времени."""
+        with self._lock:
+            rows = [{
+                'template': stats.template, 'count': stats.count, 'errors': stats.errors, 'total': stats.total,
+                'avg': stats.total / stats.count if stats.count else 0.0, 'p95': stats.p95(), 'max': stats.max,
+                'plan': stats.last_plan,
+            } for stats in self._stats.values()]
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.total_statements = 0
+
+query_tracer = QueryTracer()
+
+class TracingCursorMixin:
+    """Подмешивается к классу курсора psycopg2 и замеряет каждый execute."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            duration = time.perf_counter() - started
+            template = normalize_statement(query)[:TEMPLATE_MAX_LENGTH]
+            stats = query_tracer.record(template, duration, failed)
+            if not failed and duration >= query_tracer.slow_seconds:
+                logger.warning("Медленный запрос %.0f мс: %s | параметры: %s", duration * 1000, template, redact_params(vars))
+                # Серверный (именованный) курсор держит результат открытым - повторно его не выполняем
+                if self.name is None and query_tracer.should_explain(stats):
+                    self._capture_plan(stats, query, vars)
+
+    def _capture_plan(self, stats: StatementStats, query, vars):
+        # Обычный курсор без трассировки и точка сохранения: ошибка EXPLAIN не должна ломать транзакцию вызывающего кода
+        with psycopg2.extensions.cursor(self.connection) as cursor:
+            try:
+                cursor.execute("SAVEPOINT query_trace_explain")
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + (query if isinstance(query, str) else str(query)), vars)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                cursor.execute("RELEASE SAVEPOINT query_trace_explain")
+            except psycopg2.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT query_trace_explain")
+                logger.warning("Не удалось снять план запроса: %s", e)
+                return
+        stats.last_plan = plan
+        logger.warning("План медленного запроса %s...:\n%s", stats.template[:120], plan)
+
+class TracingCursor(TracingCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+class TracingRealDictCursor(TracingCursorMixin, RealDictCursor):
+    pass
+
+TRACED_CURSORS = {
+    psycopg2.extensions.cursor: TracingCursor,
+    RealDictCursor: TracingRealDictCursor,
+}
+
+class TracingConnection(psycopg2.extensions.connection):
+    """Соединение, которое подменяет курсоры на замеряющие (в том числе при явном cursor_factory)."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = TRACED_CURSORS.get(factory, factory)
+        return super().cursor(*args, **kwargs)
@@ -0,0 +1,119 @@
+# Файл: geofence.py
+# Этот модуль определяет, в каком офисе находится сотрудник, по сеточному пространственному индексу.
+
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE_LAT = 111320.0
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние между двумя точками на сфере в метрах."""
+    lat1_rad, lon1_rad, lat2_rad, lon2_rad = map(math.radians, (lat1, lon1, lat2, lon2))
+    dlat, dlon = lat2_rad - lat1_rad, lon2_rad - lon1_rad
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def bounding_box(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """Прямоугольник (min_lat, max_lat, min_lon, max_lon), гарантированно содержащий круг радиуса radius_m."""
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    # Ближе к полюсам градус долготы короче; у самого полюса берем всю окружность
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, radius_m / (METERS_PER_DEGREE_LAT * cos_lat))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+class GeofenceIndex:
+    """
+    Индекс офисов на равномерной сетке по широте/долготе.
+    Каждый офис регистрируется во всех ячейках, которые пересекает его описанный прямоугольник,
+    поэтому для точки достаточно посмотреть одну ячейку, отсеять кандидатов по прямоугольнику
+    и только для оставшихся считать точное расстояние по формуле гаверсинуса.
+    """
+
+    def __init__(self, cell_degrees: float = 0.05):
+        self.cell_degrees = cell_degrees
+        self._lock = threading.Lock()
+        self._offices: Dict[int, dict] = {}
+        self._boxes: Dict[int, Tuple[float, float, float, float]] = {}
+        self._cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self._offices)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def _cells_for_box(self, box: Tuple[float, float, float, float]):
+        min_lat, max_lat, min_lon, max_lon = box
+        lat_from, lon_from = self._cell(min_lat, min_lon)
+        lat_to, lon_to = self._cell(max_lat, max_lon)
+        for lat_cell in range(lat_from, lat_to + 1):
+            for lon_cell in range(lon_from, lon_to + 1):
+                yield lat_cell, lon_cell
+
+    def build(self, offices: List[dict]):
+        """Полностью перестраивает индекс по списку офисов (office_id, name, latitude, longitude, radius_meters)."""
+        with self._lock:
+            self._offices.clear(); self._boxes.clear(); self._cells.clear()
+            for office in offices:
+                self._add_locked(office)
+
+    def upsert(self, office: dict):
+        with self._lock:
+            self._remove_locked(office['office_id'])
+            self._add_locked(office)
+
+    def remove(self, office_id: int):
+        with self._lock:
+            self._remove_locked(office_id)
+
+    def _add_locked(self, office: dict):
+        office_id = office['office_id']
+        box = bounding_box(office['latitude'], office['longitude'], office['radius_meters'])
+        self._offices[office_id] = dict(office)
+        self._boxes[office_id] = box
+        for cell in self._cells_for_box(box):
+            self._cells[cell].append(office_id)
+
+    def _remove_locked(self, office_id: int):
+        box = self._boxes.pop(office_id, None)
+        if box is None:
+            return
+        self._offices.pop(office_id, None)
+        for cell in self._cells_for_box(box):
+            ids = self._cells.get(cell)
+            if ids is not None:
+                ids.remove(office_id)
+                if not ids:
+                    del self._cells[cell]
+
+    def get(self, office_id: int) -> Optional[dict]:
+        with self._lock:
+            office = self._offices.get(office_id)
+        return dict(office) if office else None
+
+    def match(self, lat: float, lon: float) -> Optional[Tuple[dict, float]]:
+        """Возвращает ближайший офис, в радиус которого попадает точка, и расстояние до него, либо None."""
+        best = None
+        with self._lock:
+            for office_id in self._cells.get(self._cell(lat, lon), ()):
+                min_lat, max_lat, min_lon, max_lon = self._boxes[office_id]
+                if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+                    continue
+                office = self._offices[office_id]
+                distance = haversine_m(office['latitude'], office['longitude'], lat, lon)
+                if distance <= office['radius_meters'] and (best is None or distance < best[1]):
+                    best = (office, distance)
+        return best
+
+    def nearest(self, lat: float, lon: float) -> Optional[Tuple[dict, float]]:
+        """Ближайший офис без учета радиуса - для сообщения сотруднику, который далеко от всех офисов."""
+        with self._lock:
+            offices = list(self._offices.values())
+        if not offices:
+            return None
+        return min(((office, haversine_m(office['latitude'], office['longitude'], lat, lon)) for office in offices), key=lambda item: item[1])
+
+geofence_index = GeofenceIndex()
@@ -0,0 +1,79 @@
+# Файл: jobs.py
+# Этот модуль содержит задачи, которые бот выполняет по расписанию через JobQueue.
+
+import datetime
+import logging
+from telegram.ext import Application, ContextTypes
+
+import database as db
+from config import CONFIG, LOCAL_TZ
+from report_generator import ReportGenerator
+from utils import get_now, get_day_start, seconds_to_str, send_messages_paced
+
+logger = logging.getLogger(__name__)
+
+STATUS_NAMES = {
+    'working': 'рабочий день',
+    'on_break': 'рабочий день (на перерыве)',
+    'clearing_debt': 'отработка долга',
+    'banking_time': 'работа в банк времени',
+}
+
+async def close_stale_sessions_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Закрывает сессии, которые сотрудники забыли завершить до полуночи, и рассылает уведомления.
+    Запускается в начале каждого часа: у сотрудников в разных поясах полночь наступает в разное время.
+    """
+    closed = db.close_stale_sessions(get_now(), CONFIG.STALE_SESSION_MAX_SECONDS)
+    if not closed:
+        return
+    logger.info("Ночное закрытие сессий: закрыто %s сессий.", len(closed))
+
+    messages = []
+    by_manager = {}
+    for row in closed:
+        status_name = STATUS_NAMES.get(row['status'], row['status'])
+        messages.append({
+            'chat_id': row['user_id'],
+            'text': (f"Вы не завершили {status_name}, сессия закрыта автоматически. "
+                     f"Засчитано: {seconds_to_str(row['work_seconds'])}. "
+                     f"Если это неверно, обратитесь к руководителю."),
+        })
+        managers = {row['manager_id_1'], row['manager_id_2']} - {None}
+        for manager_id in managers:
+            by_manager.setdefault(manager_id, []).append(f"• {row['full_name']}: {status_name}, засчитано {seconds_to_str(row['work_seconds'])}")
+
+    for manager_id, lines in by_manager.items():
+        messages.append({
+            'chat_id': manager_id,
+            'text': "Автоматически закрыты незавершенные сессии сотрудников:\n" + "\n".join(lines),
+        })
+
+    sent = await send_messages_paced(context.bot, messages)
+    logger.info("Ночное закрытие сессий: отправлено %s из %s уведомлений.", sent, len(messages))
+
+async def manager_digest_job(context: ContextTypes.DEFAULT_TYPE):
+    """Рассылает руководителям утреннюю сводку по их командам."""
+    digests = ReportGenerator.get_manager_digests(get_now().date())
+    messages = [{'chat_id': manager_id, 'text': text, 'parse_mode': 'Markdown'} for manager_id, text in digests.items()]
+    sent = await send_messages_paced(context.bot, messages)
+    logger.info("Утренняя сводка: отправлено %s из %s сообщений.", sent, len(messages))
+
+async def time_bank_checkpoint_job(context: ContextTypes.DEFAULT_TYPE):
+    """Фиксирует остатки банка времени на начало месяца."""
+    as_of = get_day_start(get_now().date().replace(day=1))
+    created = db.create_time_bank_checkpoints(as_of)
+    logger.info("Контрольные точки банка времени на %s: записано %s.", as_of.isoformat(), created)
+
+def register_jobs(application: Application):
+    """Регистрирует все задачи по расписанию."""
+    if application.job_queue is None:
+        logger.warning("JobQueue недоступна (не установлен APScheduler), задачи по расписанию не запущены.")
+        return
+    next_hour = (get_now() + datetime.timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    application.job_queue.run_repeating(close_stale_sessions_job, interval=datetime.timedelta(hours=1), first=next_hour, name='close_stale_sessions')
+    hour, minute = map(int, CONFIG.TIME_BANK_CHECKPOINT_TIME.split(':'))
+    application.job_queue.run_monthly(time_bank_checkpoint_job, when=datetime.time(hour, minute, tzinfo=LOCAL_TZ), day=1, name='time_bank_checkpoints')
+    if CONFIG.MANAGER_DIGEST_ENABLED:
+        hour, minute = map(int, CONFIG.MANAGER_DIGEST_TIME.split(':'))
+        application.job_queue.run_daily(manager_digest_job, time=datetime.time(hour, minute, tzinfo=LOCAL_TZ), days=(1, 2, 3, 4, 5), name='manager_digest')
@@ -0,0 +1,101 @@
+# Файл: logging_setup.py
+# Этот модуль настраивает неблокирующее логирование: обработчики пишут в очередь,
+# а запись в файл и консоль выполняет фоновый поток.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Передается как extra= в частых сообщениях "на каждое нажатие", чтобы они прореживались
+SAMPLED = {'sampled': True}
+
+class SamplingFilter(logging.Filter):
+    """
+    Ограничивает частоту сообщений, помеченных extra=SAMPLED: не больше limit записей
+    одного шаблона (логгер + текст до подстановки аргументов) за window секунд.
+    Пропущенные записи не теряются бесследно - их число дописывается к первой записи следующего окна.
+    """
+
+    def __init__(self, limit: int, window: float = 60.0):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows: Dict[Tuple[str, str], List] = {}  # ключ -> [начало окна, записано, пропущено]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sampled', False) or self.limit <= 0:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                state = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (пропущено похожих: {suppressed})"
+            if state[1] >= self.limit:
+                state[2] += 1
+                return False
+            state[1] += 1
+            return True
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в потоке вызова:
+    подставляет только аргументы сообщения, а время, уровень и трассировку оформляет фоновый поток.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class StoppableQueueListener(logging.handlers.QueueListener):
+    """QueueListener, который можно останавливать повторно: из finally в main и еще раз из atexit."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stop_lock = threading.Lock()
+        self._stopped = False
+
+    def stop(self):
+        with self._stop_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        super().stop()
+
+def setup_logging(level: str, file_path: str, max_bytes: int, backup_count: int, sample_per_minute: int) -> logging.handlers.QueueListener:
+    """
+    Подключает к корневому логгеру обработчик-очередь. Файл с ротацией и консоль обслуживает
+    QueueListener в отдельном потоке, поэтому медленный диск не задерживает цикл событий.
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_per_minute))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = StoppableQueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Дописываем остаток очереди при завершении процесса (если слушатель не остановили раньше)
+    atexit.register(listener.stop)
+    return listener
@@ -1,23 +1,25 @@
 # Файл: menu_generator.py
 import datetime
-from typing import List, Optional
+from typing import List, Optional, Set
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 import database as db
-from utils import get_now, seconds_to_str
+from utils import get_now, get_user_today, seconds_to_str
 from config import CONFIG
+from work_calendar import work_calendar
 
 class MenuGenerator:
     """Класс, отвечающий за генерацию всех клавиатур в боте."""
 
     @staticmethod
     async def get_main_menu(user_id: int) -> Optional[InlineKeyboardMarkup]:
-        today = get_now().date()
+        today = get_user_today(user_id)
         
         absences = db.get_absences_for_user(user_id, today)
         if absences:
             return None
         
-        is_weekend = today.weekday() >= 5
+        # Выходные, праздники и дни вне индивидуального графика - по производственному календарю
+        is_weekend = not work_calendar.is_working_day(today, db.get_user(user_id))
         today_logs = db.get_todays_work_log_for_user(user_id)
         if today_logs and not is_weekend:
             is_weekend = True
@@ -74,19 +76,33 @@ class MenuGenerator:
     def get_manager_menu() -> InlineKeyboardMarkup:
         buttons = [
             {"text": "👨‍💻 Статус команды", "callback": "team_status_button"},
+            {"text": "🌳 Статус всей структуры", "callback": "team_status_tree"},
             {"text": "📊 Отчет по команде", "callback": "manager_report_button"},
+            {"text": "📈 Аналитика", "callback": "analytics_button"},
+            {"text": "📥 Входящие запросы", "callback": "requests_inbox"},
             {"text": "❓ Помощь", "callback": "help_button"}
         ]
         return MenuGenerator.generate_from_list(buttons)
 
     @staticmethod
-    def get_report_period_menu(is_manager: bool = False, in_session: bool = False) -> InlineKeyboardMarkup:
+    def get_report_period_menu(is_manager: bool = False, in_session: bool = False, is_admin: bool = False) -> InlineKeyboardMarkup:
         base_callback = "manager" if is_manager else "employee"
         buttons = [
             {"text": "📊 Отчет за сегодня", "callback": f'report_today_{base_callback}'},
             {"text": "🗓️ Отчет за текущий месяц", "callback": f'report_this_month_{base_callback}'},
-            {"text": "📅 Выбрать другой период", "callback": f'report_custom_period_{base_callback}'}
+            {"text": "📅 Выбрать другой период", "callback": f'report_custom_period_{base_callback}'},
+            {"text": "📥 Выгрузить месяц в CSV", "callback": f'export_this_month_{base_callback}'}
         ]
+        if is_manager:
+            buttons.extend([
+                {"text": "🌳 Вся структура за текущий месяц", "callback": 'report_this_month_tree'},
+                {"text": "🌳 Вся структура за другой период", "callback": 'report_custom_period_tree'}
+            ])
+        if is_admin:
+            buttons.extend([
+                {"text": "🏢 Организация за текущий месяц", "callback": 'report_this_month_org'},
+                {"text": "🏢 Организация за другой период", "callback": 'report_custom_period_org'}
+            ])
         back_button_data = 'back_to_main_menu'
         if is_manager:
             back_button_data = 'back_to_manager_menu'
@@ -147,6 +163,55 @@ class MenuGenerator:
         ]
         return MenuGenerator.generate_from_list(buttons)
 
+    @staticmethod
+    def get_users_page_menu(users: List[dict], page_callback: str, prev_callback: Optional[str], next_callback: Optional[str]) -> InlineKeyboardMarkup:
+        """Страница списка пользователей: кнопка на пользователя и навигация. page_callback нужен для возврата к странице."""
+        keyboard = [[InlineKeyboardButton(f"{user['full_name']} ({user['role']})", callback_data=f"user_details_{user['user_id']}|{page_callback}")] for user in users]
+        navigation = []
+        if prev_callback:
+            navigation.append(InlineKeyboardButton("« Пред.", callback_data=prev_callback))
+        if next_callback:
+            navigation.append(InlineKeyboardButton("След. »", callback_data=next_callback))
+        if navigation:
+            keyboard.append(navigation)
+        return InlineKeyboardMarkup(keyboard)
+
+    @staticmethod
+    def describe_request(request: dict) -> str:
+        """Короткое описание запроса: сотрудник, тип и дата, если она есть."""
+        text = f"{request['full_name']}: {request['request_type']}"
+        date_str = (request.get('request_data') or {}).get('date')
+        if date_str:
+            text += f" на {datetime.date.fromisoformat(date_str).strftime('%d.%m.%Y')}"
+        return text
+
+    @staticmethod
+    def get_requests_inbox(pending: List[dict], selected: Set[int], notice: str = '') -> (str, InlineKeyboardMarkup):
+        """
+        Список ожидающих решения запросов с кнопкой выбора на каждый. У выбранного и невыбранного
+        запроса разные callback-данные, чтобы быстрое "выбрать - снять" не отсекалось как повторное нажатие.
+        """
+        lines = [notice] if notice else []
+        if not pending:
+            lines.append("Нет запросов, ожидающих решения.")
+            keyboard = [[InlineKeyboardButton("« Назад", callback_data="back_to_manager_menu")]]
+            return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+        lines.append(f"📥 Ожидают решения ({len(pending)}):")
+        keyboard = []
+        for request in pending:
+            is_selected = request['request_id'] in selected
+            mark = '☑️' if is_selected else '▫️'
+            lines.append(f"{mark} {MenuGenerator.describe_request(request)}")
+            callback = f"inbox_drop_{request['request_id']}" if is_selected else f"inbox_pick_{request['request_id']}"
+            keyboard.append([InlineKeyboardButton(f"{mark} {MenuGenerator.describe_request(request)}", callback_data=callback)])
+        if selected:
+            keyboard.append([InlineKeyboardButton(f"✅ Одобрить выбранные ({len(selected)})", callback_data="inbox_approve_selected"),
+                             InlineKeyboardButton(f"❌ Отклонить выбранные ({len(selected)})", callback_data="inbox_deny_selected")])
+        keyboard.append([InlineKeyboardButton(f"✅ Одобрить все ({len(pending)})", callback_data="inbox_approve_all")])
+        keyboard.append([InlineKeyboardButton("« Назад", callback_data="back_to_manager_menu")])
+        return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
     @staticmethod
     def generate_from_list(buttons: List[dict]) -> InlineKeyboardMarkup:
         """Универсальный метод генерации меню: одна кнопка в ряду."""
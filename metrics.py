@@ -0,0 +1,233 @@
+# Файл: metrics.py
+# Этот модуль собирает счетчики и гистограммы задержек и отдает их в текстовом формате Prometheus.
+
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class MetricsRegistry:
+    """
+    Реестр метрик в памяти процесса. Запись - это обновление пары словарей под одной блокировкой,
+    поэтому метрики можно не выключать в продакшене; при enabled = False запись пропускается совсем.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, list]] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def describe(self, name: str, kind: str, text: str):
+        self._help[name] = (kind, text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Добавляет наблюдение в гистограмму: [счетчики по корзинам..., сумма, количество]."""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            buckets = series.get(key)
+            if buckets is None:
+                buckets = series[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            buckets[-2] += seconds
+            buckets[-1] += 1
+
+    def gauge(self, name: str, callback: Callable[[], float], text: str = ''):
+        """Регистрирует показатель, значение которого вычисляется в момент чтения метрик."""
+        self._gauges[name] = callback
+        self.describe(name, 'gauge', text)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Замеряет время блока (в том числе с await внутри) и считает ошибки."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, status=status, **labels)
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)."""
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: list(buckets) for key, buckets in series.items()} for name, series in self._histograms.items()}
+        for name, series in sorted(counters.items()):
+            self._render_header(lines, name, 'counter')
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(histograms.items()):
+            self._render_header(lines, name, 'histogram')
+            for key, buckets in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {buckets[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {buckets[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {buckets[-1]}")
+        for name, callback in sorted(self._gauges.items()):
+            try:
+                value = callback()
+            except Exception as e:
+                logger.warning("Не удалось вычислить метрику %s: %s", name, e)
+                continue
+            self._render_header(lines, name, 'gauge')
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def _render_header(self, lines: list, name: str, kind: str):
+        _, text = self._help.get(name, (kind, ''))
+        if text:
+            lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+metrics = MetricsRegistry()
+metrics.describe('bot_handler_seconds', 'histogram', 'Время обработки команд, диалогов и маршрутов кнопок')
+metrics.describe('bot_db_call_seconds', 'histogram', 'Время выполнения функций database.py')
+metrics.describe('bot_callback_route_seconds', 'histogram', 'Время обработки нажатий по маршрутам main_handler')
+metrics.describe('bot_telegram_api_seconds', 'histogram', 'Время запросов к Telegram Bot API по методам')
+metrics.describe('bot_callback_duplicates_total', 'counter', 'Повторные нажатия кнопок, отброшенные до обработчиков')
+metrics.describe('bot_updates_shed_total', 'counter', 'Обновления, отброшенные ограничением частоты, по ролям')
+
+# --- Обертки для инструментирования ---
+
+def timed(name: str, **labels):
+    """Декоратор: замеряет время синхронной или асинхронной функции в гистограмме name."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with metrics.timer(name, **labels):
+                    return await func(*args, **kwargs)
+            async_wrapper._timed_metric = name
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(name, **labels):
+                return func(*args, **kwargs)
+        wrapper._timed_metric = name
+        return wrapper
+    return decorator
+
+def instrument_module_functions(module_globals: dict, name: str, label: str = 'function'):
+    """
+    Оборачивает все публичные функции модуля таймером. Генераторы и контекстные менеджеры
+    пропускаются: их время - это время потребителя, а не запроса.
+    """
+    module_name = module_globals['__name__']
+    for func_name, func in list(module_globals.items()):
+        if (func_name.startswith('_') or not inspect.isfunction(func) or func.__module__ != module_name
+                or inspect.isgeneratorfunction(func) or hasattr(func, '__wrapped__')):
+            continue
+        module_globals[func_name] = timed(name, **{label: func_name})(func)
+
+def instrument_handlers(application):
+    """Оборачивает таймером колбэки всех зарегистрированных обработчиков, включая шаги диалогов."""
+    from telegram.ext import ConversationHandler
+
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for inner in handler.entry_points + handler.fallbacks + [h for state in handler.states.values() for h in state]:
+                wrap(inner)
+            return
+        callback = getattr(handler, 'callback', None)
+        if callback is None or hasattr(callback, '_timed_metric'):
+            return
+        handler.callback = timed('bot_handler_seconds', handler=callback.__qualname__)(callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+def instrumented_request_class():
+    """Класс HTTP-запросов PTB, который замеряет каждый вызов Bot API по имени метода."""
+    from telegram.request import HTTPXRequest
+
+    class InstrumentedHTTPXRequest(HTTPXRequest):
+        async def do_request(self, url, method, *args, **kwargs):
+            # В URL после токена идет только имя метода - сам токен в метки не попадает
+            api_method = url.rsplit('/', 1)[-1]
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                code, payload = await super().do_request(url, method, *args, **kwargs)
+                status = str(code)
+                return code, payload
+            finally:
+                metrics.observe('bot_telegram_api_seconds', time.perf_counter() - started, method=api_method, status=status)
+
+    return InstrumentedHTTPXRequest
+
+# --- HTTP-эндпоинт ---
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            body = (await asyncio.to_thread(metrics.render)).encode('utf-8')
+            header = f"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        else:
+            body = b'Not Found\n'
+            header = f"HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        writer.write(header.encode('latin-1') + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug("Ошибка соединения с эндпоинтом метрик: %s", e)
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Запускает в текущем цикле событий HTTP-эндпоинт /metrics."""
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info("Эндпоинт метрик запущен на http://%s:%s/metrics", host, port)
+    return server
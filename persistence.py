@@ -0,0 +1,141 @@
+# Файл: persistence.py
+# Этот модуль хранит состояния диалогов (ConversationHandler) и user_data в PostgreSQL,
+# чтобы перезапуск бота не обрывал начатые сотрудниками диалоги.
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import database as db
+from state_cache import state_cache
+
+logger = logging.getLogger(__name__)
+
+USER_DATA_NAMESPACE = 'user_data'
+CONVERSATION_NAMESPACE = 'conversation:'
+
+class PostgresPersistence(BasePersistence):
+    """
+    Хранилище PTB с отложенной записью. Application сам вызывает update_* раз в update_interval секунд
+    и только для изменившихся ключей; здесь они копятся в буфере и пишутся в БД одной транзакцией
+    на весь проход. При остановке Application вызывает flush, и буфер дописывается до выхода.
+    PTB помечает user_data изменившимися после каждого обновления пользователя, поэтому значение
+    сравнивается с последним записанным и без изменений в БД не уходит.
+    Хранятся только user_data и диалоги: chat_data и bot_data в боте не используются.
+    """
+
+    def __init__(self, update_interval: float):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self._pending: Dict[Tuple[str, str], Optional[str]] = {}  # (namespace, key) -> JSON; None - удалить
+        self._saved: Dict[Tuple[str, str], str] = {}              # Последние записанные в БД значения
+        self._write_task: Optional[asyncio.Task] = None
+
+    # --- Чтение при запуске ---
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        rows = await asyncio.to_thread(db.load_persistence, USER_DATA_NAMESPACE)
+        # При нескольких процессах каждый загружает только своих пользователей (см. sharding.py)
+        rows = [row for row in rows if state_cache.owns(int(row['key']))]
+        self._remember_loaded(USER_DATA_NAMESPACE, rows)
+        return {int(row['key']): row['value'] for row in rows}
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        rows = await asyncio.to_thread(db.load_persistence, CONVERSATION_NAMESPACE + name)
+        # Последний элемент ключа диалога - user_id
+        rows = [row for row in rows if state_cache.owns(json.loads(row['key'])[-1])]
+        self._remember_loaded(CONVERSATION_NAMESPACE + name, rows)
+        return {tuple(json.loads(row['key'])): row['value'] for row in rows}
+
+    def _remember_loaded(self, namespace: str, rows: list):
+        for row in rows:
+            self._saved[(namespace, row['key'])] = self._encode(row['value'])
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- Запись ---
+
+    @staticmethod
+    def _encode(value: Any) -> str:
+        return json.dumps(value, default=str, sort_keys=True)
+
+    def _stage(self, namespace: str, key: str, value: Optional[Any]):
+        """Кладет изменение в буфер и планирует запись после текущего прохода Application."""
+        item_key = (namespace, key)
+        encoded = self._encode(value) if value is not None else None
+        if self._saved.get(item_key) == encoded and item_key not in self._pending:
+            return
+        self._pending[item_key] = encoded
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # Application вызывает update_* через gather; задача записи стартует после них и забирает весь проход
+        await asyncio.sleep(0)
+        # Изменения, пришедшие во время записи, уходят следующей транзакцией той же задачи
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(db.save_persistence_batch, batch)
+            except Exception:
+                logger.exception("Не удалось сохранить состояние диалогов (%s ключей), повтор при следующей записи.", len(batch))
+                # Более свежие значения, пришедшие за время записи, не перетираются
+                for item_key, value in batch.items():
+                    self._pending.setdefault(item_key, value)
+                return
+            for item_key, value in batch.items():
+                if value is None:
+                    self._saved.pop(item_key, None)
+                else:
+                    self._saved[item_key] = value
+            logger.debug("Сохранено ключей состояния диалогов: %s.", len(batch))
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage(USER_DATA_NAMESPACE, str(user_id), data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage(USER_DATA_NAMESPACE, str(user_id), None)
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._stage(CONVERSATION_NAMESPACE + name, json.dumps(list(key)), new_state)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    # Каждый пользователь обрабатывается одним процессом, поэтому перечитывать данные перед обработкой не нужно
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Дописывает буфер при остановке приложения."""
+        if self._write_task is not None:
+            await self._write_task
+        if self._pending:
+            await self._write_pending()
+        if self._pending:
+            logger.error("При остановке не сохранено ключей состояния диалогов: %s.", len(self._pending))
@@ -0,0 +1,107 @@
+# Файл: rate_limit.py
+# Этот модуль ограничивает частоту обновлений от одного пользователя (маркерная корзина),
+# чтобы один пользователь или скрипт не занимал базу и цикл событий в ущерб остальным.
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from config import CONFIG
+from logging_setup import SAMPLED
+from metrics import metrics
+from state_cache import MISSING, state_cache
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_TEXT = "Слишком часто, подождите немного."
+
+class TokenBuckets:
+    """
+    Корзины пользователей: запись [маркеры, время последнего пополнения, предупрежден ли].
+    Записи упорядочены по последнему обращению; запись, которая не трогалась дольше времени
+    полного пополнения, ничем не отличается от новой и удаляется с начала за O(1).
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]], max_entries: int):
+        self.limits = limits
+        self.max_entries = max_entries
+        self._idle_seconds = max(burst / rate for rate, burst in limits.values())
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[int, list]" = OrderedDict()
+        self.shed: Dict[str, int] = {role: 0 for role in limits}
+
+    def take(self, user_id: int, role: str) -> Tuple[bool, bool]:
+        """
+        Списывает маркер. Возвращает (пропущено ли обновление, нужно ли предупредить пользователя):
+        предупреждение отправляется один раз, пока корзина не начнет снова пропускать обновления.
+        """
+        rate, burst = self.limits[role]
+        now = time.monotonic()
+        with self._lock:
+            while self._buckets and now - next(iter(self._buckets.values()))[1] >= self._idle_seconds:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets.pop(user_id, None)
+            if bucket is None:
+                bucket = [float(burst), now, False]
+            else:
+                bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            self._buckets[user_id] = bucket
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                bucket[2] = False
+                return True, False
+            self.shed[role] += 1
+            warn = not bucket[2]
+            bucket[2] = True
+            return False, warn
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+buckets = TokenBuckets(CONFIG.RATE_LIMITS, CONFIG.RATE_LIMIT_MAX_ENTRIES)
+
+def role_for(user_id: int) -> str:
+    """
+    Роль для выбора лимита без обращения к БД: администраторы из конфига, остальные - по кэшу профилей.
+    Пока профиля нет в кэше, применяется лимит руководителя, чтобы не ограничить руководителя
+    лимитом сотрудника; первое же пропущенное обновление положит профиль в кэш.
+    Кэш читается через peek_user, чтобы проверка каждого обновления не попадала в hits/misses.
+    """
+    if user_id in CONFIG.ADMIN_IDS:
+        return 'admin'
+    user = state_cache.peek_user(user_id)
+    if user is MISSING:
+        return 'manager'
+    return 'manager' if user and user.get('role') in ('manager', 'admin') else 'employee'
+
+async def throttle_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Регистрируется в группе -2, до отсева повторных нажатий, диалогов и команд. Лишнее обновление
+    получает короткий ответ (один раз подряд) и дальше не обрабатывается - без запросов к БД.
+    """
+    user = update.effective_user
+    if user is None:
+        return
+    role = role_for(user.id)
+    allowed, warn = buckets.take(user.id, role)
+    if allowed:
+        return
+    metrics.inc('bot_updates_shed_total', role=role)
+    logger.info("Обновление от user_id %s отброшено ограничением частоты (%s).", user.id, role, extra=SAMPLED)
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(THROTTLED_TEXT if warn else None)
+        elif warn and update.effective_message:
+            await update.effective_message.reply_text(THROTTLED_TEXT)
+    except TelegramError as e:
+        logger.debug("Не удалось ответить на отброшенное обновление: %s", e)
+    raise ApplicationHandlerStop
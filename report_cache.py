@@ -0,0 +1,96 @@
+# Файл: report_cache.py
+# Этот модуль хранит готовые тексты отчетов, чтобы не пересчитывать их из сырых логов при каждом запросе.
+
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+CacheKey = Tuple[str, int, datetime.date, datetime.date]
+
+class ReportCache:
+    """
+    Кэш результатов отчетов с ключом (scope, subject_id, start_date, end_date).
+    Отчеты за закрытые периоды не устаревают сами по себе, а сбрасываются только при
+    изменении данных, попадающих в период (в том числе задним числом).
+    Для каждой записи хранится набор сотрудников, чьи данные в ней учтены, и необязательная
+    отметка актуальности: запись с другой отметкой считается промахом (см. ReportGenerator.freshness_stamp).
+    """
+
+    def __init__(self, max_entries: int = 5000):
+        self._entries: "OrderedDict[CacheKey, Tuple[Any, frozenset, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, scope: str, subject_id: int, start_date: datetime.date, end_date: datetime.date, stamp: Optional[str] = None) -> Optional[Any]:
+        key = (scope, subject_id, start_date, end_date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] != stamp:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, scope: str, subject_id: int, start_date: datetime.date, end_date: datetime.date, value: Any, user_ids: Iterable[int] = None,
+            stamp: Optional[str] = None):
+        """Сохраняет отчет. user_ids=None означает, что отчет охватывает всех сотрудников."""
+        key = (scope, subject_id, start_date, end_date)
+        covered = frozenset(user_ids) if user_ids is not None else None
+        with self._lock:
+            self._entries[key] = (value, covered, stamp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _drop(self, predicate) -> int:
+        with self._lock:
+            stale = [key for key, (_, covered, _) in self._entries.items() if predicate(key, covered)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def invalidate_user(self, user_id: int, start_date: datetime.date = None, end_date: datetime.date = None) -> int:
+        """
+        Сбрасывает отчеты, в которых учтен сотрудник. Если указан диапазон дат, сбрасываются
+        только отчеты, период которых с ним пересекается.
+        """
+        end_date = end_date or start_date
+        def affected(key, covered):
+            _, _, period_start, period_end = key
+            if start_date is not None and (period_start > end_date or period_end < start_date):
+                return False
+            return covered is None or user_id in covered
+        return self._drop(affected)
+
+    def invalidate_subject(self, subject_id: int) -> int:
+        """Сбрасывает все отчеты, построенные для руководителя/сотрудника subject_id."""
+        return self._drop(lambda key, covered: key[1] == subject_id)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self.invalidations += count
+            return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+report_cache = ReportCache()
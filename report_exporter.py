@@ -0,0 +1,95 @@
+# Файл: report_exporter.py
+# Этот модуль выгружает отчеты "день x сотрудник" в файлы CSV/XLSX для бухгалтерии.
+
+import csv
+import datetime
+import io
+import tempfile
+from typing import Iterable, List, Optional, Tuple
+import database as db
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX - необязательная возможность
+    Workbook = None
+
+EXPORT_HEADER = ['Дата', 'ID', 'Сотрудник', 'Рабочее время, ч', 'Перерывы, ч', 'Работа в банк, ч', 'Отработка долга, ч', 'Формат работы', 'Отсутствие']
+EXPORT_SCOPES = ('self', 'team', 'tree', 'org')
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+class ReportExporter:
+    """Класс, отвечающий за потоковую выгрузку отчетов в файлы."""
+
+    @staticmethod
+    def xlsx_available() -> bool:
+        return Workbook is not None
+
+    @staticmethod
+    def resolve_scope(scope: str, user_id: int) -> Optional[List[int]]:
+        """Возвращает список ID сотрудников для области выгрузки. None - вся организация."""
+        if scope == 'self':
+            return [user_id]
+        if scope == 'team':
+            return [member['user_id'] for member in db.get_managed_users(user_id)]
+        if scope == 'tree':
+            return [member['user_id'] for member in db.get_managed_users(user_id, max_depth=None)]
+        if scope == 'org':
+            return None
+        raise ValueError(f"Неизвестная область выгрузки: {scope}")
+
+    @staticmethod
+    def _to_export_row(row: dict) -> list:
+        hours = lambda seconds: round((seconds or 0) / 3600, 2)
+        return [
+            row['day'].strftime('%d.%m.%Y'), row['user_id'], row['full_name'],
+            hours(row['work_seconds']), hours(row['break_seconds']), hours(row['banked_seconds']), hours(row['cleared_seconds']),
+            row['work_types'] or '', row['absence_types'] or '',
+        ]
+
+    @staticmethod
+    def write_csv(rows: Iterable[dict], target) -> int:
+        """Пишет строки в бинарный файл target как CSV (разделитель ';', UTF-8 с BOM для Excel)."""
+        text_stream = io.TextIOWrapper(target, encoding='utf-8-sig', newline='')
+        writer = csv.writer(text_stream, delimiter=';')
+        writer.writerow(EXPORT_HEADER)
+        count = 0
+        for row in rows:
+            writer.writerow(ReportExporter._to_export_row(row))
+            count += 1
+        text_stream.flush()
+        text_stream.detach()
+        return count
+
+    @staticmethod
+    def write_xlsx(rows: Iterable[dict], target) -> int:
+        """Пишет строки в бинарный файл target как XLSX в потоковом режиме openpyxl."""
+        if Workbook is None:
+            raise RuntimeError("Для выгрузки в XLSX необходимо установить openpyxl.")
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Отчет')
+        sheet.append(EXPORT_HEADER)
+        count = 0
+        for row in rows:
+            sheet.append(ReportExporter._to_export_row(row))
+            count += 1
+        workbook.save(target)
+        return count
+
+    @staticmethod
+    def build_export(scope: str, user_id: int, start_date: datetime.date, end_date: datetime.date, fmt: str = 'csv') -> Tuple[tempfile.SpooledTemporaryFile, str, int]:
+        """
+        Строит файл выгрузки, не загружая весь период в память: строки идут из серверного курсора прямо в файл.
+        Возвращает открытый файл (позиция в начале), имя файла и количество строк.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        user_ids = ReportExporter.resolve_scope(scope, user_id)
+        rows = db.iter_daily_report_rows(user_ids, start_date, end_date) if user_ids is None or user_ids else iter(())
+        target = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+b')
+        if fmt == 'xlsx':
+            count = ReportExporter.write_xlsx(rows, target)
+        else:
+            count = ReportExporter.write_csv(rows, target)
+        target.seek(0)
+        filename = f"report_{scope}_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.{fmt}"
+        return target, filename, count
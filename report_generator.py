@@ -2,68 +2,132 @@
 # Этот модуль отвечает за генерацию текстовых представлений для всех видов отчетов.
 
 import datetime
-from typing import List
+from collections import defaultdict
+from typing import Dict, List, Optional
 import database as db
-from utils import seconds_to_str, get_now
-from config import LOCAL_TZ
+from report_cache import report_cache
+from utils import seconds_to_str, get_now, get_user_tz
+from timezones import timezones
+from work_calendar import work_calendar
 
 class ReportGenerator:
     """Класс, отвечающий за генерацию текстов для отчетов."""
 
     @staticmethod
-    async def get_team_status_text(manager_id: int) -> str:
-        """Генерирует текст статуса команды для руководителя с временем начала/окончания работы."""
-        team_members = db.get_managed_users(manager_id)
-        if not team_members:
+    def _format_member_status(row: dict) -> str:
+        """Формирует строку статуса одного сотрудника по строке из db.get_team_overview."""
+        member_name = row['full_name']
+        member_tz = timezones.get(row['tz'])
+        session = row['state_json']
+        if session and session.get('status'):
+            status = session['status']
+            start_time = session['start_time'].astimezone(member_tz) # Время начала в поясе сотрудника
+            if status == 'working':
+                return f"🟢 {member_name}: Работает (начал в {start_time.strftime('%H:%M')})"
+            elif status == 'on_break':
+                return f"☕️ {member_name}: На перерыве (начал в {start_time.strftime('%H:%M')})"
+            return f"⚙️ {member_name}: Доп. работа (начал в {start_time.strftime('%H:%M')})"
+        if row['absence_type']:
+            return f"🏖️ {member_name}: {row['absence_type']}"
+        if row['log_start_time']:
+            # Время из БД приходит с таймзоной UTC. Конвертируем его в пояс сотрудника.
+            start_time_local = row['log_start_time'].astimezone(member_tz)
+            end_time_local = row['log_end_time'].astimezone(member_tz)
+            return f"⚪️ {member_name}: Не в сети (работал с {start_time_local.strftime('%H:%M')} до {end_time_local.strftime('%H:%M')})"
+        return f"⚪️ {member_name}: Не в сети"
+
+    @staticmethod
+    async def get_team_status_text(manager_id: int, max_depth: Optional[int] = 1) -> str:
+        """
+        Генерирует текст статуса команды для руководителя с временем начала/окончания работы.
+        max_depth=None - статус всей структуры подчинения.
+        """
+        now = get_now(get_user_tz(manager_id))
+        team_rows = db.get_team_overview(now.date(), manager_id, max_depth)
+        if not team_rows:
             return "За вами не закреплено ни одного сотрудника."
         
-        status_lines = [f"**Статус команды на {get_now().strftime('%d.%m.%Y %H:%M')}**\n"]
-        today = get_now().date()
-        
-        for member in team_members:
-            member_id = member['user_id']
-            member_name = member['full_name']
-            session = db.get_session_state(member_id)
-            
-            if session and session.get('status'):
-                status = session['status']
-                start_time = session['start_time'] # Это время уже в нашей таймзоне
-                
-                if status == 'working':
-                    status_lines.append(f"🟢 {member_name}: Работает (начал в {start_time.strftime('%H:%M')})")
-                elif status == 'on_break':
-                    break_start = session.get('break_start_time')
-                    status_lines.append(f"☕️ {member_name}: На перерыве (начал в {start_time.strftime('%H:%M')})")
-                else:
-                    status_lines.append(f"⚙️ {member_name}: Доп. работа (начал в {start_time.strftime('%H:%M')})")
-            else:
-                absences = db.get_absences_for_user(member_id, today)
-                if absences:
-                    status_lines.append(f"🏖️ {member_name}: {absences[0]['absence_type']}")
-                else:
-                    last_log = db.get_todays_work_log_for_user(member_id)
-                    if last_log:
-                        # Время из БД приходит с таймзоной UTC. Конвертируем его в нашу локальную.
-                        start_time_local = last_log['start_time'].astimezone(LOCAL_TZ)
-                        end_time_local = last_log['end_time'].astimezone(LOCAL_TZ)
-                        status_lines.append(f"⚪️ {member_name}: Не в сети (работал с {start_time_local.strftime('%H:%M')} до {end_time_local.strftime('%H:%M')})")
-                    else:
-                        status_lines.append(f"⚪️ {member_name}: Не в сети")
-        
+        title = "Статус команды" if max_depth == 1 else "Статус структуры"
+        status_lines = [f"**{title} на {now.strftime('%d.%m.%Y %H:%M')}**\n"]
+        status_lines.extend(ReportGenerator._format_member_status(row) for row in team_rows)
         return "\n".join(status_lines)
 
+    @staticmethod
+    def get_manager_digests(day: datetime.date) -> Dict[int, str]:
+        """
+        Формирует утренние сводки для всех руководителей сразу.
+        Данные берутся двумя запросами по всей организации и группируются по руководителю.
+        """
+        team_by_manager = defaultdict(list)
+        for row in db.get_team_overview(day):
+            team_by_manager[row['manager_id']].append(row)
+        requests_by_manager = defaultdict(list)
+        for row in db.get_pending_requests_by_manager():
+            requests_by_manager[row['manager_id']].append(row)
+
+        digests = {}
+        prev_day = day - datetime.timedelta(days=1)
+        for manager_id, rows in team_by_manager.items():
+            started, absent, not_started, yesterday = [], [], [], []
+            for row in rows:
+                session = row['state_json']
+                if session and session.get('status'):
+                    started.append(ReportGenerator._format_member_status(row))
+                elif row['absence_type']:
+                    absent.append(f"🏖️ {row['full_name']}: {row['absence_type']}")
+                else:
+                    not_started.append(f"⚪️ {row['full_name']}")
+                if row['prev_work_seconds'] or row['prev_debt_seconds']:
+                    line = f"👤 {row['full_name']}: {seconds_to_str(row['prev_work_seconds'])}"
+                    if row['prev_debt_seconds']:
+                        line += f", начислена отработка {seconds_to_str(row['prev_debt_seconds'])}"
+                    yesterday.append(line)
+
+            lines = [f"**☀️ Утренняя сводка на {day.strftime('%d.%m.%Y')}**\n"]
+            lines.append(f"**Начали работу ({len(started)}):**")
+            lines.extend(started or ["—"])
+            lines.append(f"\n**Отсутствуют ({len(absent)}):**")
+            lines.extend(absent or ["—"])
+            lines.append(f"\n**Еще не начали ({len(not_started)}):**")
+            lines.extend(not_started or ["—"])
+            pending = requests_by_manager.get(manager_id, [])
+            lines.append(f"\n**Ожидают решения ({len(pending)}):**")
+            lines.extend([f"📨 {r['full_name']}: {r['request_type']}" for r in pending] or ["—"])
+            lines.append(f"\n**Итоги за {prev_day.strftime('%d.%m.%Y')}:**")
+            lines.extend(yesterday or ["Нет данных."])
+            digests[manager_id] = "\n".join(lines)
+        return digests
+
     @staticmethod
     async def get_employee_report_text(user_id: int, start_date: datetime.date, end_date: datetime.date) -> str:
         """Генерирует текстовое содержимое отчета для сотрудника."""
-        work_logs = db.get_work_logs_for_user(user_id, str(start_date), str(end_date + datetime.timedelta(days=1)))
-        total_work_seconds = sum(log.get('total_work_seconds', 0) for log in work_logs)
-        total_break_seconds = sum(log.get('total_break_seconds', 0) for log in work_logs)
-        
-        report_text = f"**Отчет для вас за период с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}**\n\n"
-        report_text += f"**Чистое рабочее время:** {seconds_to_str(total_work_seconds)}\n"
-        report_text += f"**Время на перерывах:** {seconds_to_str(total_break_seconds)}\n\n"
+        stamp = ReportGenerator.freshness_stamp(end_date)
+        cached = report_cache.get('employee', user_id, start_date, end_date, stamp)
+        if cached is None:
+            work_logs = db.get_work_logs_for_user(user_id, str(start_date), str(end_date + datetime.timedelta(days=1)))
+            total_work_seconds = sum(log.get('total_work_seconds', 0) for log in work_logs)
+            total_break_seconds = sum(log.get('total_break_seconds', 0) for log in work_logs)
+            
+            period_text = f"**Отчет для вас за период с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}**\n\n"
+            absences = db.get_absences_for_user_in_period(user_id, start_date, end_date)
+            user = db.get_user(user_id)
+            absence_periods = [(a['start_date'], a['end_date']) for a in absences]
+            expected_seconds = ReportGenerator._norm_until_today(user, start_date, end_date, absence_periods)
+            full_period_seconds = work_calendar.expected_for_user(user, start_date, end_date, absence_periods)
+            period_text += f"**Чистое рабочее время:** {seconds_to_str(total_work_seconds)}\n"
+            if full_period_seconds != expected_seconds:
+                # Период еще идет: отклонение считается от нормы на сегодня, норма всего периода - для справки
+                period_text += f"**Норма на сегодня:** {seconds_to_str(expected_seconds)} ({ReportGenerator._format_deviation(total_work_seconds, expected_seconds)})\n"
+                period_text += f"**Норма за весь период:** {seconds_to_str(full_period_seconds)}\n"
+            else:
+                period_text += f"**Норма за период:** {seconds_to_str(expected_seconds)} ({ReportGenerator._format_deviation(total_work_seconds, expected_seconds)})\n"
+            period_text += f"**Время на перерывах:** {seconds_to_str(total_break_seconds)}\n\n"
+            cleared_debt = db.get_debt_logs_for_user(user_id, str(start_date), str(end_date + datetime.timedelta(days=1)))
+            cached = (period_text, cleared_debt)
+            report_cache.set('employee', user_id, start_date, end_date, cached, [user_id], stamp)
         
-        cleared_debt = db.get_debt_logs_for_user(user_id, str(start_date), str(end_date + datetime.timedelta(days=1)))
+        # Текущий долг не зависит от периода, поэтому всегда читается заново
+        report_text, cleared_debt = cached
         total_current_debt = db.get_total_debt(user_id)
         if cleared_debt > 0 or total_current_debt > 0:
             report_text += f"**Отработка:**\n"
@@ -75,6 +139,10 @@ class ReportGenerator:
     @staticmethod
     async def get_manager_report_text(manager_id: int, start_date: datetime.date, end_date: datetime.date) -> str:
         """Генерирует текстовое содержимое отчета для руководителя."""
+        stamp = ReportGenerator.freshness_stamp(end_date)
+        cached = report_cache.get('manager', manager_id, start_date, end_date, stamp)
+        if cached is not None:
+            return cached
         team_members = db.get_managed_users(manager_id)
         if not team_members:
             return "За вами не закреплено ни одного сотрудника."
@@ -89,24 +157,148 @@ class ReportGenerator:
             # Для отсутствий нужно проверять весь период, а не одну дату
             absences_list = db.get_absences_for_user_in_period(member_id, start_date, end_date) # Предполагается, что такая функция будет создана в database.py
             
-            employee_line = f"👤 **{member_name}**:"
-            
-            if logs:
-                total_work = sum(log.get('total_work_seconds', 0) for log in logs)
-                total_break = sum(log.get('total_break_seconds', 0) for log in logs)
-                employee_line += f" отработано {seconds_to_str(total_work)} (перерывы: {seconds_to_str(total_break)})."
-            
-            if absences_list:
-                details = [f"{a['absence_type']} ({a['start_date'].strftime('%d.%m')}-{a['end_date'].strftime('%d.%m')})" for a in absences_list]
-                employee_line += f"\n  - *Отсутствия:* {', '.join(details)}" if logs else f" *{', '.join(details)}.*"
-            
-            if not logs and not absences_list:
-                employee_line += " нет данных за период."
-                
-            report_lines.append(employee_line)
+            total_work = sum(log.get('total_work_seconds', 0) for log in logs) if logs else None
+            total_break = sum(log.get('total_break_seconds', 0) for log in logs) if logs else None
+            details = [f"{a['absence_type']} ({a['start_date'].strftime('%d.%m')}-{a['end_date'].strftime('%d.%m')})" for a in absences_list]
+            expected = ReportGenerator._norm_until_today(member, start_date, end_date, [(a['start_date'], a['end_date']) for a in absences_list])
+            report_lines.append(ReportGenerator._format_member_report_line(member_name, total_work, total_break, details, expected))
+
+        report_text = "\n".join(report_lines)
+        report_cache.set('manager', manager_id, start_date, end_date, report_text, [m['user_id'] for m in team_members], stamp)
+        return report_text
+
+    @staticmethod
+    def freshness_stamp(end_date: datetime.date) -> Optional[str]:
+        """
+        Отметка актуальности кэша для отчета за незакрытый период: норма в нем считается по "сегодня"
+        сотрудника и меняется в полночь его пояса. Полночь любого пояса приходится на границу
+        четверти часа UTC, поэтому такой отчет из кэша годен до конца текущей четверти часа.
+        Период, закончившийся раньше вчерашнего дня по UTC, закрыт во всех поясах (None).
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if end_date < now.date() - datetime.timedelta(days=1):
+            return None
+        return f"{now:%Y-%m-%d %H}:{now.minute // 15}"
 
+    @staticmethod
+    def _norm_until_today(user: Optional[dict], start_date: datetime.date, end_date: datetime.date, absences) -> int:
+        """Норма за прошедшую часть периода: дни после "сегодня" сотрудника (в его поясе) еще не наступили."""
+        today = timezones.today(timezones.for_user(user))
+        return work_calendar.expected_for_user(user, start_date, min(end_date, today), absences)
+
+    @staticmethod
+    def _format_deviation(actual: int, expected: int) -> str:
+        """Отклонение от нормы: '+1 ч 30 мин' - переработка, '-2 ч 0 мин' - недоработка."""
+        difference = (actual or 0) - expected
+        return f"{'+' if difference >= 0 else '-'}{seconds_to_str(abs(difference))}"
+
+    @staticmethod
+    def _format_member_report_line(member_name: str, total_work, total_break, absence_details: List[str], expected: Optional[int] = None) -> str:
+        """
+        Формирует строку отчета по сотруднику. total_work=None означает, что логов за период нет.
+        expected - норма по календарю и графику сотрудника на прошедшую часть периода (None - не показывать).
+        """
+        employee_line = f"👤 **{member_name}**:"
+        
+        if total_work is not None:
+            employee_line += f" отработано {seconds_to_str(total_work)}"
+            if expected is not None:
+                employee_line += f" при норме {seconds_to_str(expected)} ({ReportGenerator._format_deviation(total_work, expected)})"
+            employee_line += f" (перерывы: {seconds_to_str(total_break or 0)})."
+        
+        if absence_details:
+            employee_line += f"\n  - *Отсутствия:* {', '.join(absence_details)}" if total_work is not None else f" *{', '.join(absence_details)}.*"
+        
+        if total_work is None and not absence_details:
+            employee_line += f" нет данных за период (норма {seconds_to_str(expected)})." if expected else " нет данных за период."
+        return employee_line
+
+    @staticmethod
+    def _render_grouped_report(title: str, rows: List[dict], start_date: datetime.date, end_date: datetime.date) -> str:
+        """Отчет по строкам db.get_org_report_rows, сгруппированный по основному руководителю."""
+        report_lines = [title]
+        current_manager = object()
+        for row in rows:
+            if row['manager_id'] != current_manager:
+                current_manager = row['manager_id']
+                header = row['manager_name'] or (f"ID {current_manager}" if current_manager else "Без руководителя")
+                report_lines.append(f"\n**Руководитель: {header}**")
+            details, absence_periods = [], []
+            if row['absence_types']:
+                details = [f"{t} ({s.strftime('%d.%m')}-{e.strftime('%d.%m')})" for t, s, e in zip(row['absence_types'], row['absence_starts'], row['absence_ends'])]
+                absence_periods = list(zip(row['absence_starts'], row['absence_ends']))
+            expected = ReportGenerator._norm_until_today(row, start_date, end_date, absence_periods)
+            report_lines.append(ReportGenerator._format_member_report_line(row['full_name'], row['work_seconds'], row['break_seconds'], details, expected))
         return "\n".join(report_lines)
 
+    @staticmethod
+    async def get_org_report_text(start_date: datetime.date, end_date: datetime.date) -> str:
+        """Генерирует отчет по всей организации, сгруппированный по основному руководителю."""
+        stamp = ReportGenerator.freshness_stamp(end_date)
+        cached = report_cache.get('org', 0, start_date, end_date, stamp)
+        if cached is not None:
+            return cached
+        rows = db.get_org_report_rows(start_date, end_date)
+        if not rows:
+            return "В базе данных пока нет пользователей."
+        title = f"**Отчет по организации за период с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}**"
+        report_text = ReportGenerator._render_grouped_report(title, rows, start_date, end_date)
+        report_cache.set('org', 0, start_date, end_date, report_text, stamp=stamp)
+        return report_text
+
+    @staticmethod
+    async def get_tree_report_text(manager_id: int, start_date: datetime.date, end_date: datetime.date) -> str:
+        """Генерирует отчет по всей структуре подчинения руководителя, сгруппированный по руководителям."""
+        stamp = ReportGenerator.freshness_stamp(end_date)
+        cached = report_cache.get('tree', manager_id, start_date, end_date, stamp)
+        if cached is not None:
+            return cached
+        user_ids = [member['user_id'] for member in db.get_managed_users(manager_id, max_depth=None)]
+        if not user_ids:
+            return "За вами не закреплено ни одного сотрудника."
+        rows = db.get_org_report_rows(start_date, end_date, user_ids)
+        title = f"**Отчет по структуре за период с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}**"
+        report_text = ReportGenerator._render_grouped_report(title, rows, start_date, end_date)
+        report_cache.set('tree', manager_id, start_date, end_date, report_text, user_ids, stamp)
+        return report_text
+
+    @staticmethod
+    async def get_analytics_report_text(manager_id: int, start_date: datetime.date, end_date: datetime.date) -> str:
+        """Генерирует отчет со статистикой посещаемости команды руководителя."""
+        import analytics # Локальный импорт: NumPy нужен только для этого отчета
+        team_members = db.get_managed_users(manager_id)
+        if not team_members:
+            return "За вами не закреплено ни одного сотрудника."
+        names = {m['user_id']: m['full_name'] for m in team_members}
+        columns = analytics.load_work_intervals(list(names), start_date, end_date)
+        stats = analytics.compute_attendance_stats(columns)
+
+        lines = [f"**📈 Аналитика команды за период с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}**\n"]
+        if stats['count'] == 0:
+            lines.append("Нет данных за период.")
+            return "\n".join(lines)
+
+        to_hhmm = lambda sod: f"{int(sod) // 3600:02d}:{int(sod) % 3600 // 60:02d}"
+        weekday_names = ['', 'Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+        lines.append("**Среднее начало и конец дня:**")
+        for day in range(1, 8):
+            if stats['days_by_weekday'][day]:
+                lines.append(f"{weekday_names[day]}: {to_hhmm(stats['avg_start_by_weekday'][day])} - {to_hhmm(stats['avg_end_by_weekday'][day])} (дней: {stats['days_by_weekday'][day]})")
+
+        lines.append(f"\n**Опоздания** (доля дней: {stats['late_share']:.0%}):")
+        for label, value in zip(analytics.LATENESS_LABELS, stats['lateness_distribution']):
+            lines.append(f"{label}: {value}")
+
+        lines.append(f"\n**Переработка** (доля дней: {stats['overtime_share']:.0%}):")
+        for percentile, value in stats['overtime_percentiles'].items():
+            sign = "-" if value < 0 else ""
+            lines.append(f"p{percentile}: {sign}{seconds_to_str(abs(value))}")
+
+        lines.append("\n**Удаленно / в офисе:**")
+        for user_id, ratio in sorted(stats['remote_ratio_by_user'].items(), key=lambda item: names.get(item[0], '')):
+            lines.append(f"👤 {names.get(user_id, user_id)}: удаленно {ratio:.0%}, в офисе {1 - ratio:.0%} (дней: {stats['days_by_user'][user_id]})")
+        return "\n".join(lines)
+
 # Примечание: для get_manager_report_text может потребоваться добавить в database.py функцию
 # get_absences_for_user_in_period, которая ищет пересечения отсутствий с заданным диапазоном дат.
 # Пример такой функции:
@@ -117,4 +309,4 @@ class ReportGenerator:
 #                 "SELECT * FROM absences WHERE user_id = %s AND start_date <= %s AND end_date >= %s",
 #                 (user_id, end_date, start_date)
 #             )
-#             return cursor.fetchall()
\ No newline at end of file
+#             return cursor.fetchall()
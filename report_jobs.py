@@ -0,0 +1,114 @@
+# Файл: report_jobs.py
+# Этот модуль выполняет построение отчетов в фоне, чтобы не блокировать обработку обновлений.
+
+import asyncio
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Hashable, List, Set
+
+import database as db
+from config import CONFIG
+from menu_generator import MenuGenerator
+from report_generator import ReportGenerator
+from utils import send_long_message
+
+logger = logging.getLogger(__name__)
+
+class ReportJobManager:
+    """
+    Очередь фоновых отчетов. Отчеты строятся в пуле потоков ограниченного размера,
+    одинаковые запросы, пришедшие пока отчет строится, объединяются в один,
+    а при переполнении очереди новые запросы отклоняются.
+    """
+
+    def __init__(self, max_workers: int, queue_limit: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self._in_flight: Dict[Hashable, List[Callable[[str], Awaitable]]] = {}
+        # Цикл событий хранит задачи только по слабым ссылкам: без этого набора задача могла бы быть собрана посреди построения
+        self._tasks: Set[asyncio.Task] = set()
+        self.queue_limit = queue_limit
+        self.merged = 0
+        self.rejected = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def submit(self, key: Hashable, build: Callable[[], Awaitable[str]], deliver: Callable[[str], Awaitable]) -> str:
+        """
+        Ставит отчет в очередь. build - корутина-фабрика, строящая текст отчета,
+        deliver - корутина, отправляющая результат (None при ошибке).
+        Возвращает 'started', 'merged' или 'rejected'.
+        """
+        waiters = self._in_flight.get(key)
+        if waiters is not None:
+            waiters.append(deliver)
+            self.merged += 1
+            return 'merged'
+        if len(self._in_flight) >= self.queue_limit:
+            self.rejected += 1
+            return 'rejected'
+        self._in_flight[key] = [deliver]
+        task = asyncio.create_task(self._run(key, build))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return 'started'
+
+    async def _run(self, key: Hashable, build: Callable[[], Awaitable[str]]):
+        loop = asyncio.get_running_loop()
+        text = None
+        try:
+            # Генераторы отчетов внутри синхронны (psycopg2), поэтому выполняем их целиком в рабочем потоке
+            text = await loop.run_in_executor(self._executor, lambda: asyncio.run(build()))
+        except Exception as e:
+            logger.error("Ошибка при построении отчета %s: %s", key, e, exc_info=True)
+        finally:
+            waiters = self._in_flight.pop(key, [])
+        for deliver in waiters:
+            try:
+                await deliver(text)
+            except Exception as e:
+                logger.error("Ошибка при отправке отчета %s: %s", key, e, exc_info=True)
+
+    def shutdown(self):
+        """Останавливает пул потоков при завершении приложения; еще не начатые отчеты отменяются."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+report_jobs = ReportJobManager(CONFIG.REPORT_WORKERS, CONFIG.REPORT_QUEUE_LIMIT)
+
+REPORT_BUILDERS = {
+    'employee': lambda user_id, start_date, end_date: ReportGenerator.get_employee_report_text(user_id, start_date, end_date),
+    'manager': lambda user_id, start_date, end_date: ReportGenerator.get_manager_report_text(user_id, start_date, end_date),
+    'tree': lambda user_id, start_date, end_date: ReportGenerator.get_tree_report_text(user_id, start_date, end_date),
+    'org': lambda user_id, start_date, end_date: ReportGenerator.get_org_report_text(start_date, end_date),
+    'analytics': lambda user_id, start_date, end_date: ReportGenerator.get_analytics_report_text(user_id, start_date, end_date),
+}
+
+async def _reply_markup_for(user_id: int, report_type: str):
+    if report_type in ['manager', 'tree', 'org', 'analytics']:
+        return MenuGenerator.get_manager_menu()
+    is_in_session = bool(db.get_session_state(user_id))
+    return MenuGenerator.get_working_menu() if is_in_session else await MenuGenerator.get_main_menu(user_id)
+
+def schedule_period_report(bot, user_id: int, report_type: str, start_date: datetime.date, end_date: datetime.date) -> str:
+    """Ставит в очередь отчет за период; готовый текст придет пользователю отдельным сообщением."""
+    builder = REPORT_BUILDERS[report_type]
+    subject_id = 0 if report_type == 'org' else user_id
+    key = (report_type, subject_id, start_date, end_date)
+
+    async def deliver(text: str):
+        if text is None:
+            await bot.send_message(user_id, "Не удалось сформировать отчет. Попробуйте позже.")
+            return
+        await send_long_message(bot, user_id, text, reply_markup=await _reply_markup_for(user_id, report_type))
+
+    return report_jobs.submit(key, lambda: builder(user_id, start_date, end_date), deliver)
+
+def report_status_text(result: str) -> str:
+    """Текст подтверждения для пользователя по результату постановки отчета в очередь."""
+    if result == 'rejected':
+        return "Сейчас формируется слишком много отчетов. Попробуйте через минуту."
+    if result == 'merged':
+        return "⏳ Этот отчет уже формируется, пришлю его, как только он будет готов."
+    return "⏳ Формирую отчет, пришлю его отдельным сообщением."
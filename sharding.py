@@ -0,0 +1,239 @@
+# Файл: sharding.py
+# Этот модуль запускает бота в нескольких процессах: процесс-приемник получает обновления
+# от Telegram (long polling или вебхук) и раздает их рабочим процессам по user_id.
+# Каждый рабочий процесс - полноценное приложение из bot.py со своим пулом соединений и кэшами.
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+from config import CONFIG
+from logging_setup import SAMPLED, setup_logging
+
+logger = logging.getLogger(__name__)
+
+def shard_for(user_id: Optional[int], workers: int) -> int:
+    """Номер рабочего процесса пользователя. Обновления без пользователя обрабатывает процесс 0."""
+    if user_id is None:
+        return 0
+    return user_id % workers
+
+def _worker_log_path(index: int) -> str:
+    """Свой файл лога для каждого процесса: ротация одного файла из нескольких процессов небезопасна."""
+    root, ext = os.path.splitext(CONFIG.LOG_FILE_PATH)
+    return f"{root}.worker{index}{ext}"
+
+# --- Рабочий процесс ---
+
+def _replicated_targets() -> Dict[str, Tuple[Any, Tuple[str, ...]]]:
+    """
+    Общие для всех пользователей данные в памяти процесса и методы, которые их меняют.
+    Вызов такого метода в одном процессе повторяется в остальных, иначе, например,
+    отчет руководителя в другом процессе остался бы в кэше после изменения данных сотрудника.
+    """
+    from geofence import geofence_index
+    from report_cache import report_cache
+    from user_search import user_search_index
+    from work_calendar import work_calendar
+    return {
+        'report_cache': (report_cache, ('invalidate_user', 'invalidate_subject', 'clear')),
+        'user_search_index': (user_search_index, ('upsert', 'remove')),
+        'geofence_index': (geofence_index, ('upsert', 'remove')),
+        'work_calendar': (work_calendar, ('load',)),
+    }
+
+class WorkerPeers:
+    """
+    Связь рабочего процесса с остальными через их входящие очереди.
+    Сообщения в очереди: ('update', dict) - обновление Telegram; ('invalidate', kind, user_id) -
+    сброс записи state_cache у владельца пользователя; ('call', target, method, args, kwargs) -
+    повтор изменения общих данных; None - остановка.
+    """
+
+    def __init__(self, index: int, inboxes: List[multiprocessing.Queue]):
+        self.index = index
+        self.inboxes = inboxes
+        self._local_calls: Dict[Tuple[str, str], Callable] = {}
+
+    @property
+    def workers(self) -> int:
+        return len(self.inboxes)
+
+    def owns(self, user_id: int) -> bool:
+        return shard_for(user_id, self.workers) == self.index
+
+    def send_invalidation(self, kind: str, user_id: int):
+        """Подписчик state_cache: изменение чужого пользователя передается его процессу."""
+        self.inboxes[shard_for(user_id, self.workers)].put(('invalidate', kind, user_id))
+
+    def _broadcast(self, message: tuple):
+        for index, inbox in enumerate(self.inboxes):
+            if index != self.index:
+                inbox.put(message)
+
+    def replicate(self, name: str, target: Any, methods: Tuple[str, ...]):
+        """Подменяет методы объекта так, что после локального вызова он повторяется в остальных процессах."""
+        for method in methods:
+            original = getattr(target, method)
+            self._local_calls[(name, method)] = original
+
+            def wrapper(*args, _original=original, _method=method, **kwargs):
+                result = _original(*args, **kwargs)
+                self._broadcast(('call', name, _method, args, kwargs))
+                return result
+
+            setattr(target, method, wrapper)
+
+    def apply_call(self, name: str, method: str, args: tuple, kwargs: dict):
+        """Повтор изменения из другого процесса - исходным методом, без повторной рассылки."""
+        self._local_calls[(name, method)](*args, **kwargs)
+
+async def _dispatch_inbox(application, peers: WorkerPeers, inbox: multiprocessing.Queue):
+    """Читает входящую очередь процесса, пока не придет сигнал остановки."""
+    from state_cache import state_cache
+    while True:
+        message = await asyncio.to_thread(inbox.get)
+        if message is None:
+            return
+        kind = message[0]
+        try:
+            if kind == 'update':
+                await application.update_queue.put(Update.de_json(message[1], application.bot))
+            elif kind == 'invalidate':
+                state_cache.apply_remote_invalidation(message[1], message[2])
+            elif kind == 'call':
+                peers.apply_call(*message[1:])
+        except Exception:
+            logger.exception("Не удалось обработать сообщение %s из очереди процесса %s.", kind, peers.index)
+
+async def _run_worker(peers: WorkerPeers):
+    # Импорт здесь: в процессе-приемнике обработчики, пул и кэши не нужны
+    from bot import build_application, post_init, post_shutdown, prepare_runtime
+    from state_cache import state_cache
+
+    state_cache.set_owner_predicate(peers.owns)
+    state_cache.on_invalidate(peers.send_invalidation)
+    prepare_runtime()
+    for name, (target, methods) in _replicated_targets().items():
+        peers.replicate(name, target, methods)
+
+    # Задачи по расписанию (ночное закрытие, сводка, контрольные точки) выполняет только процесс 0
+    application = build_application(with_jobs=peers.index == 0)
+    async with application:
+        await post_init(application)
+        await application.start()
+        logger.info("Рабочий процесс %s из %s принимает обновления.", peers.index, peers.workers)
+        try:
+            await _dispatch_inbox(application, peers, peers.inboxes[peers.index])
+        finally:
+            await application.stop()
+            await post_shutdown(application)
+    logger.info("Рабочий процесс %s остановлен.", peers.index)
+
+def _worker_main(index: int, inboxes: List[multiprocessing.Queue]):
+    """Точка входа рабочего процесса. Ctrl+C получает приемник, рабочие останавливаются по сигналу из очереди."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    listener = setup_logging(CONFIG.LOG_LEVEL, _worker_log_path(index), CONFIG.LOG_MAX_BYTES, CONFIG.LOG_BACKUP_COUNT, CONFIG.LOG_SAMPLE_PER_MINUTE)
+    # Каждому процессу свой порт метрик
+    CONFIG.METRICS_PORT += index
+    try:
+        asyncio.run(_run_worker(WorkerPeers(index, inboxes)))
+    finally:
+        listener.stop()
+
+# --- Процесс-приемник ---
+
+class ShardSupervisor:
+    """
+    Запускает рабочие процессы и раздает им обновления. Пользователь всегда попадает в один
+    и тот же процесс, поэтому его кэши и порядок обработки его нажатий не требуют общих блокировок.
+    Процессы создаются через spawn: при fork дочерние процессы унаследовали бы соединения пула приемника.
+    """
+
+    def __init__(self, workers: int):
+        self._context = multiprocessing.get_context('spawn')
+        self.inboxes = [self._context.Queue() for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.routed = [0] * workers
+
+    def _spawn(self, index: int):
+        process = self._context.Process(target=_worker_main, args=(index, self.inboxes), name=f"bot-worker-{index}")
+        process.start()
+        self.processes[index] = process
+        logger.info("Запущен рабочий процесс %s (pid %s).", index, process.pid)
+
+    def start(self):
+        for index in range(len(self.inboxes)):
+            self._spawn(index)
+
+    def route(self, update: Update):
+        """Передает обновление процессу его пользователя; упавший процесс перезапускается."""
+        user = update.effective_user
+        index = shard_for(user.id if user else None, len(self.inboxes))
+        if not self.processes[index].is_alive():
+            logger.error("Рабочий процесс %s завершился с кодом %s, перезапуск.", index, self.processes[index].exitcode)
+            self._spawn(index)
+        self.inboxes[index].put(('update', update.to_dict()))
+        self.routed[index] += 1
+        logger.debug("Обновление %s передано процессу %s.", update.update_id, index, extra=SAMPLED)
+
+    def stop(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(CONFIG.WORKER_STOP_TIMEOUT_SECONDS)
+            if process.is_alive():
+                logger.warning("Рабочий процесс %s не остановился за %s с, завершается принудительно.", index, CONFIG.WORKER_STOP_TIMEOUT_SECONDS)
+                process.terminate()
+                process.join()
+        logger.info("Рабочие процессы остановлены, передано обновлений по процессам: %s.", self.routed)
+
+async def _run_ingress(supervisor: ShardSupervisor):
+    """Получает обновления через Updater из PTB и раздает их, не разбирая дальше пользователя."""
+    update_queue: asyncio.Queue = asyncio.Queue()
+    updater = Updater(Bot(CONFIG.TELEGRAM_BOT_TOKEN), update_queue)
+    async with updater:
+        if CONFIG.WEBHOOK_URL:
+            await updater.start_webhook(listen=CONFIG.WEBHOOK_LISTEN, port=CONFIG.WEBHOOK_PORT, webhook_url=CONFIG.WEBHOOK_URL,
+                                        allowed_updates=Update.ALL_TYPES)
+        else:
+            await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        logger.info("Приемник обновлений запущен (%s), рабочих процессов: %s.",
+                    'вебхук' if CONFIG.WEBHOOK_URL else 'long polling', len(supervisor.inboxes))
+        try:
+            while True:
+                supervisor.route(await update_queue.get())
+        finally:
+            await updater.stop()
+
+def run_sharded(workers: int):
+    """
+    Запуск в режиме нескольких процессов. Схема БД обновляется один раз здесь,
+    до старта рабочих процессов, чтобы они не выполняли миграцию одновременно.
+    """
+    import database as db
+    db.init_db()
+    db.close_pool()
+    supervisor = ShardSupervisor(workers)
+    supervisor.start()
+    try:
+        asyncio.run(_run_ingress(supervisor))
+    except KeyboardInterrupt:
+        logger.info("Получен сигнал остановки.")
+    finally:
+        supervisor.stop()
+
+if __name__ == "__main__":
+    ingress_listener = setup_logging(CONFIG.LOG_LEVEL, CONFIG.LOG_FILE_PATH, CONFIG.LOG_MAX_BYTES, CONFIG.LOG_BACKUP_COUNT, CONFIG.LOG_SAMPLE_PER_MINUTE)
+    try:
+        run_sharded(max(CONFIG.WORKER_COUNT, 1))
+    finally:
+        ingress_listener.stop()
@@ -0,0 +1,148 @@
+# Файл: state_cache.py
+# Этот модуль держит в памяти активные рабочие сессии и профили пользователей,
+# чтобы частые нажатия кнопок не ходили в базу за одними и теми же строками.
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+MISSING = object()  # Признак "в кэше нет, нужно читать из БД"
+
+class StateCache:
+    """
+    Кэш со сквозной записью: функции database.py обновляют его сразу после записи в БД.
+    Сессии после предзагрузки считаются полными: если сессии пользователя нет в кэше,
+    значит, ее нет и в базе, и запрос не нужен. Профили пользователей хранятся с TTL.
+
+    Кэшируются только "свои" пользователи (owns), чтобы при нескольких процессах
+    каждый держал только тех, чьи обновления он обрабатывает. Изменение чужого
+    пользователя не кэшируется, а передается подписчикам (on_invalidate), чтобы владелец сбросил запись.
+    """
+
+    def __init__(self, user_ttl: float = 300):
+        self.user_ttl = user_ttl
+        self._lock = threading.Lock()
+        self._sessions: Dict[int, Optional[dict]] = {}
+        self._stale_sessions: Set[int] = set()
+        self._sessions_complete = False
+        self._users: Dict[int, Tuple[Optional[dict], float]] = {}
+        self._owns: Callable[[int], bool] = lambda user_id: True
+        self._listeners: List[Callable[[str, int], None]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def set_owner_predicate(self, owns: Callable[[int], bool]):
+        with self._lock:
+            self._owns = owns
+            self._sessions = {user_id: state for user_id, state in self._sessions.items() if owns(user_id)}
+            self._users = {user_id: entry for user_id, entry in self._users.items() if owns(user_id)}
+
+    def owns(self, user_id: int) -> bool:
+        return self._owns(user_id)
+
+    def on_invalidate(self, listener: Callable[[str, int], None]):
+        """listener(kind, user_id) вызывается при изменении пользователя, которого этот процесс не кэширует."""
+        self._listeners.append(listener)
+
+    # --- Сессии ---
+
+    def get_session(self, user_id: int):
+        """Возвращает копию сессии, None (сессии точно нет) или MISSING (нужно читать из БД)."""
+        if not self._owns(user_id):
+            return MISSING
+        with self._lock:
+            state = self._sessions.get(user_id, MISSING)
+            if state is MISSING and self._sessions_complete and user_id not in self._stale_sessions:
+                state = None
+            if state is MISSING:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            return dict(state) if state is not None else None
+
+    def put_session(self, user_id: int, state: Optional[dict]):
+        """Запоминает сессию после записи/чтения из БД (None - сессии нет)."""
+        if not self._owns(user_id):
+            self._notify('session', user_id)
+            return
+        with self._lock:
+            self._sessions[user_id] = dict(state) if state is not None else None
+            self._stale_sessions.discard(user_id)
+
+    def invalidate_session(self, user_id: int):
+        """Сессия изменилась в обход кэша (например, ночным закрытием): следующее чтение идет в БД."""
+        with self._lock:
+            self._sessions.pop(user_id, None)
+            self._stale_sessions.add(user_id)
+        if not self._owns(user_id):
+            self._notify('session', user_id)
+
+    def load_sessions(self, sessions: Dict[int, dict]):
+        """Предзагрузка всех активных сессий; после нее отсутствие в кэше означает отсутствие сессии."""
+        with self._lock:
+            self._sessions = {user_id: state for user_id, state in sessions.items() if self._owns(user_id)}
+            self._stale_sessions.clear()
+            self._sessions_complete = True
+
+    # --- Пользователи ---
+
+    def get_user(self, user_id: int):
+        if not self._owns(user_id):
+            return MISSING
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            return dict(entry[0]) if entry[0] is not None else None
+
+    def peek_user(self, user_id: int):
+        """
+        Как get_user, но без учета в hits/misses и без копирования: для служебных проверок
+        (ограничение частоты), которые не должны искажать статистику кэша. Строку менять нельзя.
+        """
+        if not self._owns(user_id):
+            return MISSING
+        with self._lock:
+            entry = self._users.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            return MISSING
+        return entry[0]
+
+    def put_user(self, user_id: int, row: Optional[dict]):
+        if not self._owns(user_id):
+            return
+        with self._lock:
+            self._users[user_id] = (dict(row) if row is not None else None, time.monotonic() + self.user_ttl)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            self._users.pop(user_id, None)
+        if not self._owns(user_id):
+            self._notify('user', user_id)
+
+    def load_users(self, rows: List[dict]):
+        expires_at = time.monotonic() + self.user_ttl
+        with self._lock:
+            self._users = {row['user_id']: (dict(row), expires_at) for row in rows if self._owns(row['user_id'])}
+
+    # --- Общее ---
+
+    def _notify(self, kind: str, user_id: int):
+        for listener in self._listeners:
+            listener(kind, user_id)
+
+    def apply_remote_invalidation(self, kind: str, user_id: int):
+        """Сброс записи по сообщению от другого процесса."""
+        if kind == 'session':
+            self.invalidate_session(user_id)
+        else:
+            with self._lock:
+                self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'sessions': len(self._sessions), 'users': len(self._users), 'hits': self.hits, 'misses': self.misses}
+
+state_cache = StateCache()
@@ -0,0 +1,88 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class RecordingCursor:
+    """Курсор, который запоминает запросы; fetch* отдают строки первого подходящего шаблона из results."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.statements = connection.statements
+        self.results = connection.results
+        self.rows = []
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.statements.append((' '.join(query.split()), params))
+        self.rows = next((list(rows) for fragment, rows in self.results.items() if fragment in query), [])
+        self.rowcount = len(self.rows) or 1
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+        self.results = {}
+        self.connections = 0
+
+    def cursor(self, cursor_factory=None):
+        return RecordingCursor(self)
+
+@pytest.fixture
+def sql(monkeypatch):
+    """
+    Подменяет соединение с БД записью запросов: sql.statements - [(запрос, параметры)] в порядке выполнения,
+    sql.results - {фрагмент запроса: строки результата}, sql.connections - число открытых транзакций.
+    """
+    import database as db
+
+    recording = RecordingConnection()
+
+    @contextmanager
+    def db_connection():
+        recording.connections += 1
+        yield recording
+
+    def execute_values(cursor, query, argslist, template=None, page_size=100, fetch=False):
+        cursor.execute(query, {'values': list(argslist), 'template': template})
+
+    monkeypatch.setattr(db, 'db_connection', db_connection)
+    monkeypatch.setattr(db, 'execute_values', execute_values)
+    return recording
+
+@pytest.fixture
+def pg(monkeypatch):
+    """
+    Пустая схема в настоящей PostgreSQL из TEST_DATABASE_URL (все таблицы бота в ней пересоздаются).
+    Без переменной тест пропускается. Кэши database.py заменяются новыми на время теста.
+    """
+    url = os.getenv('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    import database as db
+    from config import CONFIG
+    from report_cache import ReportCache
+    from state_cache import StateCache
+
+    db.close_pool()
+    monkeypatch.setattr(CONFIG, 'DATABASE_URL', url)
+    monkeypatch.setattr(db, 'state_cache', StateCache())
+    monkeypatch.setattr(db, 'report_cache', ReportCache())
+    db.init_db(drop_existing=True)
+    yield db
+    db.close_pool()
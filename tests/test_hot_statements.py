@@ -0,0 +1,28 @@
+# Проверки подготовленных операторов (HOT_STATEMENTS) на настоящей PostgreSQL.
+
+import datetime
+
+def _users_columns(pg):
+    with pg.db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'users'")
+            return {row[0] for row in cursor.fetchall()}
+
+def test_user_columns_match_schema(pg):
+    assert {column.strip() for column in pg.USER_COLUMNS.split(',')} == _users_columns(pg)
+
+def test_prepared_statements_survive_alter_table(pg, monkeypatch):
+    monkeypatch.setattr(pg, '_hot_statements_enabled', False)
+    pg.add_or_update_user(42, "Сотрудник")
+    pg.add_absence(42, "Отпуск", datetime.date(2026, 11, 1), datetime.date(2026, 11, 5))
+    pg.warm_up()
+
+    with pg.db_connection() as conn:
+        with conn.cursor() as cursor:
+            for table in ('users', 'absences', 'work_log'):
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN added_later TEXT")
+    pg.state_cache.invalidate_user(42)
+
+    assert pg.get_user(42)['full_name'] == "Сотрудник"
+    assert pg.get_absences_for_user(42, datetime.date(2026, 11, 3))[0]['absence_type'] == "Отпуск"
+    assert pg.get_todays_work_log_for_user(42) is None
@@ -0,0 +1,79 @@
+# Проверки удаления офиса при открытых сессиях: закрытие дня и ночной сброс не должны
+# записывать в work_log ссылку на удаленный офис.
+
+import asyncio
+import datetime
+
+import pytest
+
+import database as db
+from menu_generator import MenuGenerator
+from state_cache import MISSING, StateCache
+from utils import end_workday_logic, get_now
+
+@pytest.fixture
+def no_menu(monkeypatch):
+    async def get_main_menu(user_id):
+        return None
+
+    monkeypatch.setattr(MenuGenerator, 'get_main_menu', staticmethod(get_main_menu))
+
+def test_delete_office_clears_open_sessions_in_same_transaction(sql, monkeypatch):
+    cache = StateCache()
+    monkeypatch.setattr(db, 'state_cache', cache)
+    cache.put_session(42, {'status': 'working', 'office_id': 3})
+    sql.results["UPDATE work_sessions"] = [(42,)]
+
+    assert db.delete_office(3)
+
+    assert sql.connections == 1
+    queries = [query for query, _ in sql.statements]
+    assert queries[0].startswith("UPDATE work_sessions SET state_json = state_json - 'office_id'")
+    assert queries[-1].startswith("DELETE FROM offices")
+    assert cache.get_session(42) is MISSING
+
+def test_add_work_log_does_not_reference_unknown_office(sql):
+    sql.results["RETURNING log_id"] = [(1,)]
+    start = get_now() - datetime.timedelta(hours=8)
+
+    db.add_work_log(42, start, get_now(), 8 * 3600, 0, 'office', 3)
+
+    query, params = next((query, params) for query, params in sql.statements if query.startswith("INSERT INTO work_log"))
+    assert "(SELECT office_id FROM offices WHERE office_id = %s)" in query
+    assert params[-1] == 3
+
+def _work_log_offices(pg, user_id):
+    with pg.db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT office_id FROM work_log WHERE user_id = %s", (user_id,))
+            return [row[0] for row in cursor.fetchall()]
+
+def test_end_workday_after_office_deleted(pg, no_menu):
+    office = pg.add_office("Филиал", 53.0, 83.0, 500)
+    pg.add_or_update_user(42, "Сотрудник")
+    pg.set_session_state(42, {'status': 'working', 'start_time': get_now() - datetime.timedelta(hours=8),
+                              'total_break_seconds': 0, 'is_remote': False, 'office_id': office['office_id']})
+
+    assert pg.delete_office(office['office_id'])
+    assert 'office_id' not in pg.get_session_state(42)
+
+    assert asyncio.run(end_workday_logic(None, 42, notify=False)) is not None
+    assert pg.get_session_state(42) is None
+    assert _work_log_offices(pg, 42) == [None]
+
+def test_closing_sessions_with_deleted_office(pg):
+    """Сессия могла сохранить office_id уже после удаления офиса (гонка с /deloffice)."""
+    pg.add_or_update_user(42, "Сотрудник")
+    pg.add_or_update_user(43, "Сотрудник 2")
+    office = pg.add_office("Филиал", 53.0, 83.0, 500)
+    started = get_now() - datetime.timedelta(days=1, hours=2)
+    for user_id, office_id in ((42, office['office_id'] + 100), (43, office['office_id'])):
+        pg.set_session_state(user_id, {'status': 'working', 'start_time': started, 'total_break_seconds': 0,
+                                       'is_remote': False, 'office_id': office_id})
+
+    assert pg.add_work_log(42, started, started + datetime.timedelta(hours=1), 3600, 0, 'office', office['office_id'] + 100)
+    closed = pg.close_stale_sessions(get_now(), 12 * 3600)
+
+    assert sorted(row['user_id'] for row in closed) == [42, 43]
+    assert _work_log_offices(pg, 42) == [None, None]
+    assert _work_log_offices(pg, 43) == [office['office_id']]
@@ -0,0 +1,179 @@
+# Проверки PostgresPersistence: диалог, начатый до перезапуска, продолжается после него.
+# Большинство тестов заменяет таблицу bot_persistence словарем в памяти (фикстура store);
+# запросы database.py проверяются через запись SQL (sql) и на настоящей PostgreSQL (pg).
+
+import asyncio
+import datetime
+import json
+
+import pytest
+from telegram import Update, User
+from telegram.ext import Application, ConversationHandler, ExtBot
+
+import database as db
+from constants import GET_DATES_TEXT
+from conversation_handlers import absence_conv_handler
+from menu_generator import MenuGenerator
+from persistence import PostgresPersistence
+
+CHAT_ID = USER_ID = 4242
+
+@pytest.fixture
+def store(monkeypatch):
+    """Таблица bot_persistence в памяти: {(namespace, key): JSON}."""
+    rows = {}
+
+    def load_persistence(namespace):
+        return [{'key': key, 'value': json.loads(value)} for (row_namespace, key), value in rows.items() if row_namespace == namespace]
+
+    def save_persistence_batch(changes):
+        for item_key, value in changes.items():
+            if value is None:
+                rows.pop(item_key, None)
+            else:
+                rows[item_key] = value
+
+    monkeypatch.setattr(db, 'load_persistence', load_persistence)
+    monkeypatch.setattr(db, 'save_persistence_batch', save_persistence_batch)
+    return rows
+
+async def _start_absence_dialog(persistence: PostgresPersistence):
+    """Состояние, которое Application записал бы после выбора типа отсутствия (ask_for_dates_text)."""
+    await persistence.update_conversation('absence', (CHAT_ID, USER_ID), GET_DATES_TEXT)
+    await persistence.update_user_data(USER_ID, {'absence_type': 'absence_vacation'})
+    await persistence.flush()
+
+def test_conversation_and_user_data_survive_restart(store):
+    asyncio.run(_start_absence_dialog(PostgresPersistence(update_interval=60)))
+
+    restarted = PostgresPersistence(update_interval=60)
+    assert asyncio.run(restarted.get_conversations('absence')) == {(CHAT_ID, USER_ID): GET_DATES_TEXT}
+    assert asyncio.run(restarted.get_user_data()) == {USER_ID: {'absence_type': 'absence_vacation'}}
+
+def test_finished_conversation_is_deleted(store):
+    async def scenario():
+        persistence = PostgresPersistence(update_interval=60)
+        await _start_absence_dialog(persistence)
+        await persistence.update_conversation('absence', (CHAT_ID, USER_ID), None)
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert ('conversation:absence', json.dumps([CHAT_ID, USER_ID])) not in store
+    assert asyncio.run(PostgresPersistence(update_interval=60).get_conversations('absence')) == {}
+
+def test_unchanged_user_data_is_not_written_again(store, monkeypatch):
+    asyncio.run(_start_absence_dialog(PostgresPersistence(update_interval=60)))
+    batches = []
+    monkeypatch.setattr(db, 'save_persistence_batch', batches.append)
+
+    async def scenario():
+        persistence = PostgresPersistence(update_interval=60)
+        await persistence.get_user_data()
+        await persistence.update_user_data(USER_ID, {'absence_type': 'absence_vacation'})
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert batches == []
+
+def test_dates_message_after_restart_reaches_process_dates_text(store, monkeypatch):
+    """Новый Application с той же persistence принимает даты, отправленные уже после перезапуска."""
+    asyncio.run(_start_absence_dialog(PostgresPersistence(update_interval=60)))
+
+    sent, absences = [], []
+
+    async def get_me(self, *args, **kwargs):
+        return User(id=1, first_name='bot', is_bot=True, username='hr_time_bot')
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        sent.append((chat_id, text))
+
+    async def get_main_menu(user_id):
+        return None
+
+    monkeypatch.setattr(ExtBot, 'get_me', get_me)
+    monkeypatch.setattr(ExtBot, 'send_message', send_message)
+    monkeypatch.setattr(MenuGenerator, 'get_main_menu', staticmethod(get_main_menu))
+    monkeypatch.setattr(db, 'get_user', lambda user_id: {'user_id': user_id, 'full_name': 'Сотрудник', 'manager_id_1': None, 'manager_id_2': None})
+    monkeypatch.setattr(db, 'add_absence', lambda *args: absences.append(args))
+
+    # Новый объект диалога с теми же обработчиками: в модульном absence_conv_handler могут остаться
+    # состояния из памяти, а проверить нужно именно восстановление из хранилища
+    dialog = ConversationHandler(entry_points=absence_conv_handler.entry_points, states=absence_conv_handler.states,
+                                 fallbacks=absence_conv_handler.fallbacks, per_message=False, name='absence', persistent=True)
+
+    async def scenario():
+        application = Application.builder().token('123:TEST').persistence(PostgresPersistence(update_interval=60)).build()
+        application.add_handler(dialog)
+        async with application:
+            update = Update.de_json({
+                'update_id': 1,
+                'message': {'message_id': 10, 'date': 0, 'text': '01.11.2026 - 05.11.2026',
+                            'chat': {'id': CHAT_ID, 'type': 'private'},
+                            'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Сотрудник'}},
+            }, application.bot)
+            await application.process_update(update)
+
+    asyncio.run(scenario())
+
+    assert absences == [(USER_ID, 'Отпуск', datetime.date(2026, 11, 1), datetime.date(2026, 11, 5))]
+    assert any('успешно зарегистрирован' in text for _, text in sent)
+    # Диалог завершен, и при остановке приложения это записано в хранилище
+    assert ('conversation:absence', json.dumps([CHAT_ID, USER_ID])) not in store
+
+def test_save_batch_sql(sql):
+    """Одна транзакция: upsert всех новых значений и удаление ключей со значением None."""
+    db.save_persistence_batch({
+        ('user_data', '42'): '{"absence_type": "absence_vacation"}',
+        ('conversation:absence', '[42, 42]'): None,
+    })
+
+    assert sql.connections == 1
+    (upsert, upsert_params), (delete, delete_params) = sql.statements
+    assert upsert.startswith("INSERT INTO bot_persistence (namespace, key, value) VALUES %s")
+    assert "ON CONFLICT (namespace, key) DO UPDATE SET value = EXCLUDED.value, updated_at = now()" in upsert
+    assert upsert_params == {'values': [('user_data', '42', '{"absence_type": "absence_vacation"}')], 'template': "(%s, %s, %s::jsonb)"}
+    assert delete.startswith("DELETE FROM bot_persistence p USING unnest(%s::text[], %s::text[])")
+    assert delete_params == (['conversation:absence'], ['[42, 42]'])
+
+def _stored_rows(pg):
+    with pg.db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT namespace, key, value FROM bot_persistence ORDER BY namespace, key")
+            return cursor.fetchall()
+
+def test_write_behind_against_real_table(pg, monkeypatch):
+    """Upsert, пропуск неизменившихся значений и удаление на настоящей таблице bot_persistence."""
+    user_data = {'absence_type': 'absence_vacation', 'since': datetime.date(2026, 11, 1), 'ids': [3, 1]}
+    asyncio.run(_start_absence_dialog(PostgresPersistence(update_interval=60)))
+
+    async def update_user_data(persistence, data):
+        await persistence.update_user_data(USER_ID, data)
+        await persistence.flush()
+
+    # Повторная запись тех же данных обновляет строку, а не добавляет новую
+    asyncio.run(update_user_data(PostgresPersistence(update_interval=60), user_data))
+    assert _stored_rows(pg) == [
+        ('conversation:absence', json.dumps([CHAT_ID, USER_ID]), GET_DATES_TEXT),
+        ('user_data', str(USER_ID), {'absence_type': 'absence_vacation', 'since': '2026-11-01', 'ids': [3, 1]}),
+    ]
+
+    batches = []
+    save_persistence_batch = pg.save_persistence_batch
+    monkeypatch.setattr(pg, 'save_persistence_batch', lambda changes: (batches.append(dict(changes)), save_persistence_batch(changes)))
+
+    async def restart_and_finish(data):
+        persistence = PostgresPersistence(update_interval=60)
+        restored = await persistence.get_user_data()
+        await persistence.get_conversations('absence')
+        # Значение, прочитанное из JSONB, совпадает с тем, что пишет Application: записи нет
+        await update_user_data(persistence, data)
+        unchanged_batches = len(batches)
+        await persistence.update_conversation('absence', (CHAT_ID, USER_ID), None)
+        await update_user_data(persistence, {})
+        return restored, unchanged_batches
+
+    restored, unchanged_batches = asyncio.run(restart_and_finish(user_data))
+    assert restored[USER_ID]['since'] == '2026-11-01'
+    assert unchanged_batches == 0
+    assert len(batches) == 1
+    assert _stored_rows(pg) == [('user_data', str(USER_ID), {})]
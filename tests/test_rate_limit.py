@@ -0,0 +1,27 @@
+# Проверки ограничения частоты: выбор роли по кэшу профилей не влияет на его статистику.
+
+import rate_limit
+from config import CONFIG
+from state_cache import StateCache
+
+def test_role_for_does_not_count_cache_hits(monkeypatch):
+    cache = StateCache()
+    monkeypatch.setattr(rate_limit, 'state_cache', cache)
+    cache.put_user(1, {'user_id': 1, 'role': 'employee'})
+    cache.put_user(2, {'user_id': 2, 'role': 'manager'})
+
+    assert rate_limit.role_for(1) == 'employee'
+    assert rate_limit.role_for(2) == 'manager'
+    assert rate_limit.role_for(3) == 'manager'
+    assert rate_limit.role_for(CONFIG.ADMIN_IDS[0]) == 'admin'
+    assert cache.stats()['hits'] == 0 and cache.stats()['misses'] == 0
+
+def test_token_bucket_warns_once_per_throttled_streak(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: now[0])
+    buckets = rate_limit.TokenBuckets({'employee': (1.0, 2)}, max_entries=10)
+
+    assert [buckets.take(1, 'employee') for _ in range(4)] == [(True, False), (True, False), (False, True), (False, False)]
+    now[0] += 1.0
+    assert buckets.take(1, 'employee') == (True, False)
+    assert buckets.shed == {'employee': 2}
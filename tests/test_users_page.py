@@ -0,0 +1,64 @@
+# Проверки постраничного списка /users: возврат из карточки пользователя на первую страницу.
+
+import asyncio
+from types import SimpleNamespace
+
+import database as db
+from command_handlers import CommandHandlerManager
+
+USERS = [{'user_id': user_id, 'full_name': f"Сотрудник {user_id:02d}", 'role': 'employee'} for user_id in range(1, 8)]
+
+def fake_get_users_page(role, anchor_id, direction, limit):
+    """Та же семантика якоря, что у database.get_users_page, на списке в памяти."""
+    if anchor_id is None:
+        rows = USERS[:limit + 1]
+    else:
+        index = next(i for i, user in enumerate(USERS) if user['user_id'] == anchor_id)
+        if direction == 'a':
+            rows = USERS[index:index + limit + 1]
+        elif direction == 'n':
+            rows = USERS[index + 1:index + 1 + limit + 1]
+        else:
+            rows = USERS[max(0, index - limit - 1):index]
+    return list(rows)
+
+def render(monkeypatch, data=None):
+    """Показывает страницу (по команде или по callback_data) и возвращает клавиатуру."""
+    monkeypatch.setattr(db, 'get_users_page', fake_get_users_page)
+    shown = {}
+
+    async def show(text, reply_markup=None):
+        shown['markup'] = reply_markup
+
+    if data is None:
+        update = SimpleNamespace(callback_query=None, message=SimpleNamespace(reply_text=show))
+        asyncio.run(CommandHandlerManager.show_users_page(update, 'all', 'a', None))
+    else:
+        _, _, role, direction, anchor = data.split('_')
+        update = SimpleNamespace(callback_query=SimpleNamespace(edit_message_text=show), message=None)
+        asyncio.run(CommandHandlerManager.show_users_page(update, role, direction, int(anchor) or None))
+    return shown['markup']
+
+def navigation(markup):
+    return {button.text: button.callback_data for button in markup.inline_keyboard[-1] if button.callback_data.startswith('users_page_')}
+
+def page_callback(markup):
+    return markup.inline_keyboard[0][0].callback_data.split('|', 1)[1]
+
+def test_back_to_first_page_has_no_prev_button(monkeypatch):
+    monkeypatch.setattr('config.CONFIG.USERS_PAGE_SIZE', 3)
+    first = render(monkeypatch)
+    assert "« Пред." not in navigation(first)
+
+    back = render(monkeypatch, page_callback(first))
+    assert "« Пред." not in navigation(back)
+    assert "След. »" in navigation(back)
+
+def test_back_to_later_page_keeps_prev_button(monkeypatch):
+    monkeypatch.setattr('config.CONFIG.USERS_PAGE_SIZE', 3)
+    second = render(monkeypatch, navigation(render(monkeypatch))["След. »"])
+    assert "« Пред." in navigation(second)
+
+    back = render(monkeypatch, page_callback(second))
+    assert "« Пред." in navigation(back)
+    assert [row[0].text for row in back.inline_keyboard[:3]] == [row[0].text for row in second.inline_keyboard[:3]]
@@ -0,0 +1,35 @@
+# Проверки пакетной рассылки: повтор после RetryAfter и запись неудачных отправок в лог.
+
+import asyncio
+import logging
+
+from telegram.error import Forbidden, RetryAfter
+
+import utils
+
+def test_send_messages_paced_retries_and_logs_failures(monkeypatch, caplog):
+    sleeps, sent = [], []
+    attempts = {}
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    class FakeBot:
+        async def send_message(self, chat_id, text):
+            attempts[chat_id] = attempts.get(chat_id, 0) + 1
+            if chat_id == 1 and attempts[chat_id] == 1:
+                raise RetryAfter(3)
+            if chat_id == 2:
+                raise Forbidden("bot was blocked by the user")
+            sent.append(chat_id)
+
+    monkeypatch.setattr(utils.asyncio, 'sleep', sleep)
+    messages = [{'chat_id': chat_id, 'text': 'текст'} for chat_id in (1, 2, 3)]
+    with caplog.at_level(logging.WARNING, logger=utils.logger.name):
+        done = asyncio.run(utils.send_messages_paced(FakeBot(), messages, batch_size=10))
+
+    assert done == 2
+    assert sent == [1, 3]
+    assert 3 in sleeps
+    failures = [record for record in caplog.records if 'в чат 2' in record.getMessage()]
+    assert len(failures) == 1 and failures[0].exc_info is not None
@@ -0,0 +1,80 @@
+# Файл: timezones.py
+# Этот модуль определяет часовой пояс сотрудника (личный -> пояс его офиса -> пояс из конфига)
+# и держит для каждого пояса заранее вычисленные границы текущих суток.
+
+import datetime
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import pytz
+
+from config import CONFIG, LOCAL_TZ
+from geofence import geofence_index
+
+logger = logging.getLogger(__name__)
+
+class TimezoneRegistry:
+    """
+    Кэш объектов часовых поясов и границ "сегодня" для каждого из них.
+    Границы пересчитываются лениво: первый вызов после локальной полуночи пояса
+    вычисляет новые сутки, остальные вызовы только сравнивают время с концом суток.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._zones: Dict[str, datetime.tzinfo] = {CONFIG.TIMEZONE: LOCAL_TZ}
+        self._days: Dict[str, Tuple[datetime.date, datetime.datetime, datetime.datetime]] = {}
+
+    @staticmethod
+    def is_valid(name: str) -> bool:
+        return name in pytz.all_timezones_set
+
+    def get(self, name: Optional[str]) -> datetime.tzinfo:
+        """Объект пояса по имени; пустое или неизвестное имя - пояс из конфига."""
+        if not name:
+            return LOCAL_TZ
+        tz = self._zones.get(name)
+        if tz is None:
+            try:
+                tz = pytz.timezone(name)
+            except pytz.UnknownTimeZoneError:
+                logger.warning("Неизвестный часовой пояс %s, используется %s.", name, CONFIG.TIMEZONE)
+                tz = LOCAL_TZ
+            self._zones[name] = tz
+        return tz
+
+    def for_user(self, user: Optional[dict]) -> datetime.tzinfo:
+        """Пояс сотрудника по строке users: личный, затем пояс закрепленного офиса, затем пояс из конфига."""
+        if not user:
+            return LOCAL_TZ
+        if user.get('timezone'):
+            return self.get(user['timezone'])
+        office = geofence_index.get(user['office_id']) if user.get('office_id') else None
+        return self.get(office.get('timezone') if office else None)
+
+    def bounds_for_date(self, tz: datetime.tzinfo, day: datetime.date) -> Tuple[datetime.datetime, datetime.datetime]:
+        """Начало и конец (начало следующих) суток day в поясе tz."""
+        start = tz.localize(datetime.datetime.combine(day, datetime.time.min))
+        end = tz.localize(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+        return start, end
+
+    def _current_day(self, tz: datetime.tzinfo) -> Tuple[datetime.date, datetime.datetime, datetime.datetime]:
+        key = tz.zone
+        cached = self._days.get(key)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if cached is None or now >= cached[2] or now < cached[1]:
+            today = now.astimezone(tz).date()
+            cached = (today, *self.bounds_for_date(tz, today))
+            with self._lock:
+                self._days[key] = cached
+        return cached
+
+    def today(self, tz: datetime.tzinfo) -> datetime.date:
+        return self._current_day(tz)[0]
+
+    def day_bounds(self, tz: datetime.tzinfo) -> Tuple[datetime.datetime, datetime.datetime]:
+        """Начало и конец текущих суток в поясе tz."""
+        return self._current_day(tz)[1:]
+
+timezones = TimezoneRegistry()
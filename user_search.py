@@ -0,0 +1,148 @@
+# Файл: user_search.py
+# Этот модуль держит в памяти индекс имен сотрудников для быстрого поиска по /find.
+
+import heapq
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+# Транслитерация, чтобы "ivanov" находил "Иванов" и наоборот
+_CYR_TO_LAT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's',
+    'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'iu', 'я': 'ia',
+}
+_TRANSLIT_TABLE = str.maketrans(_CYR_TO_LAT)
+
+FUZZY_MIN_OVERLAP = 0.4      # Доля общих триграмм запроса, чтобы кандидат вообще рассматривался
+FUZZY_MIN_SIMILARITY = 0.35  # Порог сходства для нечеткого совпадения
+FUZZY_STOP_GRAM_SHARE = 0.02 # Триграммы, встречающиеся у большей доли сотрудников, не используются для отбора
+FUZZY_STOP_GRAM_MIN = 200
+
+def normalize(text: str) -> str:
+    """Приводит строку к единому виду: регистр, ё -> е, латиница вместо кириллицы."""
+    return text.casefold().replace('ё', 'е').translate(_TRANSLIT_TABLE)
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class UserSearchIndex:
+    """
+    Индекс имен: отсортированный список слов для поиска по префиксу
+    и инвертированный индекс триграмм для нечеткого поиска.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names: Dict[int, str] = {}
+        self._tokens: Dict[int, List[str]] = {}
+        self._sorted_tokens: List[Tuple[str, int]] = []
+        self._trigrams: Dict[str, Set[int]] = defaultdict(set)
+        self._token_grams: Dict[int, List[Set[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def build(self, users: List[dict]):
+        """Полностью перестраивает индекс по списку пользователей (user_id, full_name)."""
+        with self._lock:
+            self._names.clear(); self._tokens.clear(); self._trigrams.clear(); self._token_grams.clear()
+            self._sorted_tokens = []
+            for user in users:
+                self._add_locked(user['user_id'], user['full_name'], keep_sorted=False)
+            self._sorted_tokens.sort()
+
+    def upsert(self, user_id: int, full_name: str):
+        with self._lock:
+            self._remove_locked(user_id)
+            self._add_locked(user_id, full_name, keep_sorted=True)
+
+    def remove(self, user_id: int):
+        with self._lock:
+            self._remove_locked(user_id)
+
+    def _add_locked(self, user_id: int, full_name: str, keep_sorted: bool):
+        tokens = normalize(full_name).split()
+        self._names[user_id] = full_name
+        self._tokens[user_id] = tokens
+        token_grams = []
+        for token in tokens:
+            if keep_sorted:
+                position = bisect_left(self._sorted_tokens, (token, user_id))
+                self._sorted_tokens.insert(position, (token, user_id))
+            else:
+                self._sorted_tokens.append((token, user_id))
+            token_grams.append(trigrams(token))
+        for gram in set().union(*token_grams):
+            self._trigrams[gram].add(user_id)
+        self._token_grams[user_id] = token_grams
+
+    def _remove_locked(self, user_id: int):
+        tokens = self._tokens.pop(user_id, None)
+        if tokens is None:
+            return
+        self._names.pop(user_id, None)
+        for token in tokens:
+            position = bisect_left(self._sorted_tokens, (token, user_id))
+            if position < len(self._sorted_tokens) and self._sorted_tokens[position] == (token, user_id):
+                del self._sorted_tokens[position]
+            for gram in trigrams(token):
+                ids = self._trigrams.get(gram)
+                if ids is not None:
+                    ids.discard(user_id)
+                    if not ids:
+                        del self._trigrams[gram]
+        self._token_grams.pop(user_id, None)
+
+    def search(self, text: str, limit: int = 10, allowed_ids: Optional[Set[int]] = None) -> List[Tuple[int, str]]:
+        """
+        Ищет сотрудников по тексту: по префиксам всех слов запроса, а если таких нет -
+        нечетко по триграммам: кандидаты отбираются по инвертированному индексу,
+        а оценка - среднее по словам запроса лучшее сходство Жаккара с одним из слов имени.
+        """
+        query_tokens = normalize(text).split()
+        if not query_tokens:
+            return []
+        with self._lock:
+            prefix_hits = None
+            for token in query_tokens:
+                ids = set()
+                position = bisect_left(self._sorted_tokens, (token, -1))
+                while position < len(self._sorted_tokens) and self._sorted_tokens[position][0].startswith(token):
+                    ids.add(self._sorted_tokens[position][1])
+                    position += 1
+                prefix_hits = ids if prefix_hits is None else prefix_hits & ids
+            if allowed_ids is not None:
+                prefix_hits &= allowed_ids
+            results = heapq.nsmallest(limit, prefix_hits, key=lambda user_id: self._names[user_id])
+
+            if not results:
+                query_token_grams = [trigrams(token) for token in query_tokens]
+                query_grams = set().union(*query_token_grams)
+                # Для отбора кандидатов берем только редкие триграммы: частые вроде "ов " есть почти у всех
+                postings = sorted((self._trigrams[gram] for gram in query_grams if gram in self._trigrams), key=len)
+                max_posting = max(FUZZY_STOP_GRAM_MIN, int(len(self._names) * FUZZY_STOP_GRAM_SHARE))
+                selective = [ids for ids in postings if len(ids) <= max_posting] or postings[:1]
+                overlap = defaultdict(int)
+                for ids in selective:
+                    for user_id in ids:
+                        overlap[user_id] += 1
+                min_common = max(1, int(len(selective) * FUZZY_MIN_OVERLAP))
+                scored = []
+                for user_id, common in overlap.items():
+                    if common < min_common or (allowed_ids is not None and user_id not in allowed_ids):
+                        continue
+                    similarity = sum(
+                        max(len(q & t) / len(q | t) for t in self._token_grams[user_id])
+                        for q in query_token_grams
+                    ) / len(query_token_grams)
+                    if similarity >= FUZZY_MIN_SIMILARITY:
+                        scored.append((-similarity, self._names[user_id], user_id))
+                scored.sort()
+                results = [user_id for _, _, user_id in scored[:limit]]
+            return [(user_id, self._names[user_id]) for user_id in results]
+
+user_search_index = UserSearchIndex()
@@ -1,19 +1,33 @@
 # Файл: utils.py
+import asyncio
 import datetime
+import re
 import time
 import logging
 from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
 from telegram import Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import ContextTypes
 from config import CONFIG, LOCAL_TZ
+from timezones import timezones
+from work_calendar import work_calendar
 import database as db
 
 logger = logging.getLogger(__name__)
 
 # --- Общие утилиты ---
-def get_now() -> datetime.datetime:
-    """Возвращает текущее время с учетом таймзоны из конфига."""
-    return datetime.datetime.now(LOCAL_TZ)
+def get_now(tz: datetime.tzinfo = None) -> datetime.datetime:
+    """Возвращает текущее время в поясе tz (по умолчанию - в таймзоне из конфига)."""
+    return datetime.datetime.now(tz or LOCAL_TZ)
+
+def get_user_tz(user_id: int) -> datetime.tzinfo:
+    """Часовой пояс сотрудника: личный, затем пояс его офиса, затем из конфига."""
+    return timezones.for_user(db.get_user(user_id))
+
+def get_user_today(user_id: int) -> datetime.date:
+    """Сегодняшняя дата в поясе сотрудника (границы суток кэшируются до полуночи)."""
+    return timezones.today(get_user_tz(user_id))
 
 def seconds_to_str(seconds: int) -> str:
     """Конвертирует секунды в читаемый формат 'X ч Y мин'."""
@@ -23,6 +37,112 @@ def seconds_to_str(seconds: int) -> str:
     minutes = int((seconds % 3600) // 60)
     return f"{hours} ч {minutes} мин"
 
+def get_month_bounds(day: datetime.date) -> Tuple[datetime.date, datetime.date]:
+    """Возвращает первый и последний день месяца, в который попадает day."""
+    start_date = day.replace(day=1)
+    next_month = start_date.replace(day=28) + datetime.timedelta(days=4)
+    return start_date, next_month - datetime.timedelta(days=next_month.day)
+
+def parse_dates(text: str) -> List[datetime.date]:
+    """Находит в тексте все даты формата ДД.ММ.ГГГГ (или ДД.ММ.ГГ)."""
+    found_dates = re.findall(r'\b(\d{1,2})\.(\d{1,2})\.(\d{2,4})\b', text)
+    return [datetime.date(int(y if len(y)==4 else f"20{y}"), int(m), int(d)) for d, m, y in found_dates]
+
+def get_daily_norm_seconds(user_id: int, at: datetime.datetime = None) -> int:
+    """Норма на день (по умолчанию - сегодня) по календарю и графику сотрудника; 0 - нерабочий день."""
+    user = db.get_user(user_id)
+    tz = timezones.for_user(user)
+    day = at.astimezone(tz).date() if at else timezones.today(tz)
+    return work_calendar.day_seconds_for(day, user)
+
+def format_time_bank_entry(entry: Dict[str, Any], tz: datetime.tzinfo) -> str:
+    """Строка журнала банка времени: дата, сумма со знаком и причина."""
+    sign = '+' if entry['delta_seconds'] >= 0 else '-'
+    reason = CONFIG.TIME_BANK_REASON_MAP.get(entry['reason'], entry['reason'])
+    return f"{entry['created_at'].astimezone(tz).strftime('%d.%m %H:%M')} {sign}{seconds_to_str(abs(entry['delta_seconds']))} - {reason}"
+
+def get_day_start(day: datetime.date, tz: datetime.tzinfo = None) -> datetime.datetime:
+    """Возвращает начало суток (00:00) для даты в поясе tz (по умолчанию - в таймзоне из конфига)."""
+    return timezones.bounds_for_date(tz or LOCAL_TZ, day)[0]
+
+def _utf16_len(text: str) -> int:
+    """Длина строки так, как ее считает Telegram (в единицах UTF-16)."""
+    return len(text.encode('utf-16-le')) // 2
+
+def split_message(text: str, limit: int = None) -> List[str]:
+    """
+    Делит длинный текст на части не длиннее limit по границам строк,
+    чтобы разметка Markdown внутри каждой строки оставалась целой.
+    Слишком длинная одиночная строка режется по символам.
+    """
+    limit = limit or CONFIG.MESSAGE_CHUNK_LIMIT
+    chunks, current, current_len = [], [], 0
+    for line in text.split('\n'):
+        line_len = _utf16_len(line)
+        while line_len > limit:
+            if current:
+                chunks.append('\n'.join(current))
+                current, current_len = [], 0
+            cut = limit
+            while _utf16_len(line[:cut]) > limit:
+                cut -= 1
+            chunks.append(line[:cut])
+            line = line[cut:]
+            line_len = _utf16_len(line)
+        added_len = line_len + (1 if current else 0)
+        if current and current_len + added_len > limit:
+            chunks.append('\n'.join(current))
+            current, current_len = [line], line_len
+        else:
+            current.append(line)
+            current_len += added_len
+    if current and any(part.strip() for part in current):
+        chunks.append('\n'.join(current))
+    return chunks
+
+async def send_long_message(bot, chat_id: int, text: str, reply_markup=None, parse_mode: str = 'Markdown') -> int:
+    """Отправляет текст частями с паузами; клавиатура прикрепляется к последней части."""
+    chunks = split_message(text)
+    messages = [{'chat_id': chat_id, 'text': chunk, 'parse_mode': parse_mode} for chunk in chunks]
+    if messages and reply_markup is not None:
+        messages[-1]['reply_markup'] = reply_markup
+    return await send_messages_paced(bot, messages, batch_size=CONFIG.LONG_MESSAGE_BATCH_SIZE)
+
+async def _call_paced(method, calls: List[Dict[str, Any]], batch_size: int = None, delay: float = None) -> int:
+    """
+    Выполняет вызовы Bot API пачками с паузой между ними, чтобы не упираться в лимиты Telegram API.
+    Каждый элемент calls - это именованные аргументы для method. Возвращает количество успешных вызовов.
+    """
+    batch_size = batch_size or CONFIG.NOTIFY_BATCH_SIZE
+    delay = CONFIG.NOTIFY_BATCH_DELAY_SECONDS if delay is None else delay
+    done = 0
+    for i in range(0, len(calls), batch_size):
+        if i > 0:
+            await asyncio.sleep(delay)
+        for call in calls[i:i + batch_size]:
+            try:
+                await method(**call)
+                done += 1
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, datetime.timedelta) else e.retry_after
+                await asyncio.sleep(retry_after)
+                try:
+                    await method(**call)
+                    done += 1
+                except TelegramError as retry_error:
+                    logger.warning("Не удалось отправить сообщение в чат %s: %s", call.get('chat_id'), retry_error, exc_info=True)
+            except TelegramError as e:
+                logger.warning("Не удалось отправить сообщение в чат %s: %s", call.get('chat_id'), e, exc_info=True)
+    return done
+
+async def send_messages_paced(bot, messages: List[Dict[str, Any]], batch_size: int = None, delay: float = None) -> int:
+    """Рассылает сообщения пачками (элементы messages - аргументы bot.send_message)."""
+    return await _call_paced(bot.send_message, messages, batch_size, delay)
+
+async def edit_messages_paced(bot, edits: List[Dict[str, Any]], batch_size: int = None, delay: float = None) -> int:
+    """Редактирует ранее отправленные сообщения пачками (элементы edits - аргументы bot.edit_message_text)."""
+    return await _call_paced(bot.edit_message_text, edits, batch_size, delay)
+
 # --- Декораторы ---
 def admin_only(func):
     """Декоратор, ограничивающий доступ к функции только для администраторов."""
@@ -30,7 +150,7 @@ def admin_only(func):
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user_id = update.effective_user.id
         if user_id not in CONFIG.ADMIN_IDS:
-            logger.warning(f"Несанкционированная попытка доступа от {user_id} к {func.__name__}")
+            logger.warning("Несанкционированная попытка доступа от %s к %s", user_id, func.__name__)
             if update.message:
                 await update.message.reply_text("У вас нет доступа к этой команде.")
             elif update.callback_query:
@@ -39,14 +159,18 @@ def admin_only(func):
         return await func(update, context, *args, **kwargs)
     return wrapper
 
-async def end_workday_logic(context: ContextTypes.DEFAULT_TYPE, user_id: int, is_early_leave: bool = False, forgive_debt: bool = False, used_bank_time: int = 0):
-    """Универсальная логика завершения рабочего дня."""
+async def end_workday_logic(context: ContextTypes.DEFAULT_TYPE, user_id: int, is_early_leave: bool = False, forgive_debt: bool = False,
+                            used_bank_time: int = 0, notify: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Универсальная логика завершения рабочего дня. Возвращает сообщение сотруднику (аргументы send_message);
+    при notify=False оно не отправляется, а отдается вызывающему для общей рассылки.
+    """
     # Локальный импорт для избежания циклов зависимостей
     from menu_generator import MenuGenerator
     
     session_state = db.get_session_state(user_id)
     if not session_state or session_state.get('status') != 'working':
-        logger.warning(f"Попытка завершить день для user_id {user_id} без активной сессии 'working'.")
+        logger.warning("Попытка завершить день для user_id %s без активной сессии 'working'.", user_id)
         return
 
     start_time = session_state['start_time']
@@ -55,13 +179,15 @@ async def end_workday_logic(context: ContextTypes.DEFAULT_TYPE, user_id: int, is
     work_duration_seconds = (end_time - start_time).total_seconds() - total_break_seconds
     work_type = "remote" if session_state.get('is_remote') else "office"
     
-    db.add_work_log(user_id, start_time, end_time, int(work_duration_seconds), total_break_seconds, work_type)
+    log_id = db.add_work_log(user_id, start_time, end_time, int(work_duration_seconds), total_break_seconds, work_type, session_state.get('office_id'))
     
     # Начисление в банк времени за неиспользованные перерывы
     if not is_early_leave:
         unused_break_time = CONFIG.DAILY_BREAK_LIMIT_SECONDS - total_break_seconds
         if unused_break_time > 0:
-            db.update_time_bank(user_id, unused_break_time)
+            db.update_time_bank(user_id, unused_break_time, 'unused_break', f"work_log:{log_id}")
+    elif used_bank_time > 0:
+        db.update_time_bank(user_id, -int(used_bank_time), 'early_leave', f"work_log:{log_id}")
 
     db.delete_session_state(user_id)
     
@@ -72,18 +198,21 @@ async def end_workday_logic(context: ContextTypes.DEFAULT_TYPE, user_id: int, is
     if used_bank_time > 0:
         message_text += f"\nИз банка времени списано: {seconds_to_str(int(used_bank_time))}."
     elif is_early_leave and not forgive_debt:
-        debt_seconds = CONFIG.MIN_WORK_SECONDS - work_duration_seconds
+        debt_seconds = get_daily_norm_seconds(user_id, start_time) - work_duration_seconds
         if debt_seconds > 0:
             db.add_work_debt(user_id, int(debt_seconds))
             debt_str = seconds_to_str(debt_seconds)
             message_text += f"\n\nВам начислена отработка: **{debt_str}**."
     
     main_menu_markup = await MenuGenerator.get_main_menu(user_id)
-    await context.bot.send_message(user_id, message_text, reply_markup=main_menu_markup, parse_mode='Markdown')
+    message = {'chat_id': user_id, 'text': message_text, 'reply_markup': main_menu_markup, 'parse_mode': 'Markdown'}
+    if notify:
+        await context.bot.send_message(**message)
+    return message
 
    
     # Геолокация
-async def start_work_logic(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, is_remote: bool):
+async def start_work_logic(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, is_remote: bool, office: Dict[str, Any] = None):
     """Универсальная логика для начала рабочего дня."""
     from menu_generator import MenuGenerator # Локальный импорт для избежания циклов
 
@@ -91,10 +220,14 @@ async def start_work_logic(update: Update, context: ContextTypes.DEFAULT_TYPE, u
         await update.effective_message.reply_text("Вы не можете начать новый день, пока не завершите текущую сессию.")
         return
 
-    new_state = {'status': 'working', 'start_time': get_now(), 'total_break_seconds': 0, 'is_remote': is_remote}
+    new_state = {'status': 'working', 'start_time': get_now(get_user_tz(user_id)), 'total_break_seconds': 0, 'is_remote': is_remote}
+    if office:
+        new_state['office_id'] = office['office_id']
     db.set_session_state(user_id, new_state)
     
     message_text = f"Рабочий день начат в {new_state['start_time'].strftime('%H:%M:%S')}."
+    if office:
+        message_text += f"\nОфис: {office['name']}."
     if hasattr(update, 'callback_query') and update.callback_query:
         await update.callback_query.edit_message_text(text=message_text, reply_markup=MenuGenerator.get_working_menu())
     else:
@@ -0,0 +1,165 @@
+# Файл: work_calendar.py
+# Производственный календарь: рабочие дни и их длительность по годам,
+# а также расчет нормы рабочего времени за период через префиксные суммы.
+
+import datetime
+import json
+import logging
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Нерабочие праздничные дни (ст. 112 ТК РФ): (месяц, день)
+FIXED_HOLIDAYS = [(1, 1), (1, 2), (1, 3), (1, 4), (1, 5), (1, 6), (1, 7), (1, 8),
+                  (2, 23), (3, 8), (5, 1), (5, 9), (6, 12), (11, 4)]
+
+def _prefix(values: Iterable[int]) -> array:
+    """prefix[i] - сумма первых i значений; сумма по отрезку [a, b] = prefix[b + 1] - prefix[a]."""
+    result = array('q', [0])
+    total = 0
+    for value in values:
+        total += value
+        result.append(total)
+    return result
+
+class CalendarYear:
+    """
+    Календарь одного года, индекс дня - номер дня от 1 января.
+    lengths - норма секунд по производственному календарю (0 - выходной или праздник);
+    base - норма дня без учета выходных недели (0 только в праздники), нужна для индивидуальных графиков.
+    Для base хранится отдельная префиксная сумма по каждому дню недели.
+    """
+
+    def __init__(self, year: int, lengths: array, base: array):
+        self.year = year
+        self.first_day = datetime.date(year, 1, 1)
+        self.lengths = lengths
+        self.base = base
+        self.prefix = _prefix(lengths)
+        first_weekday = self.first_day.weekday()
+        self.weekday_prefix = [
+            _prefix(value if (first_weekday + index) % 7 == weekday else 0 for index, value in enumerate(base))
+            for weekday in range(7)
+        ]
+
+    def index(self, day: datetime.date) -> int:
+        return (day - self.first_day).days
+
+    def range_seconds(self, first: int, last: int, weekdays: Optional[str] = None) -> int:
+        """Норма за дни [first, last]; weekdays - строка ISO-дней недели графика ('135'), None - календарь."""
+        if weekdays is None:
+            return self.prefix[last + 1] - self.prefix[first]
+        return sum(self.weekday_prefix[int(weekday) - 1][last + 1] - self.weekday_prefix[int(weekday) - 1][first] for weekday in weekdays)
+
+class WorkCalendar:
+    """
+    Производственный календарь с ленивым построением лет.
+    Файл календаря (JSON) задает для года отличия от правил по умолчанию:
+        {"2026": {"holidays": ["2026-01-09", ...],      # дополнительные выходные (переносы)
+                  "working_days": ["2026-11-01", ...],  # рабочие субботы/воскресенья
+                  "short_days": ["2026-02-20", ...]}}   # сокращенные предпраздничные дни
+    Без файла год строится по правилам: пн-пт рабочие, кроме праздников из FIXED_HOLIDAYS,
+    день перед праздником сокращен на short_day_reduction секунд.
+    """
+
+    def __init__(self, day_seconds: int, short_day_reduction: int):
+        self.day_seconds = day_seconds
+        self.short_day_reduction = short_day_reduction
+        self._lock = threading.Lock()
+        self._overrides: Dict[int, dict] = {}
+        self._years: Dict[int, CalendarYear] = {}
+
+    def load(self, path: str):
+        """Загружает отличия календаря из файла; отсутствие файла не ошибка."""
+        overrides = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                overrides = {int(year): data for year, data in json.load(f).items()}
+            logger.info("Производственный календарь загружен из %s: годы %s.", path, sorted(overrides))
+        else:
+            logger.info("Файл календаря %s не найден, используются правила по умолчанию.", path)
+        with self._lock:
+            self._overrides = overrides
+            self._years = {}
+
+    @staticmethod
+    def _dates(values: Iterable[str]) -> Set[datetime.date]:
+        return {datetime.date.fromisoformat(value) for value in values}
+
+    def _build_year(self, year: int) -> CalendarYear:
+        overrides = self._overrides.get(year, {})
+        holidays = {datetime.date(year, month, day) for month, day in FIXED_HOLIDAYS} | self._dates(overrides.get('holidays', []))
+        working_days = self._dates(overrides.get('working_days', []))
+        explicit_short_days = 'short_days' in overrides
+        short_days = self._dates(overrides.get('short_days', []))
+
+        lengths, base = array('i'), array('i')
+        day = datetime.date(year, 1, 1)
+        while day.year == year:
+            if day in holidays:
+                lengths.append(0)
+                base.append(0)
+            else:
+                is_short = day in short_days if explicit_short_days else (day + datetime.timedelta(days=1)) in holidays
+                length = self.day_seconds - (self.short_day_reduction if is_short else 0)
+                lengths.append(length if day.weekday() < 5 or day in working_days else 0)
+                base.append(length)
+            day += datetime.timedelta(days=1)
+        return CalendarYear(year, lengths, base)
+
+    def _year(self, year: int) -> CalendarYear:
+        calendar_year = self._years.get(year)
+        if calendar_year is None:
+            calendar_year = self._build_year(year)
+            with self._lock:
+                self._years[year] = calendar_year
+        return calendar_year
+
+    @staticmethod
+    def user_schedule(user: Optional[dict]) -> Tuple[float, Optional[str]]:
+        """Ставка и дни недели графика сотрудника (None - по производственному календарю)."""
+        if not user:
+            return 1.0, None
+        return float(user.get('work_rate') or 1.0), user.get('work_weekdays') or None
+
+    def day_seconds_for(self, day: datetime.date, user: Optional[dict] = None) -> int:
+        """Норма секунд на день day для сотрудника (0 - нерабочий день)."""
+        rate, weekdays = self.user_schedule(user)
+        calendar_year = self._year(day.year)
+        index = calendar_year.index(day)
+        if weekdays is None:
+            seconds = calendar_year.lengths[index]
+        else:
+            seconds = calendar_year.base[index] if str(day.isoweekday()) in weekdays else 0
+        return int(seconds * rate)
+
+    def is_working_day(self, day: datetime.date, user: Optional[dict] = None) -> bool:
+        return self.day_seconds_for(day, user) > 0
+
+    def expected_seconds(self, start_date: datetime.date, end_date: datetime.date, rate: float = 1.0, weekdays: Optional[str] = None) -> int:
+        """Норма за период [start_date, end_date]: по две выборки из префиксных сумм на каждый затронутый год."""
+        if end_date < start_date:
+            return 0
+        total = 0
+        for year in range(start_date.year, end_date.year + 1):
+            calendar_year = self._year(year)
+            first = calendar_year.index(max(start_date, datetime.date(year, 1, 1)))
+            last = calendar_year.index(min(end_date, datetime.date(year, 12, 31)))
+            total += calendar_year.range_seconds(first, last, weekdays)
+        return int(total * rate)
+
+    def expected_for_user(self, user: Optional[dict], start_date: datetime.date, end_date: datetime.date,
+                          absences: Iterable[Tuple[datetime.date, datetime.date]] = ()) -> int:
+        """Норма сотрудника за период за вычетом дней отсутствий (отпуск, больничный)."""
+        rate, weekdays = self.user_schedule(user)
+        total = self.expected_seconds(start_date, end_date, rate, weekdays)
+        for absence_start, absence_end in absences:
+            total -= self.expected_seconds(max(absence_start, start_date), min(absence_end, end_date), rate, weekdays)
+        return max(total, 0)
+
+work_calendar = WorkCalendar(CONFIG.MIN_WORK_SECONDS, CONFIG.SHORT_DAY_REDUCTION_SECONDS)